@@ -0,0 +1,461 @@
+"""
+Transmissão dos anúncios do scanner pela rede local (TCP ou socket Unix).
+
+O AdvertStreamServer recebe cada anúncio do BeaconScanner (parâmetro
+stream=) e, a cada flush_interval, envia o lote acumulado aos assinantes
+conectados, já filtrado pelo que cada um pediu. Tudo roda no laço asyncio
+do scanner: push() só acrescenta a arrays compactos e o envio nunca espera
+pelo cliente. Assinante lento (buffer de saída acima de max_buffer) perde
+lotes, que são contados e informados num quadro DROPPED; se continuar
+atrasado por mais de drop_after segundos, é desconectado.
+
+Protocolo (little-endian). Cada quadro é u32 tamanho + payload, e o
+primeiro byte do payload é o tipo:
+
+    Servidor -> cliente
+        HELLO    0x01  versão u16, flush_interval f64
+        DEVICE   0x02  id u32, MAC (u8 tamanho + ASCII), nome (u16 tamanho + UTF-8)
+        BATCH    0x03  instante base f64, nº de registros u32 e os registros:
+                       id u32, deslocamento em µs desde a base u32, RSSI i8 (9 bytes)
+        DROPPED  0x04  registros descartados u64 desde o último aviso
+    Cliente -> servidor
+        SUBSCRIBE 0x10 JSON com filtros opcionais: {"macs": [...], "mac_prefix": "AA:BB",
+                       "min_rssi": -80, "max_rssi": -30}; sem filtros recebe tudo
+
+Um DEVICE é enviado antes do primeiro registro de cada dispositivo (e de
+novo quando o nome muda), então os lotes carregam só o id numérico.
+
+Uso:
+    stream = AdvertStreamServer(port=8765)          # ou path="/tmp/radar.sock"
+    scanner = BeaconScanner(stream=stream)
+    await stream.start(); await scanner.start()     # no mesmo laço asyncio
+
+    client = AdvertStreamClient.connect(port=8765, min_rssi=-80)
+    for timestamp, mac, nome, rssi in client.records(): ...
+"""
+import asyncio
+import json
+import socket
+import struct
+import time
+from array import array
+
+import numpy as np
+
+VERSION = 1
+FRAME = struct.Struct("<I")
+HELLO, DEVICE, BATCH, DROPPED, SUBSCRIBE = 0x01, 0x02, 0x03, 0x04, 0x10
+HELLO_BODY = struct.Struct("<BHd")
+BATCH_HEADER = struct.Struct("<BdI")
+DROPPED_BODY = struct.Struct("<BQ")
+RECORD = np.dtype([("id", "<u4"), ("offset", "<u4"), ("rssi", "i1")])
+MAX_FRAME = 64 * 1024 * 1024
+
+
+def _frame(payload):
+    return FRAME.pack(len(payload)) + payload
+
+
+def _device_frame(dev, mac, nome):
+    mac_bytes = mac.encode("ascii", "replace")
+    name_bytes = nome.encode("utf-8")[:0xFFFF]
+    return _frame(struct.pack("<BIB", DEVICE, dev, len(mac_bytes)) + mac_bytes +
+                  struct.pack("<H", len(name_bytes)) + name_bytes)
+
+
+class _Subscriber:
+    """Conexão de um assinante: filtros, dispositivos já anunciados e contagem de descartes."""
+    __slots__ = ("writer", "macs", "mac_prefix", "min_rssi", "max_rssi", "allowed", "allowed_generation",
+                 "known", "dropped", "unreported", "late_since", "sent")
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.configure({})
+        self.known = set()          # ids cujo DEVICE já foi enviado
+        self.dropped = 0
+        self.unreported = 0         # Descartes ainda não informados ao cliente
+        self.late_since = None
+        self.sent = 0
+
+    def configure(self, filters):
+        macs = filters.get("macs")
+        self.macs = {m.upper() for m in macs} if macs else None
+        prefix = filters.get("mac_prefix")
+        self.mac_prefix = prefix.upper() if prefix else None
+        self.min_rssi = filters.get("min_rssi")
+        self.max_rssi = filters.get("max_rssi")
+        self.allowed = None         # ids permitidos pelos filtros de MAC (array NumPy)
+        self.allowed_generation = -1
+
+    def mask(self, server, records):
+        """Máscara dos registros do lote que passam pelos filtros (None = todos)."""
+        mask = None
+        if self.macs is not None or self.mac_prefix is not None:
+            if self.allowed_generation != server.generation:
+                # Só recalculado quando surgem dispositivos novos
+                ids = [dev for mac, dev in server.ids.items()
+                       if (self.macs is None or mac.upper() in self.macs) and
+                       (self.mac_prefix is None or mac.upper().startswith(self.mac_prefix))]
+                self.allowed = np.array(sorted(ids), dtype=np.uint32)
+                self.allowed_generation = server.generation
+            mask = np.isin(records["id"], self.allowed, assume_unique=False)
+        if self.min_rssi is not None:
+            m = records["rssi"] >= self.min_rssi
+            mask = m if mask is None else mask & m
+        if self.max_rssi is not None:
+            m = records["rssi"] <= self.max_rssi
+            mask = m if mask is None else mask & m
+        return mask
+
+
+class AdvertStreamServer:
+    """
+    Servidor de anúncios em TCP (host/port) ou socket Unix (path). Deve ser
+    iniciado (await start()) no mesmo laço asyncio do BeaconScanner, que
+    chama push() a cada anúncio.
+    """
+    def __init__(self, port=8765, host="127.0.0.1", path=None, flush_interval=0.1,
+                 max_buffer=4 * 1024 * 1024, drop_after=10.0):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.drop_after = drop_after
+        self.ids = {}               # MAC -> id numérico do protocolo
+        self.names = []             # id -> nome atual
+        self.macs = []              # id -> MAC
+        self.generation = 0         # Muda quando surgem dispositivos (filtros por MAC recalculam os ids)
+        self._free = []             # ids de dispositivos esquecidos, reaproveitados por _register()
+        self._forgotten = []        # Esquecidos neste lote: liberados só depois do envio
+        self.subscribers = set()
+        self.records_sent = 0
+        self.dropped = 0
+        self.disconnected = 0
+        self._ids = array("I")
+        self._timestamps = array("d")
+        self._rssi = array("b")
+        self._server = None
+        self._flusher = None
+        self._handlers = set()
+
+    def push(self, timestamp, mac, nome, rssi):
+        """Acrescenta um anúncio ao lote atual; barato o bastante para o callback."""
+        dev = self.ids.get(mac)
+        if dev is None or self.names[dev] != nome: dev = self._register(mac, nome)
+        self._ids.append(dev)
+        self._timestamps.append(timestamp)
+        self._rssi.append(-128 if rssi < -128 else (127 if rssi > 127 else rssi))
+
+    def _register(self, mac, nome):
+        dev = self.ids.get(mac)
+        if dev is None:
+            if self._free:
+                dev = self._free.pop()
+                self.macs[dev], self.names[dev] = mac, nome
+                for sub in self.subscribers: sub.known.discard(dev) # O id agora é de outro MAC
+            else:
+                dev = len(self.macs)
+                self.macs.append(mac)
+                self.names.append(nome)
+            self.ids[mac] = dev
+            self.generation += 1
+        else:
+            self.names[dev] = nome
+            for sub in self.subscribers: sub.known.discard(dev) # Reenvia o DEVICE com o nome novo
+        return dev
+
+    def forget(self, mac):
+        """Libera o id de um dispositivo esquecido pelo scanner (reaproveitado após o próximo envio)."""
+        dev = self.ids.pop(mac, None)
+        if dev is not None: self._forgotten.append(dev)
+
+    def pending(self):
+        return len(self._ids)
+
+    async def start(self):
+        if self._server is not None: return
+        if self.path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        else:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+        self._flusher = asyncio.ensure_future(self._flush_loop())
+
+    async def stop(self):
+        if self._server is None: return
+        self._flusher.cancel()
+        self.flush()
+        self._server.close()
+        for sub in list(self.subscribers): sub.writer.close()
+        # Com a conexão fechada cada leitura termina sozinha (sem cancelar as tarefas)
+        if self._handlers: await asyncio.wait(list(self._handlers), timeout=1.0)
+        await self._server.wait_closed()
+        self._server = self._flusher = None
+
+    async def _handle(self, reader, writer):
+        sub = _Subscriber(writer)
+        self._handlers.add(asyncio.current_task())
+        sock = writer.get_extra_info("socket")
+        if sock is not None and sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        writer.write(_frame(HELLO_BODY.pack(HELLO, VERSION, self.flush_interval)))
+        self.subscribers.add(sub)
+        try:
+            while True:
+                size, = FRAME.unpack(await reader.readexactly(FRAME.size))
+                if size > MAX_FRAME: break
+                payload = await reader.readexactly(size)
+                if payload and payload[0] == SUBSCRIBE:
+                    try: sub.configure(json.loads(payload[1:].decode("utf-8")) or {})
+                    except (ValueError, AttributeError): break # Filtro inválido: encerra a conexão
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.subscribers.discard(sub)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Envia o lote acumulado a todos os assinantes. Retorna o nº de registros do lote."""
+        n = len(self._ids)
+        if self._forgotten and not n:
+            self._free.extend(self._forgotten)
+            self._forgotten = []
+        if not n: return 0
+        ids = np.frombuffer(self._ids, dtype=np.uint32)
+        timestamps = np.frombuffer(self._timestamps, dtype=np.float64)
+        rssi = np.frombuffer(self._rssi, dtype=np.int8)
+        self._ids, self._timestamps, self._rssi = array("I"), array("d"), array("b")
+        forgotten, self._forgotten = self._forgotten, []
+        if self.subscribers: self._send_all(ids, timestamps, rssi)
+        self._free.extend(forgotten)
+        return n
+
+    def _send_all(self, ids, timestamps, rssi):
+        n = len(ids)
+        base = float(timestamps.min())
+        records = np.empty(n, dtype=RECORD)
+        records["id"] = ids
+        records["offset"] = np.round((timestamps - base) * 1e6)
+        records["rssi"] = rssi
+        now = time.monotonic()
+        for sub in list(self.subscribers): self._send(sub, records, base, now)
+
+    def _send(self, sub, records, base, now):
+        transport = sub.writer.transport
+        if transport.is_closing():
+            self.subscribers.discard(sub)
+            return
+        mask = sub.mask(self, records)
+        selected = records if mask is None else records[mask]
+        if not len(selected): return
+
+        if transport.get_write_buffer_size() > self.max_buffer:
+            # Assinante não acompanha: descarta o lote dele em vez de segurar o scanner
+            sub.dropped += len(selected)
+            sub.unreported += len(selected)
+            self.dropped += len(selected)
+            if sub.late_since is None: sub.late_since = now
+            elif now - sub.late_since > self.drop_after:
+                self.subscribers.discard(sub)
+                self.disconnected += 1
+                transport.abort()
+            return
+        sub.late_since = None
+
+        parts = []
+        if sub.unreported:
+            parts.append(_frame(DROPPED_BODY.pack(DROPPED, sub.unreported)))
+            sub.unreported = 0
+        known = sub.known
+        for dev in np.unique(selected["id"]).tolist():
+            if dev not in known:
+                parts.append(_device_frame(dev, self.macs[dev], self.names[dev]))
+                known.add(dev)
+        body = selected.tobytes()
+        parts.append(FRAME.pack(BATCH_HEADER.size + len(body)) + BATCH_HEADER.pack(BATCH, base, len(selected)) + body)
+        sub.writer.write(b"".join(parts))
+        sub.sent += len(selected)
+        self.records_sent += len(selected)
+
+
+def _decode(payload, devices):
+    """
+    Decodifica um quadro do servidor e retorna (tipo, valor): BATCH traz
+    (timestamps, ids, rssi), DROPPED a contagem e HELLO (versão,
+    flush_interval). DEVICE só atualiza 'devices' (id -> (MAC, nome)).
+    """
+    kind = payload[0]
+    if kind == BATCH:
+        _, base, n = BATCH_HEADER.unpack_from(payload)
+        records = np.frombuffer(payload, dtype=RECORD, count=n, offset=BATCH_HEADER.size)
+        return kind, (base + records["offset"] / 1e6, records["id"].copy(), records["rssi"].copy())
+    if kind == DEVICE:
+        dev, mac_len = struct.unpack_from("<IB", payload, 1)
+        mac = payload[6:6 + mac_len].decode("ascii")
+        name_len, = struct.unpack_from("<H", payload, 6 + mac_len)
+        start = 8 + mac_len
+        devices[dev] = (mac, payload[start:start + name_len].decode("utf-8"))
+        return kind, dev
+    if kind == DROPPED: return kind, DROPPED_BODY.unpack(payload)[1]
+    if kind == HELLO: return kind, HELLO_BODY.unpack(payload)[1:]
+    return kind, None
+
+
+def _subscribe_frame(macs=None, mac_prefix=None, min_rssi=None, max_rssi=None):
+    filters = {"macs": list(macs) if macs else None, "mac_prefix": mac_prefix, "min_rssi": min_rssi, "max_rssi": max_rssi}
+    return _frame(bytes([SUBSCRIBE]) + json.dumps({k: v for k, v in filters.items() if v is not None}).encode("utf-8"))
+
+
+class AdvertStreamClient:
+    """
+    Cliente bloqueante do AdvertStreamServer, para serviços que consomem os
+    anúncios. read_batch() devolve um lote inteiro em arrays NumPy; records()
+    itera registro a registro.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.file = sock.makefile("rb")
+        self.devices = {}           # id -> (MAC, nome)
+        self.dropped = 0            # Registros descartados pelo servidor (assinante lento)
+        self.flush_interval = None
+        self.version = None
+
+    @classmethod
+    def connect(cls, port=8765, host="127.0.0.1", path=None, timeout=None, **filters):
+        """Conecta e, se houver filtros (macs, mac_prefix, min_rssi, max_rssi), já assina com eles."""
+        if path is not None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            sock.connect(path)
+        else:
+            sock = socket.create_connection((host, port), timeout=timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = cls(sock)
+        if filters: client.subscribe(**filters)
+        return client
+
+    def subscribe(self, macs=None, mac_prefix=None, min_rssi=None, max_rssi=None):
+        self.sock.sendall(_subscribe_frame(macs, mac_prefix, min_rssi, max_rssi))
+
+    def _read_frame(self):
+        header = self.file.read(FRAME.size)
+        if len(header) < FRAME.size: return None
+        size, = FRAME.unpack(header)
+        payload = self.file.read(size)
+        if len(payload) < size: return None
+        return payload
+
+    def read_batch(self):
+        """
+        Lê até o próximo lote. Retorna (timestamps f64, ids u32, rssi i8) ou
+        None quando a conexão termina; os MACs/nomes dos ids estão em self.devices.
+        """
+        while True:
+            payload = self._read_frame()
+            if payload is None: return None
+            kind, value = _decode(payload, self.devices)
+            if kind == BATCH: return value
+            if kind == DROPPED: self.dropped += value
+            elif kind == HELLO: self.version, self.flush_interval = value
+
+    def records(self):
+        """Itera (timestamp, MAC, nome, RSSI) até a conexão terminar."""
+        devices = self.devices
+        while True:
+            batch = self.read_batch()
+            if batch is None: return
+            timestamps, ids, rssi = batch
+            for ts, dev, r in zip(timestamps.tolist(), ids.tolist(), rssi.tolist()):
+                mac, nome = devices[dev]
+                yield ts, mac, nome, r
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+class StreamSource:
+    """
+    Fonte de anúncios do BeaconScanner lida de um AdvertStreamServer (outro
+    nó ou o agregador), com a mesma interface do BleakScanner:
+
+        BeaconScanner(source_factory=partial(StreamSource, port=8766))
+
+    Roda no laço asyncio do scanner, sem threads, e reconecta a cada
+    'reconnect' segundos se a conexão cair. filters: os mesmos de subscribe().
+
+    clock() devolve, durante a entrega de cada registro, o instante gravado
+    pelo nó de origem (como o ReplaySource): o scanner guarda o momento real
+    do anúncio, não o da chegada do lote. Fora da entrega vale time.time().
+    """
+    def __init__(self, detection_callback=None, port=8765, host="127.0.0.1", path=None, reconnect=2.0, **filters):
+        self.detection_callback = detection_callback
+        self.port = port
+        self.host = host
+        self.path = path
+        self.reconnect = reconnect
+        self.filters = filters
+        self.connected = False
+        self.dropped = 0
+        self.now = None     # Instante do registro em entrega (None fora dos lotes)
+        self._task = None
+
+    def clock(self):
+        """Instante do registro sendo entregue, ou o relógio local entre os lotes."""
+        now = self.now
+        return time.time() if now is None else now
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+
+    async def _run(self):
+        from synthetic_source import SyntheticAdvertisementData, SyntheticDevice
+        empty = {}
+        while True:
+            writer = None
+            try:
+                if self.path is not None: reader, writer = await asyncio.open_unix_connection(self.path)
+                else: reader, writer = await asyncio.open_connection(self.host, self.port)
+                if self.filters: writer.write(_subscribe_frame(**self.filters))
+                self.connected = True
+                devices = {}
+                objects = {}        # id -> SyntheticDevice, recriado quando o DEVICE muda
+                while True:
+                    size, = FRAME.unpack(await reader.readexactly(FRAME.size))
+                    kind, value = _decode(await reader.readexactly(size), devices)
+                    if kind == DEVICE:
+                        mac, nome = devices[value]
+                        objects[value] = SyntheticDevice(mac, nome)
+                    elif kind == BATCH:
+                        callback = self.detection_callback
+                        timestamps, ids, rssi = value
+                        try:
+                            for t, dev, r in zip(timestamps.tolist(), ids.tolist(), rssi.tolist()):
+                                self.now = t
+                                device = objects[dev]
+                                callback(device, SyntheticAdvertisementData(device.name, r, empty, empty))
+                        finally:
+                            self.now = None
+                    elif kind == DROPPED:
+                        self.dropped += value
+            except (OSError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                self.connected = False
+                if writer is not None: writer.close()
+            await asyncio.sleep(self.reconnect)
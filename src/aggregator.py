@@ -0,0 +1,488 @@
+"""
+Agregador central: junta os anúncios de vários nós de escaneamento.
+
+Cada nó roda um scanner com stream (scanner_daemon.py --stream-port) e o
+agregador se conecta a todos. Os instantes de cada nó são alinhados ao
+relógio do agregador e as leituras formam uma matriz dispositivo × nó
+(último RSSI, média exponencial e instante da última leitura), dividida
+entre processos de trabalho pelo hash do MAC, de modo que a ingestão
+acompanha o número de nós.
+
+Consultas (API em processo): strongest() (nó mais forte de cada
+dispositivo), device() (a linha inteira de um dispositivo) e near() (os
+dispositivos cujo nó mais forte é um dado nó). O agregador também é um
+AdvertStreamServer: a cada publish_interval transmite, para cada
+dispositivo atualizado, a leitura do nó mais forte com o nome "nome @ nó".
+Assim a interface gráfica aponta para o agregador como se fosse um scanner:
+
+    python beacon_scanner_gui.py --stream 127.0.0.1:8766
+
+Uso:
+    python aggregator.py --node sala1=192.168.0.10:8765 --node sala2=unix:/tmp/n2.sock
+    python aggregator.py --local-nodes 3 --synthetic 200      # nós locais simulados, para testes
+"""
+import argparse
+import asyncio
+import math
+import multiprocessing
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from advert_stream import AdvertStreamClient, AdvertStreamServer
+
+# Lotes considerados na estimativa do deslocamento de relógio de cada nó
+OFFSET_WINDOW = 50
+
+
+def shard_of(mac, shards):
+    """Shard do MAC; crc32 em vez de hash() para ser igual em todos os processos."""
+    return zlib.crc32(mac.encode("ascii", "replace")) % shards
+
+
+class RssiMatrix:
+    """
+    Matriz dispositivo × nó de um shard. Cada célula guarda o último RSSI, a
+    média exponencial (fator alpha por leitura) e o instante da última leitura.
+    Os ids de cada nó (do protocolo do stream) são traduzidos para linhas por
+    tabelas NumPy, então um lote é aplicado sem laço Python por leitura.
+    """
+    def __init__(self, nodes, alpha=0.3, capacity=1024):
+        self.nodes = nodes
+        self.alpha = alpha
+        self.rows = {}                              # MAC -> linha
+        self.macs = []                              # linha -> MAC (None nas linhas livres)
+        self.names = []                             # linha -> nome
+        self._free = []
+        self._node_macs = [{} for _ in range(nodes)]    # por nó: id -> (MAC, nome)
+        self._lut = [np.full(0, -1, dtype=np.int64) for _ in range(nodes)]
+        self._row_ids = []                          # linha -> [(nó, id)] que apontam para ela
+        self.latest = np.full((capacity, nodes), np.nan)
+        self.smoothed = np.full((capacity, nodes), np.nan)
+        self.last_seen = np.full((capacity, nodes), -np.inf)
+        self.updated = np.full(capacity, -np.inf)   # Instante (relógio local) da última alteração da linha
+
+    def __len__(self):
+        return len(self.rows)
+
+    def define(self, node, dev, mac, nome):
+        """Registra o MAC/nome do id 'dev' do nó (quadro DEVICE)."""
+        previous = self._node_macs[node].get(dev)
+        self._node_macs[node][dev] = (mac, nome)
+        lut = self._lut[node]
+        if previous is not None and previous[0] != mac and dev < len(lut): lut[dev] = -1 # id reaproveitado pelo nó
+        row = self.rows.get(mac)
+        if row is not None: self.names[row] = nome
+
+    def _row(self, mac, nome):
+        row = self.rows.get(mac)
+        if row is not None: return row
+        if self._free:
+            row = self._free.pop()
+            self.macs[row] = mac
+            self.names[row] = nome
+            self._row_ids[row] = []
+        else:
+            row = len(self.macs)
+            self.macs.append(mac)
+            self.names.append(nome)
+            self._row_ids.append([])
+            if row >= len(self.latest): self._grow()
+        self.rows[mac] = row
+        return row
+
+    def _grow(self):
+        extra = len(self.latest)
+        self.latest = np.concatenate([self.latest, np.full((extra, self.nodes), np.nan)])
+        self.smoothed = np.concatenate([self.smoothed, np.full((extra, self.nodes), np.nan)])
+        self.last_seen = np.concatenate([self.last_seen, np.full((extra, self.nodes), -np.inf)])
+        self.updated = np.concatenate([self.updated, np.full(extra, -np.inf)])
+
+    def _rows_for(self, node, ids):
+        lut = self._lut[node]
+        top = int(ids.max()) + 1
+        if top > len(lut):
+            lut = self._lut[node] = np.concatenate([lut, np.full(max(top, 2 * len(lut)) - len(lut), -1, dtype=np.int64)])
+        rows = lut[ids]
+        missing = rows < 0
+        if missing.any():
+            # Primeira leitura do id (ou linha esquecida): resolve pelo MAC anunciado no DEVICE
+            for dev in np.unique(ids[missing]).tolist():
+                entry = self._node_macs[node].get(dev)
+                if entry is None: continue
+                row = self._row(*entry)
+                lut[dev] = row
+                self._row_ids[row].append((node, dev))
+            rows = lut[ids]
+        return rows
+
+    def apply(self, node, ids, timestamps, rssi, now):
+        """Aplica um lote de um nó (ids u32, instantes já alinhados, RSSI)."""
+        rows = self._rows_for(node, ids)
+        valid = rows >= 0
+        if not valid.all(): rows, timestamps, rssi = rows[valid], timestamps[valid], rssi[valid]
+        if not len(rows): return
+        order = np.lexsort((timestamps, rows))
+        rows, timestamps, values = rows[order], timestamps[order], rssi[order].astype(np.float64)
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        ends = np.r_[starts[1:], len(rows)] - 1
+        counts = ends - starts + 1
+        uniq = rows[starts]
+        means = np.add.reduceat(values, starts) / counts
+
+        # Média exponencial por célula: o lote entra como 'counts' leituras de valor médio
+        previous = self.smoothed[uniq, node]
+        gain = 1.0 - (1.0 - self.alpha) ** counts
+        self.smoothed[uniq, node] = np.where(np.isnan(previous), means, previous + gain * (means - previous))
+        self.latest[uniq, node] = values[ends]
+        self.last_seen[uniq, node] = np.maximum(self.last_seen[uniq, node], timestamps[ends])
+        self.updated[uniq] = now
+
+    def expire(self, limit):
+        """Esquece os dispositivos sem leituras de nenhum nó desde 'limit'. Retorna quantos."""
+        used = len(self.macs)
+        if not used: return 0
+        stale = np.flatnonzero(self.last_seen[:used].max(axis=1) < limit)
+        removed = 0
+        for row in stale.tolist():
+            mac = self.macs[row]
+            if mac is None: continue
+            del self.rows[mac]
+            self.macs[row] = None
+            for node, dev in self._row_ids[row]:
+                if self._lut[node][dev] == row: self._lut[node][dev] = -1
+            self._row_ids[row] = []
+            self.latest[row] = np.nan
+            self.smoothed[row] = np.nan
+            self.last_seen[row] = -np.inf
+            self.updated[row] = -np.inf
+            self._free.append(row)
+            removed += 1
+        return removed
+
+    def _row_result(self, row, node):
+        return (self.macs[row], self.names[row], node, float(self.smoothed[row, node]), int(self.latest[row, node]),
+                float(self.last_seen[row, node]))
+
+    def strongest(self, since=None, max_age=None, now=None):
+        """
+        [(MAC, nome, nó, RSSI suavizado, último RSSI, instante)] com o nó de
+        maior RSSI suavizado de cada dispositivo. since: só linhas alteradas
+        desde então; max_age: ignora células sem leitura há mais que isso.
+        """
+        used = len(self.macs)
+        rows = np.arange(used) if since is None else np.flatnonzero(self.updated[:used] >= since)
+        if not len(rows): return []
+        values = self.smoothed[rows]
+        if max_age is not None: values = np.where(self.last_seen[rows] >= now - max_age, values, np.nan)
+        seen = ~np.isnan(values).all(axis=1)
+        rows, values = rows[seen], values[seen]
+        best = np.argmax(np.nan_to_num(values, nan=-np.inf), axis=1)
+        return [self._row_result(row, node) for row, node in zip(rows.tolist(), best.tolist())]
+
+    def device(self, mac):
+        """{nó: (RSSI suavizado, último RSSI, instante)} de um dispositivo, ou None."""
+        row = self.rows.get(mac)
+        if row is None: return None
+        return {node: (float(self.smoothed[row, node]), int(self.latest[row, node]), float(self.last_seen[row, node]))
+                for node in range(self.nodes) if not math.isnan(self.smoothed[row, node])}
+
+
+def _shard_main(ingest, queries, nodes, alpha):
+    """Processo de trabalho: aplica os lotes do seu shard e responde às consultas."""
+    matrix = RssiMatrix(nodes, alpha)
+    handlers = {
+        "strongest": matrix.strongest,
+        "device": matrix.device,
+        "expire": matrix.expire,
+        "size": matrix.__len__,
+    }
+    while True:
+        for conn in wait([ingest, queries]):
+            try: message = conn.recv()
+            except EOFError: return
+            kind = message[0]
+            if kind == "batch": matrix.apply(*message[1:], time.time())
+            elif kind == "define": matrix.define(*message[1:])
+            elif kind == "stop": return
+            else: queries.send(handlers[kind](*message[1:]))
+
+
+class _Shard:
+    """Lado do processo principal de um shard: canal de ingestão e canal de consultas, cada um com sua trava."""
+    def __init__(self, context, nodes, alpha):
+        ingest_recv, self.ingest = context.Pipe(duplex=False)
+        self.queries, worker_queries = context.Pipe()
+        self.process = context.Process(target=_shard_main, args=(ingest_recv, worker_queries, nodes, alpha),
+                                       name="agregador-shard", daemon=True)
+        self.process.start()
+        ingest_recv.close()
+        worker_queries.close()
+        self.ingest_lock = threading.Lock()
+        self.query_lock = threading.Lock()
+
+    def send(self, message):
+        with self.ingest_lock: self.ingest.send(message)
+
+    def ask(self, *message):
+        # As consultas passam pelo mesmo processo que aplica os lotes: a resposta já inclui o que foi enviado antes
+        with self.query_lock:
+            self.queries.send(message)
+            return self.queries.recv()
+
+
+class NodeLink:
+    """
+    Conexão com um nó (thread própria, com reconexão). Estima o deslocamento
+    do relógio do nó como o menor (chegada - instante mais recente do lote)
+    dos últimos OFFSET_WINDOW lotes, ou seja, o atraso mínimo da rede, e
+    reparte cada lote entre os shards já com os instantes alinhados.
+    """
+    def __init__(self, aggregator, index, name, address):
+        self.aggregator = aggregator
+        self.index = index
+        self.name = name
+        self.address = address
+        self.connected = False
+        self.records = 0
+        self.dropped = 0
+        self.offset = 0.0
+        self._offsets = deque(maxlen=OFFSET_WINDOW)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"no-{name}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _connect(self):
+        host, port, path = self.address
+        return AdvertStreamClient.connect(port=port, host=host, path=path, timeout=5.0)
+
+    def _run(self):
+        shards = self.aggregator.shards
+        while not self._stop.is_set():
+            try:
+                client = self._connect()
+            except OSError:
+                self._stop.wait(self.aggregator.reconnect)
+                continue
+            client.sock.settimeout(None)
+            self.connected = True
+            shard_lut = np.full(0, -1, dtype=np.int64)    # id do nó -> shard
+            defined = {}                                    # id -> (MAC, nome) já repassado aos shards
+            try:
+                while not self._stop.is_set():
+                    batch = client.read_batch()
+                    if batch is None: break
+                    arrival = time.time()
+                    timestamps, ids, rssi = batch
+                    if not len(ids): continue
+                    self._offsets.append(arrival - float(timestamps.max()))
+                    self.offset = min(self._offsets)
+                    timestamps = timestamps + self.offset
+
+                    top = int(ids.max()) + 1
+                    if top > len(shard_lut): shard_lut = np.concatenate([shard_lut, np.full(top - len(shard_lut), -1, dtype=np.int64)])
+                    for dev in np.unique(ids).tolist():
+                        entry = client.devices[dev]
+                        if defined.get(dev) != entry:
+                            defined[dev] = entry
+                            shard = shard_of(entry[0], len(shards))
+                            shard_lut[dev] = shard
+                            shards[shard].send(("define", self.index, dev, entry[0], entry[1]))
+
+                    targets = shard_lut[ids]
+                    for shard in np.unique(targets).tolist():
+                        mask = targets == shard
+                        shards[shard].send(("batch", self.index, ids[mask], timestamps[mask], rssi[mask]))
+                    self.records += len(ids)
+                    self.dropped = client.dropped
+            except OSError:
+                pass
+            finally:
+                self.connected = False
+                client.close()
+            self._stop.wait(self.aggregator.reconnect)
+
+
+def parse_address(text):
+    """'host:porta', 'porta' ou 'unix:/caminho' -> (host, porta, caminho)."""
+    if text.startswith("unix:"): return None, None, text[5:]
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port), None
+
+
+class Aggregator:
+    """
+    Agrega os streams de N nós. nodes: lista de (nome, endereço), com
+    endereço como em parse_address(). workers: nº de processos de shard.
+    """
+    def __init__(self, nodes, workers=2, alpha=0.3, idle_ttl=900.0, reconnect=2.0):
+        self.node_names = [name for name, _ in nodes]
+        self.reconnect = reconnect
+        self.idle_ttl = idle_ttl
+        context = multiprocessing.get_context("spawn") # Sem herdar as threads do processo principal
+        self.shards = [_Shard(context, len(nodes), alpha) for _ in range(max(1, workers))]
+        self.links = [NodeLink(self, i, name, parse_address(address) if isinstance(address, str) else address)
+                      for i, (name, address) in enumerate(nodes)]
+
+    def start(self):
+        for link in self.links: link.start()
+
+    def stop(self):
+        for link in self.links: link.stop()
+        for shard in self.shards:
+            try: shard.send(("stop",))
+            except OSError: pass
+            shard.process.join(timeout=2.0)
+
+    def _gather(self, *message):
+        return [shard.ask(*message) for shard in self.shards]
+
+    def __len__(self):
+        return sum(self._gather("size"))
+
+    def strongest(self, since=None, max_age=None):
+        """
+        Nó mais forte de cada dispositivo: [(MAC, nome, nó, RSSI suavizado,
+        último RSSI, instante)] em ordem de RSSI decrescente.
+        """
+        rows = [row for part in self._gather("strongest", since, max_age, time.time()) for row in part]
+        rows = [(mac, nome, self.node_names[node], smoothed, latest, seen) for mac, nome, node, smoothed, latest, seen in rows]
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows
+
+    def device(self, mac):
+        """{nó: (RSSI suavizado, último RSSI, instante)} de um dispositivo em todos os nós que o ouviram."""
+        cells = self.shards[shard_of(mac, len(self.shards))].ask("device", mac)
+        if cells is None: return {}
+        return {self.node_names[node]: cell for node, cell in cells.items()}
+
+    def near(self, node, max_age=None):
+        """Dispositivos cujo nó mais forte é 'node'."""
+        return [row for row in self.strongest(max_age=max_age) if row[2] == node]
+
+    def expire(self):
+        if self.idle_ttl is None: return 0
+        return sum(self._gather("expire", time.time() - self.idle_ttl))
+
+    async def serve(self, stream, publish_interval=0.5, stop_event=None, max_age=10.0):
+        """
+        Publica no stream, a cada publish_interval, a leitura do nó mais forte
+        de cada dispositivo alterado (nós sem leitura há mais de max_age
+        segundos não contam: o dispositivo pode ter se afastado deles).
+        """
+        await stream.start()
+        loop = asyncio.get_running_loop()
+        since = None
+        last_expire = time.time()
+        try:
+            while stop_event is None or not stop_event.is_set():
+                await asyncio.sleep(publish_interval)
+                started = time.time()
+                rows = await loop.run_in_executor(None, self.strongest, since, max_age)
+                since = started
+                for mac, nome, node, smoothed, latest, seen in rows: stream.push(seen, mac, f"{nome} @ {node}", latest)
+                if started - last_expire >= 60.0:
+                    last_expire = started
+                    await loop.run_in_executor(None, self.expire)
+        finally:
+            await stream.stop()
+
+
+def _node_pattern(node, nodes):
+    """RSSI simulado de um nó local: cada nó fica mais perto de cada dispositivo numa fase diferente."""
+    phase = 2 * math.pi * node / nodes
+    return lambda index, t: -65 + 20 * math.sin(0.2 * t + index * 0.7 + phase)
+
+
+def start_local_nodes(count, devices=200, adverts_per_second=2000, seed=1):
+    """
+    Sobe 'count' nós simulados neste processo (scanner sintético + stream em
+    portas livres), vendo os mesmos dispositivos com RSSI diferentes. Retorna
+    [(nome, (host, porta, None))] para o Aggregator.
+    """
+    from functools import partial
+    from beacon_scanner import BeaconScanner
+    from synthetic_source import SyntheticAdvertSource
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="nos-locais", daemon=True).start()
+    nodes = []
+    for i in range(count):
+        stream = AdvertStreamServer(port=0)
+        factory = partial(SyntheticAdvertSource, num_devices=devices, adverts_per_second=adverts_per_second, seed=seed,
+                          rssi_pattern=_node_pattern(i, count))
+        scanner = BeaconScanner(source_factory=factory, history_capacity=16, stream=stream)
+        asyncio.run_coroutine_threadsafe(stream.start(), loop).result()
+        asyncio.run_coroutine_threadsafe(scanner.start(), loop).result()
+        nodes.append((f"no{i + 1}", (stream.host, stream.port, None)))
+    return nodes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Agregador de vários nós do Radar BLE")
+    parser.add_argument("--node", action="append", default=[], metavar="NOME=ENDEREÇO",
+                        help="Nó a agregar: nome=host:porta ou nome=unix:/caminho (repetível)")
+    parser.add_argument("--local-nodes", type=int, default=0, metavar="N", help="Sobe N nós simulados neste processo (testes)")
+    parser.add_argument("--synthetic", type=int, default=200, help="Dispositivos de cada nó simulado")
+    parser.add_argument("--workers", type=int, default=max(1, min(4, (multiprocessing.cpu_count() or 2) - 1)),
+                        help="Processos de shard da matriz dispositivo × nó")
+    parser.add_argument("--port", type=int, default=8766, help="Porta do stream agregado (nó mais forte de cada dispositivo)")
+    parser.add_argument("--host", default="127.0.0.1", help="Endereço de escuta do stream agregado")
+    parser.add_argument("--publish-interval", type=float, default=0.5, help="Segundos entre as publicações do stream agregado")
+    parser.add_argument("--summary-interval", type=float, default=10.0, help="Segundos entre os resumos impressos")
+    parser.add_argument("--duration", type=float, default=None, help="Encerra após N segundos")
+    args = parser.parse_args(argv)
+
+    nodes = []
+    for spec in args.node:
+        name, sep, address = spec.partition("=")
+        if not sep: parser.error(f"--node espera nome=endereço: {spec}")
+        nodes.append((name, address))
+    if args.local_nodes: nodes.extend(start_local_nodes(args.local_nodes, args.synthetic))
+    if not nodes: parser.error("informe ao menos um --node ou --local-nodes")
+
+    aggregator = Aggregator(nodes, workers=args.workers)
+    aggregator.start()
+    stream = AdvertStreamServer(args.port, args.host)
+
+    async def run():
+        stop_event = asyncio.Event()
+        server = asyncio.ensure_future(aggregator.serve(stream, args.publish_interval, stop_event))
+        started = time.monotonic()
+        try:
+            while not server.done():
+                await asyncio.sleep(min(args.summary_interval, args.duration or args.summary_interval))
+                elapsed = time.monotonic() - started
+                strongest = await asyncio.get_running_loop().run_in_executor(None, aggregator.strongest, None, 5.0)
+                links = ", ".join(f"{link.name}: {'ok' if link.connected else 'desconectado'} {link.records} leituras "
+                                  f"(relógio {link.offset * 1000:+.0f} ms)" for link in aggregator.links)
+                top = ", ".join(f"{mac} @ {node} {smoothed:.0f} dBm" for mac, _, node, smoothed, _, _ in strongest[:3])
+                print(f"[{time.strftime('%H:%M:%S')}] {len(strongest)} dispositivos ativos | {links}" +
+                      (f" | mais fortes: {top}" if top else ""), flush=True)
+                if args.duration is not None and elapsed >= args.duration: break
+        finally:
+            stop_event.set()
+            await server
+
+    print(f"Agregando {len(nodes)} nó(s) em {len(aggregator.shards)} shard(s); stream em {args.host}:{args.port}", flush=True)
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        aggregator.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Decodificação dos formatos de beacon mais comuns a partir dos dados do anúncio.
+
+    iBeacon     manufacturer_data[0x004C] = 02 15 | UUID (16) | major (2) | minor (2) | TX (1)
+    AltBeacon   manufacturer_data[qualquer] = BE AC | ID (20) | RSSI de referência (1) | reservado (1)
+    Eddystone   service_data[0xFEAA], quadros UID (0x00), URL (0x10) e TLM (0x20)
+
+Os beacons repetem o mesmo payload o tempo todo, então cada payload é
+decodificado uma única vez: os resultados ficam num cache LRU limitado,
+indexado pelos bytes. Os dicts retornados são compartilhados pelo cache e
+não devem ser alterados.
+"""
+import struct
+import uuid
+from functools import lru_cache
+
+APPLE_COMPANY_ID = 0x004C
+EDDYSTONE_UUID = "0000feaa-0000-1000-8000-00805f9b34fb"
+CACHE_SIZE = 4096
+
+# Colunas dos campos decodificados na exportação CSV: (chave, cabeçalho)
+EXPORT_FIELDS = [
+    ("tipo", "Tipo"),
+    ("uuid", "UUID"),
+    ("major", "Major"),
+    ("minor", "Minor"),
+    ("namespace", "Namespace"),
+    ("instance", "Instance"),
+    ("url", "URL"),
+    ("tx_power", "TX Power"),
+    ("bateria_mv", "Bateria (mV)"),
+    ("temperatura", "Temperatura (C)"),
+]
+
+_URL_SCHEMES = ("http://www.", "https://www.", "http://", "https://")
+_URL_EXPANSIONS = (".com/", ".org/", ".edu/", ".net/", ".info/", ".biz/", ".gov/",
+                   ".com", ".org", ".edu", ".net", ".info", ".biz", ".gov")
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def decode_manufacturer(company_id, payload):
+    """Decodifica um item de manufacturer_data (iBeacon ou AltBeacon). Retorna um dict ou None."""
+    if company_id == APPLE_COMPANY_ID and len(payload) == 23 and payload[:2] == b"\x02\x15":
+        major, minor, tx = struct.unpack_from(">HHb", payload, 18)
+        return {"tipo": "iBeacon", "uuid": str(uuid.UUID(bytes=payload[2:18])), "major": major, "minor": minor,
+                "tx_power": tx}
+    if len(payload) == 24 and payload[:2] == b"\xbe\xac":
+        major, minor, tx = struct.unpack_from(">HHb", payload, 18)
+        return {"tipo": "AltBeacon", "uuid": str(uuid.UUID(bytes=payload[2:18])), "major": major, "minor": minor,
+                "tx_power": tx, "fabricante": company_id}
+    return None
+
+
+def _decode_url(tx, data):
+    if not data or data[0] >= len(_URL_SCHEMES): return None
+    parts = [_URL_SCHEMES[data[0]]]
+    for byte in data[1:]:
+        if byte < len(_URL_EXPANSIONS): parts.append(_URL_EXPANSIONS[byte])
+        elif 0x20 < byte < 0x7F: parts.append(chr(byte))
+        else: return None
+    return {"tipo": "Eddystone", "url": "".join(parts), "tx_power": tx}
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def decode_eddystone(payload):
+    """Decodifica um quadro Eddystone (service data 0xFEAA). Retorna um dict ou None."""
+    if len(payload) < 2: return None
+    frame = payload[0]
+    if frame == 0x00 and len(payload) >= 18:
+        tx = struct.unpack_from("b", payload, 1)[0]
+        return {"tipo": "Eddystone", "namespace": payload[2:12].hex(), "instance": payload[12:18].hex(),
+                "tx_power": tx}
+    if frame == 0x10:
+        return _decode_url(struct.unpack_from("b", payload, 1)[0], payload[2:])
+    if frame == 0x20 and len(payload) >= 14 and payload[1] == 0x00:
+        # TLM não criptografado: bateria (mV), temperatura 8.8, contadores de anúncios e de tempo (0,1 s)
+        vbatt, temp, adv_count, uptime = struct.unpack_from(">HhII", payload, 2)
+        return {"tipo": "Eddystone", "bateria_mv": vbatt or None, "temperatura": None if temp == -0x8000 else temp / 256.0,
+                "anuncios": adv_count, "uptime_s": uptime / 10.0}
+    return None
+
+
+def decode_advertisement(manufacturer_data, service_data):
+    """
+    Decodifica os dados de um anúncio. Retorna o dict de campos do formato
+    reconhecido ou None. Quadros Eddystone trazem só parte dos campos (UID,
+    URL ou telemetria); merge_fields os acumula por dispositivo.
+    """
+    for company_id, payload in manufacturer_data.items():
+        fields = decode_manufacturer(company_id, bytes(payload))
+        if fields is not None: return fields
+    if service_data:
+        payload = service_data.get(EDDYSTONE_UUID)
+        if payload is not None: return decode_eddystone(bytes(payload))
+    return None
+
+
+def merge_fields(current, fields):
+    """
+    Combina os campos decodificados de um novo anúncio com os já conhecidos
+    do dispositivo (ex.: quadros Eddystone UID e TLM alternados). Retorna o
+    próprio 'current' quando nada mudou, sem alocar.
+    """
+    if current is None or current is fields: return fields
+    if fields.items() <= current.items(): return current
+    if fields.get("tipo", current.get("tipo")) != current.get("tipo"): return fields # Outro formato: substitui
+    merged = dict(current)
+    merged.update(fields)
+    return merged
+
+
+def describe(fields):
+    """Texto curto do identificador decodificado, para a tabela."""
+    if not fields: return ""
+    if "uuid" in fields: return fields["uuid"]
+    if "namespace" in fields: return f"{fields['namespace']}/{fields['instance']}"
+    return fields.get("url", "")
+
+
+def export_values(fields):
+    """Valores dos EXPORT_FIELDS para uma linha do CSV (vazio quando ausente)."""
+    if not fields: return ("",) * len(EXPORT_FIELDS)
+    return tuple("" if fields.get(key) is None else fields[key] for key, _ in EXPORT_FIELDS)
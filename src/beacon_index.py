@@ -0,0 +1,235 @@
+import heapq
+from bisect import bisect_left, bisect_right, insort
+
+
+class SortedKeyList:
+    """
+    Lista ordenada de chaves em blocos (listas de até 2 * load chaves), no
+    estilo do sortedcontainers: inserção e remoção custam O(log n + load) e
+    um intervalo de k chaves é percorrido em O(log n + k).
+
+    copy() devolve uma cópia que compartilha os blocos com a original (custo
+    O(n / load)); a original copia cada bloco compartilhado só na primeira
+    alteração dele, e a cópia nunca deve ser alterada.
+    """
+    def __init__(self, load=512):
+        self.load = load
+        self._lists = []
+        self._maxes = []
+        self._len = 0
+        self._owned = set()     # id dos blocos que só esta lista referencia
+
+    def __len__(self):
+        return self._len
+
+    def copy(self):
+        """Cópia somente leitura, com os blocos compartilhados."""
+        other = SortedKeyList(self.load)
+        other._lists = list(self._lists)
+        other._maxes = list(self._maxes)
+        other._len = self._len
+        self._owned = set()
+        return other
+
+    def _own(self, i):
+        """Bloco i pronto para alteração (copiado se ainda é compartilhado)."""
+        sub = self._lists[i]
+        if id(sub) not in self._owned:
+            sub = self._lists[i] = list(sub)
+            self._owned.add(id(sub))
+        return sub
+
+    def add(self, key):
+        lists, maxes = self._lists, self._maxes
+        if not maxes:
+            sub = [key]
+            lists.append(sub)
+            maxes.append(key)
+            self._owned.add(id(sub))
+        else:
+            i = bisect_left(maxes, key)
+            if i == len(maxes):
+                i -= 1
+                sub = self._own(i)
+                sub.append(key)
+                maxes[i] = key
+            else:
+                sub = self._own(i)
+                insort(sub, key)
+            if len(sub) > 2 * self.load:
+                half = sub[self.load:]
+                del sub[self.load:]
+                maxes[i] = sub[-1]
+                lists.insert(i + 1, half)
+                maxes.insert(i + 1, half[-1])
+                self._owned.add(id(half))
+        self._len += 1
+
+    def remove(self, key):
+        lists, maxes = self._lists, self._maxes
+        i = bisect_left(maxes, key)
+        if i == len(maxes): raise KeyError(key)
+        sub = lists[i]
+        j = bisect_left(sub, key)
+        if j == len(sub) or sub[j] != key: raise KeyError(key)
+        sub = self._own(i)
+        del sub[j]
+        if not sub:
+            self._owned.discard(id(sub))
+            del lists[i]
+            del maxes[i]
+        elif j == len(sub):
+            maxes[i] = sub[-1]
+        self._len -= 1
+
+    def irange(self, lo=None, hi=None, reverse=False):
+        """Chaves com lo <= chave <= hi (None = sem limite), em ordem crescente ou decrescente."""
+        lists, maxes = self._lists, self._maxes
+        if not maxes: return
+        if not reverse:
+            i = 0 if lo is None else bisect_left(maxes, lo)
+            if i == len(maxes): return
+            j = 0 if lo is None else bisect_left(lists[i], lo)
+            while i < len(lists):
+                sub = lists[i]
+                for key in sub[j:]:
+                    if hi is not None and key > hi: return
+                    yield key
+                i += 1
+                j = 0
+        else:
+            i = len(maxes) - 1 if hi is None else min(bisect_right(maxes, hi), len(maxes) - 1)
+            j = len(lists[i]) if hi is None else bisect_right(lists[i], hi)
+            while i >= 0:
+                sub = lists[i]
+                for key in reversed(sub[:j]):
+                    if lo is not None and key < lo: return
+                    yield key
+                i -= 1
+                if i >= 0: j = len(lists[i])
+
+    def __iter__(self):
+        return self.irange()
+
+
+class BeaconIndex:
+    """
+    Índices ordenados dos beacons, mantidos de forma incremental pelo scanner.
+
+        por sinal   (ativo, RSSI filtrado arredondado, MAC)
+        por nome    (nome normalizado com casefold, MAC)
+        por MAC     MAC
+
+    update() é chamado por dispositivo alterado em cada publicação e só
+    reposiciona as chaves que mudaram. A passagem de ativo para inativo é
+    detectada por expire() com uma fila de prioridade de prazos, sem percorrer
+    todos os dispositivos. O RSSI entra na chave em dBm inteiros para que as
+    pequenas variações do valor filtrado não reordenem o índice a cada lote.
+
+    copy() tira uma cópia somente leitura para consultas em outra thread: as
+    entradas são tuplas trocadas a cada alteração e as listas ordenadas
+    compartilham os blocos que não mudaram (ver SortedKeyList.copy).
+    """
+    def __init__(self, timeout=3.0):
+        self.timeout = timeout
+        self.entries = {}       # MAC -> (ativo, chave de RSSI, nome normalizado, last_seen)
+        self.by_signal = SortedKeyList()
+        self.by_name = SortedKeyList()
+        self.by_mac = SortedKeyList()
+        self._deadlines = []    # heap de (prazo, MAC) dos dispositivos ativos
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, mac):
+        return mac in self.entries
+
+    def is_active(self, mac):
+        entry = self.entries.get(mac)
+        return entry is not None and entry[0] == 1
+
+    def copy(self):
+        """Cópia somente leitura (sem a fila de prazos) publicada junto com o snapshot."""
+        other = BeaconIndex(self.timeout)
+        other.entries = dict(self.entries)
+        other.by_signal = self.by_signal.copy()
+        other.by_name = self.by_name.copy()
+        other.by_mac = self.by_mac.copy()
+        return other
+
+    def update(self, mac, nome, rssi, last_seen, now):
+        active = 1 if now - last_seen <= self.timeout else 0
+        rssi_key = round(rssi)
+        name_key = nome.casefold()
+        entry = self.entries.get(mac)
+        self.entries[mac] = (active, rssi_key, name_key, last_seen)
+        if entry is None:
+            self.by_signal.add((active, rssi_key, mac))
+            self.by_name.add((name_key, mac))
+            self.by_mac.add(mac)
+        else:
+            was_active = entry[0]
+            if active != was_active or rssi_key != entry[1]:
+                self.by_signal.remove((was_active, entry[1], mac))
+                self.by_signal.add((active, rssi_key, mac))
+            if name_key != entry[2]:
+                self.by_name.remove((entry[2], mac))
+                self.by_name.add((name_key, mac))
+            # Já ativo: o prazo pendente na heap é renovado quando vencer
+            if was_active: return
+        if active: heapq.heappush(self._deadlines, (last_seen + self.timeout, mac))
+
+    def remove(self, mac):
+        entry = self.entries.pop(mac, None)
+        if entry is None: return
+        self.by_signal.remove((entry[0], entry[1], mac))
+        self.by_name.remove((entry[2], mac))
+        self.by_mac.remove(mac)
+
+    def expire(self, now):
+        """Marca como inativos os dispositivos cujo prazo venceu. Retorna os MACs que mudaram."""
+        deadlines = self._deadlines
+        changed = []
+        while deadlines and deadlines[0][0] < now:
+            _, mac = heapq.heappop(deadlines)
+            entry = self.entries.get(mac)
+            if entry is None or not entry[0]: continue
+            deadline = entry[3] + self.timeout
+            if deadline >= now:
+                heapq.heappush(deadlines, (deadline, mac)) # Recebeu anúncios depois: novo prazo
+                continue
+            self.by_signal.remove((1, entry[1], mac))
+            self.by_signal.add((0, entry[1], mac))
+            self.entries[mac] = (0,) + entry[1:]
+            changed.append(mac)
+        return changed
+
+    def clear(self):
+        self.entries = {}
+        self.by_signal = SortedKeyList()
+        self.by_name = SortedKeyList()
+        self.by_mac = SortedKeyList()
+        self._deadlines = []
+
+    def by_rssi(self, min_rssi=None, max_rssi=None, include_inactive=True):
+        """
+        MACs em ordem de sinal decrescente (ativos primeiro). min_rssi/max_rssi
+        limitam os ativos pelo RSSI filtrado; os inativos vêm depois, se pedidos.
+        """
+        lo = None if min_rssi is None else (1, min_rssi)
+        hi = None if max_rssi is None else (1, max_rssi, "\uffff")
+        for _, _, mac in self.by_signal.irange(lo or (1,), hi, reverse=True):
+            yield mac
+        if include_inactive:
+            for _, _, mac in self.by_signal.irange(None, (0, 10 ** 9), reverse=True):
+                yield mac
+
+    def by_name_prefix(self, prefix="", reverse=False):
+        """MACs cujo nome normalizado começa por 'prefix', em ordem de nome."""
+        prefix = prefix.casefold()
+        hi = (prefix + "\U0010ffff",) if prefix else None
+        for _, mac in self.by_name.irange((prefix,), hi, reverse=reverse):
+            yield mac
+
+    def in_mac_order(self, reverse=False):
+        return self.by_mac.irange(reverse=reverse)
@@ -1,53 +1,500 @@
 import asyncio
+import heapq
 import time
-from bleak import BleakScanner
+
+from beacon_decoder import decode_advertisement, merge_fields
+from beacon_index import BeaconIndex
+from ring_buffer import AdvertHistory
+from rssi_filter import RssiFilterBank
+
+# Endereços anteriores lembrados por dispositivo lógico (com coalesce)
+MAX_ALIASES = 8
+
+# Com callback_latency, só 1 em cada N anúncios tem a duração do callback medida
+LATENCY_SAMPLE_EVERY = 64
+
+class BeaconSnapshot:
+    """
+    Retrato imutável do estado dos beacons publicado pela thread do scanner.
+
+    A thread do scanner nunca altera um snapshot depois de publicado: a cada
+    lote ela cria um novo dict e uma cópia do índice (index) e troca a
+    referência de uma só vez. Os dicts de cada beacon são compartilhados por
+    todos os leitores e não devem ser alterados.
+    """
+    __slots__ = ("version", "created", "beacons", "index")
+
+    def __init__(self, version, created, beacons, index):
+        self.version = version
+        self.created = created
+        self.beacons = beacons
+        self.index = index
 
 class BeaconScanner:
     """
     Biblioteca para escanear continuamente dispositivos BLE na proximidade,
     mantendo um histórico persistente de todos os dispositivos encontrados.
+
+    source_factory: fábrica da fonte de anúncios, chamada com detection_callback.
+    Por padrão usa o BleakScanner; para testes de carga sem rádio pode-se usar
+    o SyntheticAdvertSource (ver synthetic_source.py). Uma fonte com relógio
+    próprio (método clock(), como o ReplaySource de replay.py) define o
+    instante dos anúncios, da atividade, do esquecimento e das amostras no
+    lugar de time.time(). set_source() troca a fonte com o scanner parado.
+
+    Além do último estado de cada dispositivo (self.beacons), todos os anúncios
+    recebidos ficam em buffers circulares por MAC (self.history), limitados por
+    history_capacity amostras por dispositivo e history_max_bytes no total
+    (com max_devices, a capacidade por dispositivo é reduzida para que todos
+    os dispositivos mantidos caibam no orçamento; sem ele, é reduzida à medida
+    que surgem dispositivos, ver AdvertHistory).
+
+    Concorrência: self.beacons e self.history são escritos apenas pela thread
+    do asyncio (callback). A cada publish_interval segundos as alterações são
+    publicadas em lote num novo BeaconSnapshot (self.snapshot), cuja referência
+    é trocada atomicamente; a interface lê o snapshot em O(1), sem cópias.
+
+    Filtragem: cada anúncio também é enfileirado no RssiFilterBank
+    (self.filters, método filter_method). O lote é filtrado de uma vez na
+    publicação e cada beacon ganha o campo 'rssi_filtrado'.
+
+    Payloads iBeacon, AltBeacon e Eddystone são decodificados (com cache por
+    payload, ver beacon_decoder.py) e ficam no campo 'decodificado'.
+
+    Esquecimento: dispositivos sem anúncios há mais de idle_ttl segundos, e os
+    menos recentes além de max_devices, são removidos a cada evict_interval
+    segundos (None desativa cada critério). O histórico de anúncios de cada
+    dispositivo esquecido é entregue a spill.append_many(linhas), com linhas
+    (timestamp, MAC, nome, RSSI) — por exemplo um CaptureJournal.
+
+    coalesce=True liga a heurística de rotação de MAC: um endereço novo cujo
+    payload tem a mesma impressão digital (identidade decodificada ou bytes
+    de manufacturer data) de um dispositivo conhecido é tratado como o mesmo
+    dispositivo lógico, desde que o dispositivo anterior esteja calado há
+    coalesce_gap segundos (None = active_timeout, ou seja, já inativo). Isso
+    evita juntar aparelhos distintos que anunciam o mesmo payload ao mesmo
+    tempo (beacons de uma mesma frota, por exemplo); 0 une imediatamente. O
+    registro mantém o MAC original em 'mac' e o endereço atual em 'mac_atual'.
+
+    Consultas: a cada publicação os dispositivos alterados são reposicionados
+    num BeaconIndex (self.index) ordenado por atividade/RSSI filtrado, nome e
+    MAC, com atividade segundo active_timeout. query(), top_k(), rssi_range()
+    e name_prefix() percorrem só o trecho pedido do índice, sem ordenar todos
+    os dispositivos a cada chamada. Cada snapshot leva uma cópia do índice
+    (snapshot.index, com os blocos inalterados compartilhados), de modo que as
+    consultas de outras threads não disputam nenhum lock com a publicação.
+
+    Avisos: subscribe(listener) registra listener(alterados, removidos),
+    chamado na thread do scanner após cada publicação com os conjuntos de MACs
+    (inclui os que passaram a inativos). add_sampler(sink, interval) registra
+    sink(instante, snapshot), chamado a cada 'interval' segundos pelo laço de
+    publicação, independente de quem lê os snapshots e com que frequência.
+
+    stream (opcional) recebe cada anúncio com stream.push(instante, MAC, nome,
+    RSSI) e stream.forget(MAC) quando o dispositivo é esquecido, por exemplo
+    um AdvertStreamServer (ver advert_stream.py) iniciado no mesmo laço.
+
+    ingest (opcional) é o estágio de entrada (ver ingest_gate.IngestGate),
+    consultado antes de qualquer outro trabalho do callback: cópias exatas e
+    anúncios acima da taxa máxima por MAC são só dobrados num agregado, que
+    aparece no registro como 'agregado' = (anúncios, RSSI mín, RSSI máx, RSSI
+    médio) do último intervalo. Anúncios dobrados não entram no histórico,
+    nos filtros nem no stream, mas renovam o 'last_seen' do dispositivo.
+
+    Métricas: self.adverts conta os anúncios (inclusive os dobrados) e self.adverts_per_second é
+    recalculado a cada segundo de relógio real. callback_latency e publish_latency recebem
+    histogramas (ver metrics.register_scanner); com None nada é medido.
     """
-    def __init__(self):
+    def __init__(self, source_factory=None, history_capacity=1024, history_max_bytes=32 * 1024 * 1024,
+                 publish_interval=0.1, filter_method="ema", idle_ttl=None, max_devices=None, evict_interval=1.0,
+                 spill=None, coalesce=False, coalesce_gap=None, active_timeout=3.0, stream=None, ingest=None):
         self.beacons = {} 
-        self.scanner = BleakScanner(detection_callback=self._callback)
+        self.history = AdvertHistory(capacity=history_capacity, max_bytes=history_max_bytes, max_devices=max_devices)
+        self.filters = RssiFilterBank(filter_method)
+        self.publish_interval = publish_interval
+        self.idle_ttl = idle_ttl
+        self.max_devices = max_devices
+        self.evict_interval = evict_interval
+        self.spill = spill
+        self.stream = stream
+        self.ingest = ingest
+        self.coalesce = coalesce
+        self.coalesce_gap = active_timeout if coalesce_gap is None else coalesce_gap
+        self.evicted = 0
+        self.coalesced = 0
+        self.adverts = 0
+        self.adverts_per_second = 0.0
+        self.callback_latency = None
+        self.publish_latency = None
+        self._rate_mark = (0.0, 0)  # (instante, anúncios) da última medição da taxa
+        self.index = BeaconIndex(active_timeout)
+        self.snapshot = BeaconSnapshot(0, time.time(), {}, self.index.copy())
+        self._dirty = set()
+        self._removed = set()
+        self._aliases = {}          # MAC físico -> MAC lógico (com coalesce)
+        self._fingerprints = {}     # impressão digital -> MAC lógico
+        self._last_evict = 0.0
+        self._listeners = []
+        self._samplers = []         # [sink, intervalo, próximo instante]
+        self._loop = None
+        self._publisher = None
+        self.set_source(source_factory)
+
+    def set_source(self, source_factory):
+        """Troca a fonte de anúncios (None = BleakScanner). Só com o scanner parado; retorna a fonte nova."""
+        self.source_factory = source_factory
+        if source_factory is None:
+            from bleak import BleakScanner
+            source_factory = BleakScanner
+        self.scanner = source_factory(detection_callback=self._callback)
+        self.clock = getattr(self.scanner, "clock", time.time)
+        return self.scanner
 
     def _callback(self, device, advertisement_data):
         mac = device.address
-        nome = advertisement_data.local_name or device.name or "Desconhecido"
         rssi = advertisement_data.rssi
-        
-        self.beacons[mac] = {
-            "nome": nome,
-            "mac": mac,
-            "rssi": rssi,
-            "last_seen": time.time(),
-            "detalhes": advertisement_data.manufacturer_data
-        }
+        now = self.clock()
+        manufacturer_data = advertisement_data.manufacturer_data
+        service_data = getattr(advertisement_data, "service_data", None)
+        self.adverts += 1
+        timed = self.callback_latency is not None and not self.adverts % LATENCY_SAMPLE_EVERY
+        if timed: started = time.perf_counter()
+        ingest = self.ingest
+        if ingest is not None and not ingest.admit(mac, now, rssi, manufacturer_data, service_data):
+            # Dobrado ou cópia: fica fora do pipeline, mas o dispositivo continua vivo
+            info = self.beacons.get(self._aliases.get(mac, mac) if self.coalesce else mac)
+            if info is not None:
+                info["last_seen"] = now
+                self._dirty.add(info["mac"])
+            return
+        nome = advertisement_data.local_name or device.name or "Desconhecido"
+        if self.coalesce:
+            mac = self._aliases.get(mac) or self._resolve_alias(mac, now, manufacturer_data, service_data)
+
+        self.history.append(mac, now, rssi)
+        self.filters.push(mac, rssi)
+        if self.stream is not None: self.stream.push(now, mac, nome, rssi)
+        self._dirty.add(mac)
+
+        # Atualiza o registro existente no lugar, sem alocar um dict por anúncio
+        info = self.beacons.get(mac)
+        if info is None:
+            self.beacons[mac] = {
+                "nome": nome,
+                "mac": mac,
+                "rssi": rssi,
+                "last_seen": now,
+                "detalhes": manufacturer_data,
+                "servicos": service_data,
+                "decodificado": decode_advertisement(manufacturer_data, service_data)
+            }
+            if self.coalesce: self.beacons[mac]["mac_atual"] = device.address
+        else:
+            if ingest is not None:
+                interval = ingest.take(device.address)
+                if interval is not None: info["agregado"] = interval[1:]
+            info["nome"] = nome
+            info["rssi"] = rssi
+            info["last_seen"] = now
+            if self.coalesce: info["mac_atual"] = device.address
+            # Payload repetido (o caso comum) não passa nem pelo cache do decodificador
+            if manufacturer_data != info["detalhes"] or service_data != info["servicos"]:
+                info["detalhes"] = manufacturer_data
+                info["servicos"] = service_data
+                fields = decode_advertisement(manufacturer_data, service_data)
+                if fields is not None: info["decodificado"] = merge_fields(info["decodificado"], fields)
+
+        if timed: self.callback_latency.observe(time.perf_counter() - started)
+
+    def _fingerprint(self, manufacturer_data, service_data):
+        fields = decode_advertisement(manufacturer_data, service_data or {})
+        if fields is not None:
+            identity = tuple(fields.get(k) for k in ("tipo", "uuid", "major", "minor", "namespace", "instance", "url"))
+            if any(identity[1:]): return identity
+        if not manufacturer_data: return None
+        return tuple(sorted((k, bytes(v)) for k, v in manufacturer_data.items()))
+
+    def _resolve_alias(self, address, now, manufacturer_data, service_data):
+        """Primeiro anúncio de um endereço com coalesce: decide a qual dispositivo lógico ele pertence."""
+        fingerprint = self._fingerprint(manufacturer_data, service_data)
+        logical = self._fingerprints.get(fingerprint) if fingerprint is not None else None
+        info = self.beacons.get(logical) if logical is not None else None
+        if info is not None and now - info["last_seen"] >= self.coalesce_gap:
+            # O dispositivo anterior calou e um endereço novo surgiu com o mesmo payload: rotação
+            aliases = info.setdefault("aliases", [])
+            aliases.append(address)
+            if len(aliases) > MAX_ALIASES:
+                # Endereços antigos não voltam; se voltarem, a impressão digital os resolve de novo
+                self._aliases.pop(aliases.pop(0), None)
+            self.coalesced += 1
+        else:
+            logical = address
+            if fingerprint is not None: self._fingerprints[fingerprint] = address
+        self._aliases[address] = logical
+        return logical
+
+    def evict(self, now=None):
+        """
+        Esquece os dispositivos ociosos (idle_ttl) e os menos recentes além de
+        max_devices. Deve ser chamado na thread do scanner; retorna os MACs removidos.
+        """
+        if self.idle_ttl is None and self.max_devices is None: return []
+        if now is None: now = self.clock()
+        beacons = self.beacons
+        removed = []
+        if self.idle_ttl is not None:
+            limit = now - self.idle_ttl
+            removed = [mac for mac, info in beacons.items() if info["last_seen"] < limit]
+        if self.max_devices is not None:
+            excess = len(beacons) - len(removed) - self.max_devices
+            if excess > 0:
+                gone = set(removed)
+                candidates = ((info["last_seen"], mac) for mac, info in beacons.items() if mac not in gone)
+                removed.extend(mac for _, mac in heapq.nsmallest(excess, candidates))
+        if not removed: return removed
+
+        self.filters.process() # Nenhuma leitura pendente pode apontar para um slot liberado
+        rows = []
+        for mac in removed:
+            info = beacons.pop(mac)
+            buf = self.history.pop(mac)
+            if buf is not None and self.spill is not None:
+                ts, rs = buf.since(float("-inf"))
+                nome = info["nome"]
+                rows.extend(zip(ts, (mac,) * len(ts), (nome,) * len(ts), rs))
+            self.filters.release(mac)
+            if self.stream is not None: self.stream.forget(mac)
+            if self.ingest is not None:
+                self.ingest.forget(mac)
+                for alias in info.get("aliases", ()): self.ingest.forget(alias)
+            self._dirty.discard(mac)
+            self._removed.add(mac)
+            if self.coalesce:
+                self._aliases.pop(mac, None)
+                for alias in info.get("aliases", ()): self._aliases.pop(alias, None)
+        if self.coalesce:
+            gone = set(removed)
+            self._fingerprints = {fp: mac for fp, mac in self._fingerprints.items() if mac not in gone}
+        if rows: self.spill.append_many(rows)
+        self.evicted += len(removed)
+        return removed
+
+    def publish(self):
+        """
+        Publica as alterações pendentes num novo snapshot. Deve ser chamado na
+        thread do scanner; o custo é pago uma vez por lote, não por leitura.
+        """
+        if not self._dirty and not self._removed: return self.snapshot
+        started = time.perf_counter()
+        changed, removed = self._dirty, self._removed
+        filters = self.filters
+        filters.process()
+        previous = self.snapshot
+        beacons = dict(previous.beacons)
+        index = self.index
+        now = self.clock()
+        for mac in self._removed:
+            beacons.pop(mac, None)
+            index.remove(mac)
+        self._removed = set()
+        live = self.beacons
+        for mac in self._dirty:
+            info = live.get(mac)
+            if info is not None:
+                filtered = filters.value(mac)
+                info["rssi_filtrado"] = info["rssi"] if filtered is None else filtered
+                beacons[mac] = dict(info)
+                index.update(mac, info["nome"], info["rssi_filtrado"], info["last_seen"], now)
+        self._dirty = set()
+        self.snapshot = BeaconSnapshot(previous.version + 1, now, beacons, index.copy())
+        if self.publish_latency is not None: self.publish_latency.observe(time.perf_counter() - started)
+        for listener in self._listeners: listener(changed, removed)
+        return self.snapshot
+
+    async def _publish_loop(self):
+        while True:
+            await asyncio.sleep(self.publish_interval)
+            now = self.clock()
+            if now - self._last_evict >= self.evict_interval:
+                self._last_evict = now
+                self.evict(now)
+            wall = time.time()
+            mark_time, mark_count = self._rate_mark
+            if wall - mark_time >= 1.0:
+                if mark_time: self.adverts_per_second = (self.adverts - mark_count) / (wall - mark_time)
+                self._rate_mark = (wall, self.adverts)
+            if self.ingest is not None: self.flush_ingest(now)
+            self.publish()
+            # Passagem de ativo para inativo também muda a ordem, mesmo sem anúncios novos
+            now = self.clock()
+            expired = self.index.expire(now)
+            if expired:
+                previous = self.snapshot
+                self.snapshot = BeaconSnapshot(previous.version + 1, now, previous.beacons, self.index.copy())
+                for listener in self._listeners: listener(expired, ())
+            for sampler in self._samplers:
+                if now >= sampler[2]:
+                    # Mantém a cadência sem acumular atraso; depois de um engasgo não tenta compensar
+                    sampler[2] = sampler[2] + sampler[1] if now - sampler[2] < sampler[1] else now + sampler[1]
+                    sampler[0](now, self.snapshot)
+
+    def flush_ingest(self, now):
+        """Grava o agregado dos intervalos dobrados de dispositivos que calaram antes do próximo anúncio aceito."""
+        ingest, aliases = self.ingest, self._aliases
+        for address in ingest.flush(now):
+            interval = ingest.take(address)
+            mac = aliases.get(address, address)
+            info = self.beacons.get(mac)
+            if info is None or interval is None: continue
+            info["agregado"] = interval[1:]
+            self._dirty.add(mac)
 
     async def start(self):
+        self._loop = asyncio.get_running_loop()
         await self.scanner.start()
+        if self._publisher is None:
+            self._publisher = asyncio.ensure_future(self._publish_loop())
 
     async def stop(self):
         await self.scanner.stop()
+        if self._publisher is not None:
+            self._publisher.cancel()
+            self._publisher = None
+        self.publish()
+
+    def _clear(self):
+        self.beacons.clear()
+        self.history.clear()
+        self.filters.clear()
+        if self.ingest is not None: self.ingest.clear()
+        self._dirty = set()
+        self._removed = set()
+        self._aliases.clear()
+        self._fingerprints.clear()
+        # Com o relógio de uma reprodução o tempo pode voltar: prazos antigos não valem mais
+        self._last_evict = 0.0
+        for sampler in self._samplers: sampler[2] = 0.0
+        self.index.clear()
+
+    def clear(self):
+        """
+        Esquece todos os dispositivos e o histórico de anúncios. Pode ser chamado
+        de qualquer thread: um snapshot vazio é publicado imediatamente e a
+        limpeza do estado interno é feita na thread do scanner.
+        """
+        self.snapshot = BeaconSnapshot(self.snapshot.version + 1, self.clock(), {}, BeaconIndex(self.index.timeout))
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            loop.call_soon_threadsafe(self._clear)
+        else:
+            self._clear()
+
+    def set_filter(self, method, **params):
+        """
+        Troca o método (ou os parâmetros) do filtro de RSSI. Como clear(), pode
+        ser chamado de qualquer thread; o estado dos filtros recomeça do zero.
+        """
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            loop.call_soon_threadsafe(lambda: self.filters.configure(method, **params))
+        else:
+            self.filters.configure(method, **params)
+
+    def subscribe(self, listener):
+        """Registra listener(alterados, removidos), chamado na thread do scanner após cada publicação."""
+        self._listeners.append(listener)
+
+    def add_sampler(self, sink, interval=1.0):
+        """Registra sink(instante, snapshot), chamado na thread do scanner a cada 'interval' segundos."""
+        self._samplers.append([sink, interval, 0.0])
+
+    def get_snapshot(self):
+        """Retorna o snapshot publicado mais recente (O(1), sem cópia)."""
+        return self.snapshot
+
+    def get_history(self, mac, since=0.0):
+        """
+        Retorna (timestamps, rssi) de todos os anúncios do MAC recebidos desde
+        o instante 'since' (epoch), como arrays compactos.
+        """
+        return self.history.since(mac, since)
+
+    def query(self, order="rssi", reverse=False, min_rssi=None, max_rssi=None, name_prefix=None, active_only=False,
+              limit=None):
+        """
+        Beacons do último snapshot em ordem, pelo índice incremental:
+
+            order="rssi"  ativos primeiro, do sinal filtrado mais forte ao mais fraco
+            order="nome"  ordem alfabética do nome (sem diferenciar maiúsculas)
+            order="mac"   ordem do endereço
+
+        min_rssi/max_rssi limitam o RSSI filtrado (em dBm inteiros; na ordem
+        por sinal só os ativos), name_prefix o começo do nome, reverse inverte
+        a ordem e limit corta o resultado nos primeiros N. Retorna cópias dos
+        dicts do snapshot com a flag 'is_active'.
+        """
+        snapshot = self.snapshot # Índice e beacons do mesmo lote, sem lock
+        index, beacons = snapshot.index, snapshot.beacons
+        entries = index.entries
+        ranged = min_rssi is not None or max_rssi is not None
+        prefix = name_prefix.casefold() if name_prefix else None
+        if order == "rssi":
+            macs = index.by_rssi(min_rssi, max_rssi, include_inactive=not (active_only or ranged))
+            if reverse: macs = reversed(list(macs)) # Do mais fraco ao mais forte: só os MACs são materializados
+            ranged = False
+        elif order == "nome":
+            macs = index.by_name_prefix(prefix or "", reverse)
+            prefix = None
+        elif order == "mac":
+            macs = index.in_mac_order(reverse)
+        else:
+            raise ValueError(f"Ordem desconhecida: {order} (use rssi, nome ou mac)")
+
+        result = []
+        for mac in macs:
+            entry = entries[mac]
+            if active_only and not entry[0]: continue
+            if prefix is not None and not entry[2].startswith(prefix): continue
+            if ranged and ((min_rssi is not None and entry[1] < min_rssi) or (max_rssi is not None and entry[1] > max_rssi)): continue
+            result.append(dict(beacons[mac], is_active=entry[0] == 1))
+            if limit is not None and len(result) >= limit: break
+        return result
+
+    def top_k(self, k):
+        """Os k beacons ativos de sinal filtrado mais forte."""
+        return self.query("rssi", active_only=True, limit=k)
+
+    def rssi_range(self, min_rssi, max_rssi):
+        """Beacons ativos com RSSI filtrado entre min_rssi e max_rssi (dBm), do mais forte ao mais fraco."""
+        return self.query("rssi", min_rssi=min_rssi, max_rssi=max_rssi)
+
+    def name_prefix(self, prefix, limit=None):
+        """Beacons cujo nome começa por 'prefix' (sem diferenciar maiúsculas), em ordem alfabética."""
+        return self.query("nome", name_prefix=prefix, limit=limit)
 
     def get_all_beacons(self, timeout=3.0, name_filter=None):
         """
-        Retorna a lista de TODOS os beacons já vistos.
-        Adiciona a flag 'is_active' se foi visto nos últimos 'timeout' segundos.
+        Retorna a lista de TODOS os beacons já vistos (segundo o último snapshot).
+        Cada item é uma cópia com a flag 'is_active' (visto nos últimos 'timeout' segundos).
         """
-        current_time = time.time()
+        if timeout == self.index.timeout:
+            # Mesmo critério de atividade do índice: a ordem já está pronta
+            result = self.query("rssi")
+            if name_filter is not None:
+                name_filter = name_filter.casefold()
+                result = [data for data in result if name_filter in data["nome"].casefold()]
+            return result
+
+        current_time = self.clock()
         result = []
+        if name_filter is not None: name_filter = name_filter.lower()
         
-        for mac, data in list(self.beacons.items()):
-            if name_filter is None or name_filter.lower() in data["nome"].lower():
+        # Os dicts do snapshot são compartilhados: a flag vai numa cópia
+        for data in self.snapshot.beacons.values():
+            if name_filter is None or name_filter in data["nome"].lower():
                 # Calcula se o beacon deu sinal recentemente
-                is_active = (current_time - data["last_seen"]) <= timeout
-                
-                # Cria uma cópia dos dados e adiciona o status
-                beacon_info = data.copy()
-                beacon_info["is_active"] = is_active
-                result.append(beacon_info)
+                result.append(dict(data, is_active=(current_time - data["last_seen"]) <= timeout))
         
-        # Ordena a lista: Primeiro os Online (True), depois pelo sinal (maior para o menor)
-        result.sort(key=lambda x: (x["is_active"], x["rssi"]), reverse=True)
+        # Ordena a lista: Primeiro os Online (True), depois pelo sinal filtrado (maior para o menor)
+        result.sort(key=lambda x: (x["is_active"], x["rssi_filtrado"]), reverse=True)
         return result
@@ -2,18 +2,100 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import asyncio
 import threading
-from datetime import datetime
+import time
+import os
+import bisect
 from collections import deque
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import csv
+import math
+from functools import partial
 
 from beacon_scanner import BeaconScanner
+from ingest_gate import IngestGate
+from change_queue import ChangeQueue
+from metrics import MetricsRegistry, MetricsServer, register_journal, register_scanner
+from rssi_plot import RssiPlot
+from rssi_heatmap import HeatmapMatrix, RssiHeatmap
+from plot_export import MARKER_LIMIT, PlotExporter, PlotSpec, file_slug
+from telemetry_store import StoreExporter, TelemetryStore, format_timestamp
+from capture_journal import CaptureJournal
+from presence import DEVICE_HEADER, SESSION_HEADER, PresenceAnalysis, SessionTracker
+from csv_import import CsvImporter
+from recording import Recording
+from replay import SPEEDS, ReplaySource, ReplayTape, format_duration, format_speed
+from ring_buffer import BYTES_PER_SAMPLE, TieredRssiBuffer
+from downsample import break_gaps, lttb
+from beacon_decoder import EXPORT_FIELDS, describe, export_values
+
+IDLE_TTL = 15 * 60 # Dispositivos calados há mais que isto são esquecidos (histórico vai para o diário)
+MAX_DEVICES = 5000 # Acima disto os dispositivos menos recentes são esquecidos
+FILTER_METHODS = {"EMA": "ema", "Mediana": "median", "Kalman": "kalman"}
+# Colunas cuja ordem ao vivo vem do índice do scanner (BeaconScanner.query)
+INDEX_ORDERS = {"filtrado": "rssi", "status": "rssi", "nome": "nome", "mac": "mac"}
+DEFAULT_JOURNAL_DIR = os.path.join(os.path.expanduser("~"), ".radar_ble", "diario")
+SAMPLE_INTERVAL = 1.0 # Segundos entre as leituras gravadas de cada beacon ativo (independe do redesenho)
+PLOT_WINDOWS = ["30s", "60s", "120s", "300s", "1h", "24h", "Tudo"] # Janelas do gráfico e do mapa de calor
+MAX_PLOT_WINDOW = 24 * 3600 # Maior janela com duração ("24h", também o maior período da exportação em lote)
+PLOT_RAW_SPAN = 3600 # Trecho mais recente do gráfico em resolução completa (uma amostra por SAMPLE_INTERVAL)
+MAX_PLOT_HISTORY = int(PLOT_RAW_SPAN / SAMPLE_INTERVAL)
+PLOT_LONG_BUCKET = 60.0 # Além de PLOT_RAW_SPAN, o gráfico guarda só a média de cada balde de N segundos
+PLOT_LONG_HISTORY = int(MAX_PLOT_WINDOW / PLOT_LONG_BUCKET)
+PLOT_HISTORY_INITIAL = 256 # Posições alocadas no início; os buffers dobram até a capacidade
+ACTIVE_TIMEOUT = 3.0 # Segundos sem anúncio para um beacon ser exibido como offline
+PLOT_GAP = ACTIVE_TIMEOUT + SAMPLE_INTERVAL # Sem leituras por mais que isto (offline), a linha é interrompida
+INGEST_MAX_RATE = 20.0 # Anúncios/s processados por MAC; o excesso só entra no agregado do dispositivo
+EXPORT_PERIODS = {"10min": 600, "1h": 3600, "6h": 6 * 3600, "24h": 24 * 3600} # Períodos da exportação em lote
+PRESENCE_ROWS = 2000 # Linhas exibidas na janela de presença (a exportação leva todas)
+REPLAY_POLL_MS = 250 # Intervalo de atualização da barra de reprodução
+
+class RefreshPacer:
+    """
+    Decide quando redesenhar. Com dados chegando, os quadros saem a cada
+    min_interval; sem alterações nada é agendado (a ChangeQueue acorda a
+    interface). Quadros lentos alongam o intervalo para que o redesenho ocupe
+    no máximo a fração 'budget' da thread da interface, até max_interval.
+    """
+    def __init__(self, min_interval=0.25, max_interval=2.0, budget=0.3):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.budget = budget
+        self.frame_time = 0.0 # Média móvel da duração dos quadros (s)
+        self.last_frame = 0.0
+
+    def interval(self):
+        return min(self.max_interval, max(self.min_interval, self.frame_time / self.budget))
+
+    def delay_ms(self, now):
+        """Espera até o próximo quadro, contada a partir do fim do anterior"""
+        return max(0, int((self.last_frame + self.interval() - now) * 1000))
+
+    def record(self, started, finished):
+        duration = finished - started
+        self.frame_time = duration if not self.frame_time else 0.7 * self.frame_time + 0.3 * duration
+        self.last_frame = finished
+
+def stable_positions(positions):
+    """
+    Retorna os índices de uma subsequência crescente máxima de 'positions'.
+    As linhas nesses índices já estão na ordem certa e não precisam ser movidas.
+    """
+    tails, tails_idx, prev = [], [], [None] * len(positions)
+    for i, pos in enumerate(positions):
+        k = bisect.bisect_left(tails, pos)
+        if k == len(tails):
+            tails.append(pos); tails_idx.append(i)
+        else:
+            tails[k] = pos; tails_idx[k] = i
+        prev[i] = tails_idx[k - 1] if k > 0 else None
 
-MAX_PLOT_HISTORY = 3600 
+    stable = set()
+    i = tails_idx[-1] if tails_idx else None
+    while i is not None:
+        stable.add(i)
+        i = prev[i]
+    return stable
 
 class BeaconApp:
-    def __init__(self, root):
+    def __init__(self, root, scanner=None, journal_dir=None, metrics_port=None, source_factory=None):
         self.root = root
         self.root.title("Radar BLE - Escaner de Beacons")
         self.root.geometry("1200x850") # Um pouco maior para respirar bem
@@ -23,16 +105,27 @@ class BeaconApp:
 
         self.history = {}
         self.last_known_beacons = []
+        self.table_rows = {} # MAC -> (valores, tag) exibidos na linha cujo iid é o próprio MAC
         self.is_scanning = False 
-        self.export_data = [] 
+        self.store = TelemetryStore() # Todas as leituras capturadas/importadas, em colunas compactas
+        self.viewing_import = False
+        self.importer = None
+        self.recording = None # Gravação .rble aberta (mapeada em memória) durante a visualização
+        self.import_end = None # Instante da última leitura importada, referência do eixo X
         
-        self.sort_col = "rssi"
+        self.sort_col = "filtrado"
         self.sort_reverse = True
         self.col_names = {
             "mac": "Endereço MAC", 
             "status": "Status", 
             "rssi": "Sinal (RSSI)", 
-            "nome": "Nome"
+            "filtrado": "Sinal Filtrado",
+            "nome": "Nome",
+            "tipo": "Tipo",
+            "ident": "Identificador",
+            "major": "Major",
+            "minor": "Minor",
+            "tx": "TX (dBm)"
         }
         
         self.custom_title = None
@@ -40,7 +133,50 @@ class BeaconApp:
         self.custom_ylabel = None
         self.custom_legends = {} 
         
-        self.scanner = BeaconScanner()
+        # Diário em disco: toda leitura ao vivo é gravada continuamente em segundo plano.
+        # Os anúncios dos dispositivos esquecidos pelo scanner vão para segmentos próprios.
+        self.journal = CaptureJournal(journal_dir or DEFAULT_JOURNAL_DIR)
+        self.journal.start()
+        self.spill_journal = CaptureJournal(journal_dir or DEFAULT_JOURNAL_DIR, prefix="esquecidos")
+        self.spill_journal.start()
+
+        # source_factory: outra fonte de anúncios no lugar do rádio local (ex.: StreamSource de um agregador)
+        self.scanner = scanner if scanner is not None else BeaconScanner(source_factory, idle_ttl=IDLE_TTL, max_devices=MAX_DEVICES,
+                                                                         spill=self.spill_journal,
+                                                                         active_timeout=ACTIVE_TIMEOUT,
+                                                                         ingest=IngestGate(INGEST_MAX_RATE))
+        self.live_source = self.scanner.source_factory # Fonte restaurada ao encerrar uma reprodução
+        self.replay = None # ReplaySource em uso no lugar da fonte ao vivo
+        self.replay_seeking = False
+
+        # O scanner avisa o que mudou pela fila coalescente e grava as amostras no
+        # seu próprio laço: a taxa de redesenho não afeta os dados capturados.
+        self.changes = ChangeQueue(notify=self.notify_changes)
+        self.samples = deque() # (instante, ativos) gravados pelo scanner, ainda fora do store/gráfico
+        self.pacer = RefreshPacer()
+        self.refresh_job = None
+        self.scanner.subscribe(self.changes.push)
+        self.scanner.add_sampler(self.record_sample, SAMPLE_INTERVAL)
+        self.sessions = SessionTracker() # Sessões de presença detectadas ao vivo
+        self.sessions.attach(self.scanner)
+        self.analysis = None
+        self.exporter = None
+
+        # Métricas do pipeline (self.metrics.snapshot()); com metrics_port também em http://127.0.0.1:porta/metrics
+        self.metrics = MetricsRegistry()
+        register_scanner(self.metrics, self.scanner)
+        register_journal(self.metrics, self.journal)
+        register_journal(self.metrics, self.spill_journal)
+        self.table_time = self.metrics.histogram("radar_ui_refresh_table_seconds", "Duração de refresh_table")
+        self.plot_time = self.metrics.histogram("radar_ui_update_plot_seconds", "Duração de update_plot")
+        self.metrics.gauge("radar_ui_pending_changes", "MACs alterados aguardando o próximo quadro", lambda: len(self.changes))
+        self.metrics.gauge("radar_ui_pending_samples", "Amostras aguardando inclusão no store", lambda: len(self.samples))
+        self.metrics.gauge("radar_ui_store_bytes", "Memória das leituras mantidas para exportação", lambda: self.store.memory_bytes())
+        self.metrics.gauge("radar_ui_store_rows", "Leituras mantidas para exportação", lambda: len(self.store))
+        self.metrics.gauge("radar_ui_plot_history_bytes", "Memória do histórico do gráfico",
+                           lambda: sum(h['buffer'].size * BYTES_PER_SAMPLE for h in list(self.history.values()) if 'buffer' in h))
+        self.metrics_server = MetricsServer(self.metrics, metrics_port) if metrics_port is not None else None
+        if self.metrics_server is not None: self.metrics_server.start()
         
         self.setup_styles()
         self.setup_ui()
@@ -49,7 +185,13 @@ class BeaconApp:
         self.bg_thread = threading.Thread(target=self.start_asyncio_thread, daemon=True)
         self.bg_thread.start()
 
-        self.root.after(1000, self.update_ui)
+        self.root.bind("<<BeaconsChanged>>", self.schedule_refresh)
+        self.root.bind("<<ReplayRewound>>", lambda e: self.clear_capture())
+        if self.journal.recovered:
+            self.root.after(500, self.notify_recovered)
+
+    def notify_recovered(self):
+        messagebox.showinfo("Capturas Recuperadas", f"{len(self.journal.recovered)} arquivo(s) de captura de uma sessão anterior foram recuperados em:\n{self.journal.directory}")
 
     def setup_styles(self):
         """Configura os estilos globais da aplicação (Cores, Fontes e Temas)"""
@@ -134,6 +276,10 @@ class BeaconApp:
         self.btn_import.pack(side=tk.LEFT, padx=(0, 5))
         self.btn_export = self.create_button(btn_frame2, "💾 Exportar CSV", "secondary", self.action_export, state=tk.DISABLED)
         self.btn_export.pack(side=tk.LEFT, padx=5)
+        self.btn_presence = self.create_button(btn_frame2, "📊 Presença", "secondary", self.action_presence)
+        self.btn_presence.pack(side=tk.LEFT, padx=5)
+        self.btn_replay = self.create_button(btn_frame2, "⏯ Reproduzir", "secondary", self.action_replay)
+        self.btn_replay.pack(side=tk.LEFT, padx=5)
 
         # Status à direita
         status_group = ttk.Frame(top_bar_inner, style="Card.TFrame")
@@ -141,6 +287,25 @@ class BeaconApp:
         self.lbl_status = ttk.Label(status_group, text="Status: Parado", style="Status.TLabel")
         self.lbl_status.pack(side=tk.BOTTOM, anchor="e")
 
+        # --- BARRA DE REPRODUÇÃO (exibida só enquanto uma gravação é reproduzida) ---
+        self.replay_bar = ttk.Frame(self.root, style="Card.TFrame")
+        replay_inner = ttk.Frame(self.replay_bar, style="Card.TFrame")
+        replay_inner.pack(fill=tk.X, padx=15, pady=10)
+        ttk.Label(replay_inner, text="Reprodução", style="Header.TLabel").pack(side=tk.LEFT)
+        ttk.Label(replay_inner, text="Velocidade:", style="Card.TLabel").pack(side=tk.LEFT, padx=(15, 0))
+        self.speed_var = tk.StringVar(value="1×")
+        self.combo_speed = ttk.Combobox(replay_inner, textvariable=self.speed_var, values=list(SPEEDS), width=6, state="readonly")
+        self.combo_speed.pack(side=tk.LEFT, padx=(5, 15))
+        self.combo_speed.bind("<<ComboboxSelected>>", lambda e: self.action_replay_speed())
+        self.lbl_replay = ttk.Label(replay_inner, text="", style="Card.TLabel")
+        self.lbl_replay.pack(side=tk.RIGHT)
+        # Arrastar o cursor não mexe na reprodução; o salto acontece ao soltar
+        self.replay_pos = tk.DoubleVar(value=0.0)
+        self.scale_replay = ttk.Scale(replay_inner, from_=0.0, to=1.0, orient=tk.HORIZONTAL, variable=self.replay_pos)
+        self.scale_replay.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 15))
+        self.scale_replay.bind("<ButtonPress-1>", lambda e: setattr(self, "replay_seeking", True))
+        self.scale_replay.bind("<ButtonRelease-1>", lambda e: self.action_seek())
+
         # --- ÁREA PRINCIPAL DIVIDIDA (PANED WINDOW) ---
         # Isso permite ao usuário redimensionar o gráfico vs tabela!
         self.paned_window = ttk.PanedWindow(self.root, orient=tk.VERTICAL)
@@ -160,12 +325,21 @@ class BeaconApp:
         filter_frame = ttk.Frame(table_header, style="Card.TFrame")
         filter_frame.pack(side=tk.RIGHT)
         
+        ttk.Label(filter_frame, text="Buscar:", style="Card.TLabel").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", lambda *args: self.apply_filter())
+        ttk.Entry(filter_frame, textvariable=self.search_var, width=18).pack(side=tk.LEFT, padx=(5, 15))
+
         ttk.Label(filter_frame, text="Potência Mínima:", style="Card.TLabel").pack(side=tk.LEFT)
         self.rssi_var = tk.IntVar(value=-100)
         self.spin_rssi = ttk.Spinbox(filter_frame, from_=-100, to=0, textvariable=self.rssi_var, width=5, command=self.apply_filter)
         self.spin_rssi.pack(side=tk.LEFT, padx=(5, 15))
         self.spin_rssi.bind("<Return>", lambda e: self.apply_filter())
         
+        self.coalesce_var = tk.BooleanVar(value=self.scanner.coalesce)
+        ttk.Checkbutton(filter_frame, text="Unir MACs rotativos", variable=self.coalesce_var,
+                        command=lambda: setattr(self.scanner, "coalesce", self.coalesce_var.get())).pack(side=tk.LEFT, padx=(0, 15))
+
         btn_clear = self.create_button(filter_frame, "Limpar Seleção", "light", self.clear_selection)
         btn_clear.pack(side=tk.LEFT)
 
@@ -176,7 +350,7 @@ class BeaconApp:
         tree_scroll = ttk.Scrollbar(tree_frame)
         tree_scroll.pack(side=tk.RIGHT, fill=tk.Y)
         
-        columns = ("mac", "status", "rssi", "nome")
+        columns = ("mac", "status", "rssi", "filtrado", "nome", "tipo", "ident", "major", "minor", "tx")
         self.tree = ttk.Treeview(tree_frame, columns=columns, show="headings", yscrollcommand=tree_scroll.set, selectmode="extended")
         tree_scroll.config(command=self.tree.yview)
         
@@ -186,7 +360,13 @@ class BeaconApp:
         self.tree.column("mac", width=160, anchor="center")
         self.tree.column("status", width=100, anchor="center")
         self.tree.column("rssi", width=100, anchor="center")
-        self.tree.column("nome", width=300, anchor="w")
+        self.tree.column("filtrado", width=110, anchor="center")
+        self.tree.column("nome", width=200, anchor="w")
+        self.tree.column("tipo", width=90, anchor="center")
+        self.tree.column("ident", width=260, anchor="w")
+        self.tree.column("major", width=60, anchor="center")
+        self.tree.column("minor", width=60, anchor="center")
+        self.tree.column("tx", width=70, anchor="center")
         
         self.tree.tag_configure("online", foreground="#212529")
         self.tree.tag_configure("offline", foreground="#ADB5BD")
@@ -210,17 +390,40 @@ class BeaconApp:
         
         ttk.Label(graph_actions, text="Exibir últimos:", style="Card.TLabel").pack(side=tk.LEFT)
         self.time_window_var = tk.StringVar(value="60s")
-        self.combo_time = ttk.Combobox(graph_actions, textvariable=self.time_window_var, values=["30s", "60s", "120s", "300s", "Tudo"], width=6, state="readonly")
+        self.combo_time = ttk.Combobox(graph_actions, textvariable=self.time_window_var, values=PLOT_WINDOWS, width=6, state="readonly")
         self.combo_time.pack(side=tk.LEFT, padx=(5, 15))
         self.combo_time.bind("<<ComboboxSelected>>", lambda e: self.update_plot())
+
+        ttk.Label(graph_actions, text="Visualização:", style="Card.TLabel").pack(side=tk.LEFT)
+        self.view_var = tk.StringVar(value="Linhas")
+        self.combo_view = ttk.Combobox(graph_actions, textvariable=self.view_var, values=["Linhas", "Mapa de calor"], width=13, state="readonly")
+        self.combo_view.pack(side=tk.LEFT, padx=(5, 15))
+        self.combo_view.bind("<<ComboboxSelected>>", lambda e: self.update_plot())
+
+        ttk.Label(graph_actions, text="Sinal:", style="Card.TLabel").pack(side=tk.LEFT)
+        self.signal_var = tk.StringVar(value="Bruto")
+        self.combo_signal = ttk.Combobox(graph_actions, textvariable=self.signal_var, values=["Bruto", "Filtrado", "Ambos"], width=8, state="readonly")
+        self.combo_signal.pack(side=tk.LEFT, padx=(5, 15))
+        self.combo_signal.bind("<<ComboboxSelected>>", lambda e: self.update_plot())
+
+        ttk.Label(graph_actions, text="Filtro:", style="Card.TLabel").pack(side=tk.LEFT)
+        self.filter_var = tk.StringVar(value=next(k for k, v in FILTER_METHODS.items() if v == self.scanner.filters.method))
+        self.combo_filter = ttk.Combobox(graph_actions, textvariable=self.filter_var, values=list(FILTER_METHODS), width=8, state="readonly")
+        self.combo_filter.pack(side=tk.LEFT, padx=(5, 15))
+        self.combo_filter.bind("<<ComboboxSelected>>", lambda e: self.action_filter())
         
         self.create_button(graph_actions, "⚙️ Personalizar", "secondary", self.action_config_plot).pack(side=tk.LEFT, padx=5)
         self.create_button(graph_actions, "🖼️ Salvar", "primary", self.action_save_plot).pack(side=tk.LEFT)
+        self.create_button(graph_actions, "🗂️ Lote", "secondary", self.action_batch_plot).pack(side=tk.LEFT, padx=(5, 0))
 
         # Área do Canvas do Matplotlib
         graph_frame = ttk.Frame(graph_container)
         graph_frame.pack(fill=tk.BOTH, expand=True, padx=15, pady=(0, 15))
         
+        # Matplotlib só é carregado aqui, quando a janela realmente precisa do gráfico
+        import matplotlib.pyplot as plt
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
         self.fig, self.ax = plt.subplots(figsize=(8, 4))
         self.ax.set_title("Potência do Sinal (RSSI) ao longo do tempo")
         self.ax.set_xlabel("Leituras")
@@ -231,6 +434,11 @@ class BeaconApp:
 
         self.canvas = FigureCanvasTkAgg(self.fig, master=graph_frame)
         self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.plot = RssiPlot(self.fig, self.ax, self.canvas, "Selecione dispositivos na tabela acima para visualizá-los aqui.")
+        # Mapa de calor num segundo eixo na mesma posição; só um dos dois fica visível
+        self.reset_heatmap()
+        self.heatmap = RssiHeatmap(self.fig, self.fig.add_subplot(self.ax.get_subplotspec()), self.canvas,
+                                   "Nenhum dispositivo com histórico para exibir.")
 
     # ==========================================
     # LÓGICA DE INTERFACE E BOTÕES
@@ -270,7 +478,8 @@ class BeaconApp:
             self.btn_start.config(state=tk.DISABLED)
             self.btn_pause.config(state=tk.NORMAL)
             self.btn_stop.config(state=tk.NORMAL)
-            self.lbl_status.config(text="Status: Escaneando ao vivo...", foreground="#198754") # Verde
+            if self.replay is not None: self.show_replay_status()
+            else: self.lbl_status.config(text="Status: Escaneando ao vivo...", foreground="#198754") # Verde
 
     def action_pause(self):
         if self.is_scanning:
@@ -282,26 +491,25 @@ class BeaconApp:
             self.lbl_status.config(text="Status: Pausado", foreground="#FFC107") # Amarelo
 
     def action_stop(self):
-        if len(self.export_data) > 0:
-            resposta = messagebox.askyesnocancel("Atenção - Perda de Dados", "Você possui dados coletados na memória. Se parar agora, o histórico será apagado.\n\nDeseja EXPORTAR os dados antes de limpar?")
+        if len(self.store) > 0:
+            resposta = messagebox.askyesnocancel("Atenção - Perda de Dados", "Você possui dados coletados na memória. Se parar agora, o histórico será apagado (os arquivos do diário de captura continuam em disco).\n\nDeseja EXPORTAR os dados antes de limpar?")
             if resposta is None: return
             elif resposta is True:
                 sucesso = self.action_export()
                 if not sucesso: return 
 
-        if self.is_scanning:
+        if self.replay is not None:
+            self.stop_replay()
+        elif self.is_scanning:
             asyncio.run_coroutine_threadsafe(self.scanner.stop(), self.loop)
-            self.is_scanning = False
+        self.is_scanning = False
         
-        self.history.clear()
-        self.last_known_beacons.clear()
-        self.export_data.clear() 
-        self.scanner.beacons.clear()
-        
-        for row in self.tree.get_children():
-            self.tree.delete(row)
-            
-        self.update_plot()
+        self.clear_capture()
+        self.import_end = None
+        self.close_recording()
+        self.journal.new_session()
+        self.viewing_import = False
+        self.scanner.clear()
         
         self.btn_start.config(state=tk.NORMAL, text="▶ Iniciar")
         self.btn_pause.config(state=tk.DISABLED)
@@ -309,72 +517,401 @@ class BeaconApp:
         self.btn_export.config(state=tk.DISABLED)
         self.lbl_status.config(text="Status: Parado e Limpo", foreground="#DC3545") # Vermelho
 
+    def clear_capture(self):
+        """Apaga da interface as leituras em memória: histórico, amostras, sessões, store, tabela e gráfico"""
+        self.history.clear()
+        self.reset_heatmap()
+        self.last_known_beacons.clear()
+        self.samples.clear()
+        self.changes.drain()
+        self.sessions.clear()
+        self.store.clear()
+        
+        self.tree.delete(*self.tree.get_children())
+        self.table_rows.clear()
+            
+        self.update_plot()
+
     def action_export(self):
-        if not self.export_data:
+        if not self.store:
             messagebox.showwarning("Aviso", "Não há dados coletados para exportar.")
             return False
 
-        filepath = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("Arquivos CSV", "*.csv")], title="Salvar leitura de Beacons")
+        filepath = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("Arquivos CSV", "*.csv"), ("Gravação Radar BLE", "*.rble")], title="Salvar leitura de Beacons")
         if not filepath: return False 
             
-        try:
-            with open(filepath, mode='w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f, delimiter=',')
-                writer.writerow(["Timestamp", "MAC", "Nome", "RSSI"])
-                writer.writerows(self.export_data)
-                
-            messagebox.showinfo("Sucesso", f"Dados exportados com sucesso!\n{len(self.export_data)} registos salvos.")
-            return True
-        except Exception as e:
-            messagebox.showerror("Erro", f"Não foi possível salvar o arquivo:\n{e}")
-            return False
+        # A gravação roda em segundo plano sobre uma cópia do store: a interface não
+        # trava e quem pediu a exportação (parar, importar) já pode limpar a memória.
+        # O CSV leva também o RSSI filtrado, calculado por MAC sobre todas as leituras,
+        # (com um retrato do filtro atual, já que o do scanner pode ser trocado durante
+        # a gravação) e os campos decodificados (iBeacon/Eddystone/AltBeacon) de cada MAC
+        decoded = {b['mac']: export_values(b.get('decodificado')) for b in self.last_known_beacons}
+        exporter = StoreExporter(filepath, self.store.copy(), self.scanner.filters.snapshot(),
+                                 [header for _, header in EXPORT_FIELDS], decoded)
+        exporter.start()
+        self.show_progress("Exportando Dados", exporter.cancel)
+        # Referências próprias: uma importação iniciada em seguida abre outra janela de progresso
+        self.root.after(100, self.poll_store_export, exporter, self.progress_dialog, self.lbl_progress, self.bar_progress)
+        return True
+
+    def poll_store_export(self, exporter, dialog, label, bar):
+        if not exporter.done:
+            pct = exporter.progress * 100
+            bar["value"] = pct
+            label.config(text="Cancelando..." if exporter.cancelled else f"Gravando arquivo... {pct:.0f}%")
+            self.root.after(100, self.poll_store_export, exporter, dialog, label, bar)
+            return
+
+        dialog.destroy()
+        if exporter.error is not None:
+            messagebox.showerror("Erro", f"Não foi possível salvar o arquivo:\n{exporter.error}")
+        elif exporter.total is None:
+            self.lbl_status.config(text="Status: Exportação cancelada", foreground="#6c757d")
+        else:
+            messagebox.showinfo("Sucesso", f"Dados exportados com sucesso!\n{exporter.total} registos salvos.")
 
     def action_import(self):
         if self.is_scanning:
             messagebox.showwarning("Aviso", "Por favor, pause ou pare o radar ao vivo antes de importar um histórico.")
             return
 
-        if len(self.export_data) > 0:
+        if len(self.store) > 0:
             resposta = messagebox.askyesnocancel("Atenção", "Existem dados atualmente na memória. Importar um arquivo irá substituí-listos.\n\nDeseja EXPORTAR os dados atuais antes de prosseguir?")
             if resposta is None: return
             elif resposta is True:
                 if not self.action_export(): return 
 
-        filepath = filedialog.askopenfilename(defaultextension=".csv", filetypes=[("Arquivos CSV", "*.csv")], title="Importar leitura")
+        filepath = filedialog.askopenfilename(defaultextension=".csv", filetypes=[("Arquivos CSV", "*.csv"), ("Gravação Radar BLE", "*.rble")], title="Importar leitura")
         if not filepath: return
 
+        if filepath.lower().endswith(".rble"):
+            # Gravação binária: só o índice é lido, os dados ficam mapeados em memória
+            try:
+                recording = Recording(filepath)
+                result = recording.import_result()
+            except (OSError, ValueError) as e:
+                messagebox.showerror("Erro", f"Não foi possível abrir a gravação.\n\nDetalhes: {e}")
+                return
+            self.apply_import(result, recording)
+            return
+
         try:
-            self.history.clear()
-            self.export_data.clear()
-            latest_beacons_dict = {}
-
-            with open(filepath, mode='r', encoding='utf-8') as f:
-                reader = csv.reader(f, delimiter=',')
-                header = next(reader, None) 
-                for row in reader:
-                    if len(row) < 4: continue 
-                    timestamp, mac, nome, rssi_str = row
-                    try: rssi = int(rssi_str)
-                    except ValueError: continue 
-
-                    self.export_data.append(row)
-
-                    if mac not in self.history:
-                        self.history[mac] = {'nome': nome, 'rssi_history': deque(maxlen=MAX_PLOT_HISTORY), 'is_imported': True}
-                    self.history[mac]['rssi_history'].append(rssi)
-                    latest_beacons_dict[mac] = {'mac': mac, 'nome': nome, 'rssi': rssi, 'is_active': True, 'is_imported': True}
-
-            self.last_known_beacons = list(latest_beacons_dict.values())
+            self.importer = CsvImporter(filepath)
+        except OSError as e:
+            messagebox.showerror("Erro", f"Não foi possível ler o ficheiro CSV.\n\nDetalhes: {e}")
+            return
+
+        # A leitura acontece em segundo plano; a janela de progresso permite cancelar
+        self.importer.start()
+        self.btn_import.config(state=tk.DISABLED)
+        self.btn_replay.config(state=tk.DISABLED)
+        self.show_progress("Importando CSV", self.importer.cancel)
+        self.root.after(100, self.poll_import)
+
+    def show_progress(self, title, cancel):
+        """Janela de progresso das tarefas em segundo plano (importação, análise), com cancelamento"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title(title)
+        dialog.geometry("380x140")
+        dialog.configure(bg="#F0F2F5")
+        dialog.transient(self.root)
+        dialog.protocol("WM_DELETE_WINDOW", cancel)
+
+        self.lbl_progress = ttk.Label(dialog, text="Lendo arquivo...")
+        self.lbl_progress.pack(fill=tk.X, padx=15, pady=(15, 5))
+        self.bar_progress = ttk.Progressbar(dialog, maximum=100, mode="determinate")
+        self.bar_progress.pack(fill=tk.X, padx=15, pady=5)
+        self.create_button(dialog, "Cancelar", "light", cancel).pack(side=tk.RIGHT, padx=15, pady=10)
+        self.progress_dialog = dialog
+
+    def poll_import(self, on_done=None):
+        """on_done(resultado): o que fazer com o CSV lido (padrão: exibir como arquivo importado)"""
+        importer = self.importer
+        if not importer.done:
+            pct = importer.progress * 100
+            self.bar_progress["value"] = pct
+            self.lbl_progress.config(text="Cancelando..." if importer.cancelled else f"Lendo arquivo... {pct:.0f}%")
+            self.root.after(100, self.poll_import, on_done)
+            return
+
+        self.progress_dialog.destroy()
+        self.btn_import.config(state=tk.NORMAL)
+        self.btn_replay.config(state=tk.NORMAL)
+        self.importer = None
+
+        if importer.error is not None:
+            messagebox.showerror("Erro", f"Não foi possível ler o ficheiro CSV.\n\nDetalhes: {importer.error}")
+            return
+        if importer.result is None:
+            self.lbl_status.config(text="Status: Importação cancelada", foreground="#6c757d")
+            return
+        (on_done or self.apply_import)(importer.result)
+
+    def apply_import(self, result, recording=None):
+        if self.replay is not None: self.stop_replay()
+        self.history.clear()
+        self.reset_heatmap()
+        self.close_recording()
+        self.recording = recording
+        self.store = result.store
+        self.viewing_import = True
+
+        # As séries por MAC já vêm em buffers compactos prontos para o gráfico
+        for mac, (timestamps, rssi) in result.series.items():
+            self.history[mac] = {'nome': result.first_name[mac], 'timestamps': timestamps, 'rssi': rssi, 'is_imported': True}
+        self.import_end = max((ts[-1] for ts, _ in result.series.values() if len(ts)), default=time.time())
+        self.last_known_beacons = [dict(b, is_active=True, is_imported=True) for b in result.latest.values()]
+        self.refilter_imported()
+
+        self.refresh_table(self.last_known_beacons)
+        self.update_plot()
+        
+        self.btn_export.config(state=tk.NORMAL)
+        self.btn_stop.config(state=tk.NORMAL)
+        self.lbl_status.config(text="Status: Visualizando Arquivo Importado", foreground="#0D6EFD")
+        messagebox.showinfo("Sucesso", f"Arquivo carregado com sucesso!\n{len(self.store)} leituras importadas.")
+
+    def refilter_imported(self):
+        """Recalcula o RSSI filtrado mais recente de cada beacon importado"""
+        filters = self.scanner.filters
+        for b in self.last_known_beacons:
+            h = self.history.get(b['mac'])
+            if h is not None and 'rssi' in h and len(h['rssi']): b['rssi_filtrado'] = float(filters.filter_series(h['rssi'])[-1])
+
+    def action_filter(self):
+        self.scanner.set_filter(FILTER_METHODS[self.filter_var.get()])
+        if self.viewing_import:
+            self.refilter_imported()
             self.refresh_table(self.last_known_beacons)
+        else:
             self.update_plot()
-            
-            self.btn_export.config(state=tk.NORMAL)
-            self.btn_stop.config(state=tk.NORMAL)
-            self.lbl_status.config(text="Status: Visualizando Arquivo Importado", foreground="#0D6EFD")
-            messagebox.showinfo("Sucesso", f"Arquivo carregado com sucesso!\n{len(self.export_data)} leituras importadas.")
 
-        except Exception as e:
+    def close_recording(self):
+        if self.recording is not None:
+            self.recording.close()
+            self.recording = None
+
+    def action_replay(self):
+        if self.is_scanning:
+            messagebox.showwarning("Aviso", "Por favor, pause ou pare o radar antes de reproduzir uma gravação.")
+            return
+
+        if len(self.store) > 0:
+            resposta = messagebox.askyesnocancel("Atenção", "Existem dados atualmente na memória. A reprodução irá substituí-los.\n\nDeseja EXPORTAR os dados atuais antes de prosseguir?")
+            if resposta is None: return
+            elif resposta is True:
+                if not self.action_export(): return
+
+        filepath = filedialog.askopenfilename(filetypes=[("Gravação Radar BLE", "*.rble"), ("Arquivos CSV", "*.csv")], title="Reproduzir gravação")
+        if not filepath: return
+
+        if filepath.lower().endswith(".rble"):
+            try:
+                tape = ReplayTape.load(filepath)
+            except (OSError, ValueError) as e:
+                messagebox.showerror("Erro", f"Não foi possível abrir a gravação.\n\nDetalhes: {e}")
+                return
+            self.start_replay(tape, filepath)
+            return
+
+        try:
+            self.importer = CsvImporter(filepath)
+        except OSError as e:
             messagebox.showerror("Erro", f"Não foi possível ler o ficheiro CSV.\n\nDetalhes: {e}")
+            return
+        self.importer.start()
+        self.btn_import.config(state=tk.DISABLED)
+        self.btn_replay.config(state=tk.DISABLED)
+        self.show_progress("Lendo gravação", self.importer.cancel)
+        self.root.after(100, self.poll_import, lambda result: self.start_replay(ReplayTape.from_store(result.store), filepath))
+
+    def start_replay(self, tape, filepath):
+        """
+        Troca a fonte do scanner pela reprodução da gravação: as leituras passam
+        pelo mesmo caminho dos anúncios do rádio (entrada, histórico, filtros,
+        índice, amostras e sessões), com o instante original de cada uma.
+        """
+        if not len(tape):
+            messagebox.showwarning("Aviso", "A gravação não tem leituras.")
+            return
+        self.clear_capture()
+        self.import_end = None
+        self.close_recording()
+        self.viewing_import = False
+        self.scanner.clear()
+        # Scanner parado (verificado em action_replay): a fonte pode ser trocada daqui
+        self.replay = self.scanner.set_source(partial(ReplaySource, tape=tape, speed=SPEEDS[self.speed_var.get()]))
+        self.replay_name = os.path.basename(filepath)
+        self.replay_seeking = False
+        self.replay_pos.set(0.0)
+        self.scale_replay.config(to=max(tape.duration, 1.0))
+        self.replay_bar.pack(side=tk.TOP, fill=tk.X, padx=15, pady=(0, 10), before=self.paned_window)
+        self.action_start()
+        self.root.after(REPLAY_POLL_MS, self.poll_replay)
+
+    def stop_replay(self):
+        """Encerra a reprodução e devolve ao scanner a fonte ao vivo"""
+        async def restore():
+            await self.scanner.stop()
+            self.scanner.set_source(self.live_source)
+        asyncio.run_coroutine_threadsafe(restore(), self.loop)
+        self.replay = None
+        self.replay_bar.pack_forget()
+
+    def show_replay_status(self):
+        replay = self.replay
+        if replay.finished: text = f"Status: Reprodução de {self.replay_name} concluída"
+        else: text = f"Status: Reproduzindo {self.replay_name} ({format_speed(replay.speed)})"
+        self.lbl_status.config(text=text, foreground="#0D6EFD") # Azul
+
+    def poll_replay(self):
+        """Acompanha a posição da reprodução e a vazão medida; termina quando a reprodução é encerrada"""
+        replay = self.replay
+        if replay is None: return
+        tape = replay.tape
+        if not self.replay_seeking: self.replay_pos.set(replay.now - tape.start)
+        self.lbl_replay.config(text=f"{format_timestamp(replay.now)}  {format_duration(replay.now - tape.start)} / "
+                                    f"{format_duration(tape.duration)}  ({replay.adverts_per_second:,.0f} leituras/s)")
+        if self.is_scanning: self.show_replay_status()
+        self.root.after(REPLAY_POLL_MS, self.poll_replay)
+
+    def action_replay_speed(self):
+        if self.replay is None: return
+        self.replay.set_speed(SPEEDS[self.speed_var.get()])
+        if self.is_scanning: self.show_replay_status()
+
+    def action_seek(self):
+        self.replay_seeking = False
+        if self.replay is None: return
+        self.loop.call_soon_threadsafe(self.rewind_replay, self.replay.tape.start + self.replay_pos.get())
+
+    def rewind_replay(self, instant):
+        """
+        Thread do scanner: recomeça a reprodução em 'instant' com o scanner, as
+        amostras e as sessões limpos, e avisa a interface para limpar o resto.
+        Feito aqui, nenhuma amostra do ponto antigo chega depois do salto.
+        """
+        replay = self.replay
+        if replay is None: return
+        self.scanner.clear()
+        replay.seek(instant)
+        self.samples.clear()
+        self.sessions.clear()
+        try: self.root.event_generate("<<ReplayRewound>>", when="tail")
+        except (RuntimeError, tk.TclError): pass
+
+    def action_presence(self):
+        """Abre o relatório de presença das sessões detectadas ao vivo"""
+        self.show_presence(self.sessions.report(), "Presença - Ao Vivo", live=True)
+
+    def action_analyze_file(self):
+        if self.analysis is not None:
+            messagebox.showwarning("Aviso", "Já existe uma análise em andamento.")
+            return
+        filepath = filedialog.askopenfilename(filetypes=[("Gravação Radar BLE", "*.rble"), ("Arquivos CSV", "*.csv")], title="Analisar gravação")
+        if not filepath: return
+
+        # A análise roda em processos auxiliares; a interface só acompanha o progresso
+        self.analysis = PresenceAnalysis(filepath)
+        self.analysis.start()
+        self.show_progress("Analisando Presença", self.analysis.cancel)
+        self.root.after(100, self.poll_analysis)
+
+    def poll_analysis(self):
+        analysis = self.analysis
+        if not analysis.done:
+            pct = analysis.progress * 100
+            self.bar_progress["value"] = pct
+            self.lbl_progress.config(text="Cancelando..." if analysis.cancelled else f"Analisando... {pct:.0f}%")
+            self.root.after(100, self.poll_analysis)
+            return
+
+        self.progress_dialog.destroy()
+        self.analysis = None
+        if analysis.error is not None:
+            messagebox.showerror("Erro", f"Não foi possível analisar o arquivo.\n\nDetalhes: {analysis.error}")
+            return
+        if analysis.result is None: return
+        name = os.path.basename(analysis.filepath)
+        self.show_presence(analysis.result, f"Presença - {name} ({analysis.elapsed:.1f} s)", live=False)
+
+    def show_presence(self, report, title, live):
+        """Janela com o resumo por dispositivo e a tabela de sessões de um PresenceReport"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title(title)
+        dialog.geometry("1100x600")
+        dialog.configure(bg="#F0F2F5")
+        dialog.transient(self.root)
+
+        # Colunas do resumo que podem ordenar a tabela (índice em DEVICE_HEADER -> coluna do relatório)
+        sortable = {0: "mac", 2: "first", 3: "last", 4: "count", 5: "sessions", 6: "dwell", 7: "mean", 8: "var", 9: "var"}
+        state = {"report": report, "order": "dwell", "reverse": True}
+
+        lbl_summary = ttk.Label(dialog, style="Status.TLabel")
+        lbl_summary.pack(fill=tk.X, padx=15, pady=(15, 5))
+        notebook = ttk.Notebook(dialog)
+        notebook.pack(fill=tk.BOTH, expand=True, padx=15, pady=5)
+
+        def make_table(header, widths):
+            frame = ttk.Frame(notebook)
+            scroll = ttk.Scrollbar(frame)
+            scroll.pack(side=tk.RIGHT, fill=tk.Y)
+            columns = [str(i) for i in range(len(header))]
+            tree = ttk.Treeview(frame, columns=columns, show="headings", yscrollcommand=scroll.set)
+            scroll.config(command=tree.yview)
+            for col, text, width in zip(columns, header, widths):
+                tree.heading(col, text=text)
+                tree.column(col, width=width, anchor="w" if text in ("MAC", "Nome") else "center")
+            tree.pack(fill=tk.BOTH, expand=True)
+            return frame, tree
+
+        devices_frame, devices_tree = make_table(DEVICE_HEADER, [140, 160, 140, 140] + [70] * 11)
+        sessions_frame, sessions_tree = make_table(SESSION_HEADER, [140, 180, 150, 150, 90, 80, 90])
+        notebook.add(devices_frame, text="Dispositivos")
+        notebook.add(sessions_frame, text="Sessões")
+
+        def fill():
+            current = state["report"]
+            devices_tree.delete(*devices_tree.get_children())
+            for row in current.device_rows(state["order"], state["reverse"], limit=PRESENCE_ROWS):
+                devices_tree.insert("", tk.END, values=row)
+            sessions_tree.delete(*sessions_tree.get_children())
+            for row in current.session_rows(limit=PRESENCE_ROWS):
+                sessions_tree.insert("", tk.END, values=row)
+            shown = "" if len(current) <= PRESENCE_ROWS and len(current.enter) <= PRESENCE_ROWS else f" (exibindo até {PRESENCE_ROWS} linhas; a exportação leva todas)"
+            lbl_summary.config(text=f"{len(current)} dispositivos, {len(current.enter)} sessões{shown}")
+
+        def sort_by(index):
+            order = sortable[index]
+            state["reverse"] = not state["reverse"] if state["order"] == order else order != "mac"
+            state["order"] = order
+            fill()
+
+        for index in sortable:
+            devices_tree.heading(str(index), command=lambda i=index: sort_by(i))
+
+        def refresh():
+            state["report"] = self.sessions.report()
+            fill()
+
+        def export(method, titulo):
+            filepath = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("Arquivos CSV", "*.csv")], title=titulo, parent=dialog)
+            if not filepath: return
+            try:
+                total = getattr(state["report"], method)(filepath)
+                messagebox.showinfo("Sucesso", f"{total} linhas exportadas.", parent=dialog)
+            except Exception as e:
+                messagebox.showerror("Erro", f"Não foi possível salvar o arquivo:\n{e}", parent=dialog)
+
+        buttons = ttk.Frame(dialog)
+        buttons.pack(fill=tk.X, padx=15, pady=(5, 15))
+        if live: self.create_button(buttons, "Atualizar", "light", refresh).pack(side=tk.LEFT, padx=(0, 5))
+        self.create_button(buttons, "Analisar Arquivo...", "light", self.action_analyze_file).pack(side=tk.LEFT, padx=5)
+        self.create_button(buttons, "Exportar Sessões", "secondary",
+                           lambda: export("write_sessions_csv", "Salvar sessões")).pack(side=tk.RIGHT, padx=(5, 0))
+        self.create_button(buttons, "Exportar Resumo", "secondary",
+                           lambda: export("write_csv", "Salvar resumo por dispositivo")).pack(side=tk.RIGHT, padx=5)
+        fill()
 
     def action_save_plot(self):
         filepath = filedialog.asksaveasfilename(
@@ -383,11 +920,106 @@ class BeaconApp:
             title="Salvar Imagem do Gráfico"
         )
         if not filepath: return 
-        try:
-            self.fig.savefig(filepath, dpi=300, bbox_inches='tight')
+        # Os dados e o estilo do gráfico são copiados agora; o desenho acontece fora da tela, em segundo plano
+        windows, ref, span, scale, default_xlabel = self.plot_frame()
+        title, xlabel, ylabel = self.plot_titles(default_xlabel)
+        spec = self.plot_spec(self.plot_series(windows, ref, scale), title, xlabel, ylabel, (-span / scale, 0))
+        self.start_export([(spec, filepath)])
+
+    def action_batch_plot(self):
+        macs = list(self.tree.selection())
+        if not macs:
+            messagebox.showwarning("Aviso", "Selecione dispositivos na tabela para exportar os gráficos.")
+            return
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Exportar Gráficos em Lote")
+        dialog.geometry("380x250")
+        dialog.configure(bg="#F0F2F5")
+        dialog.transient(self.root)
+        dialog.grab_set()
+
+        frame = ttk.LabelFrame(dialog, text="Um arquivo por...", padding=10)
+        frame.pack(fill=tk.X, padx=15, pady=10)
+        mode_var = tk.StringVar(value="dispositivo")
+        ttk.Radiobutton(frame, text=f"Dispositivo selecionado ({len(macs)})", variable=mode_var, value="dispositivo").grid(row=0, column=0, columnspan=2, sticky="w", pady=3)
+        ttk.Radiobutton(frame, text="Período de", variable=mode_var, value="periodo").grid(row=1, column=0, sticky="w", pady=3)
+        period_var = tk.StringVar(value="1h")
+        ttk.Combobox(frame, textvariable=period_var, values=list(EXPORT_PERIODS), width=6, state="readonly").grid(row=1, column=1, sticky="w", padx=5)
+
+        ttk.Label(frame, text="Formato:").grid(row=2, column=0, sticky="w", pady=(10, 3))
+        format_var = tk.StringVar(value="PNG")
+        ttk.Combobox(frame, textvariable=format_var, values=["PNG", "JPEG", "PDF", "SVG"], width=6, state="readonly").grid(row=2, column=1, sticky="w", padx=5, pady=(10, 3))
+
+        def exportar():
+            directory = filedialog.askdirectory(parent=dialog, title="Pasta dos gráficos")
+            if not directory: return
+            ext = {"JPEG": "jpg"}.get(format_var.get(), format_var.get().lower())
+            jobs = self.batch_jobs(mode_var.get(), EXPORT_PERIODS[period_var.get()], directory, ext)
+            dialog.destroy()
+            if not jobs:
+                messagebox.showwarning("Aviso", "Os dispositivos selecionados não têm leituras na janela exibida.")
+                return
+            self.start_export(jobs)
+
+        self.create_button(dialog, "Exportar", "success", exportar).pack(side=tk.RIGHT, padx=15, pady=10)
+
+    def batch_jobs(self, mode, period, directory, ext):
+        """(PlotSpec, caminho) de cada figura do lote: uma por dispositivo ou uma por período da janela exibida"""
+        windows, ref, span, scale, default_xlabel = self.plot_frame()
+        title, xlabel, ylabel = self.plot_titles(default_xlabel)
+        jobs = []
+        if mode == "dispositivo":
+            for window in windows:
+                if not len(window[2]): continue
+                series = self.plot_series([window], ref, scale)
+                spec = self.plot_spec(series, f"{title} - {series[0][1]}", xlabel, ylabel, (-span / scale, 0))
+                jobs.append((spec, os.path.join(directory, f"grafico-{file_slug(window[0])}.{ext}")))
+            return jobs
+
+        stamps = [ts for _, _, ts, _ in windows if len(ts)]
+        if not stamps: return jobs
+        end = max(ts[-1] for ts in stamps)
+        t = math.floor(min(ts[0] for ts in stamps) / period) * period
+        period_scale, unit = self.time_unit(period)
+        while t <= end:
+            part = [(mac, h) + tuple(self.history_window(h, t, t + period)) for mac, h, _, _ in windows]
+            part = [w for w in part if len(w[2])]
+            if part:
+                label = format_timestamp(t)
+                spec = self.plot_spec(self.plot_series(part, t, period_scale), f"{title} - {label}",
+                                      self.custom_xlabel or f"Tempo desde {label} ({unit})", ylabel, (0, period / period_scale))
+                jobs.append((spec, os.path.join(directory, f"grafico-{file_slug(label)}.{ext}")))
+            t += period
+        return jobs
+
+    def start_export(self, jobs):
+        if self.exporter is not None:
+            messagebox.showwarning("Aviso", "Já existe uma exportação de gráficos em andamento.")
+            return
+        self.exporter = PlotExporter(jobs)
+        self.exporter.start()
+        self.show_progress("Exportando Gráfico", self.exporter.cancel)
+        self.root.after(100, self.poll_export)
+
+    def poll_export(self):
+        exporter = self.exporter
+        if not exporter.done:
+            pct = exporter.progress * 100
+            self.bar_progress["value"] = pct
+            self.lbl_progress.config(text="Cancelando..." if exporter.cancelled else f"Desenhando... {len(exporter.written)}/{len(exporter.jobs)}")
+            self.root.after(100, self.poll_export)
+            return
+
+        self.progress_dialog.destroy()
+        self.exporter = None
+        if exporter.error is not None:
+            messagebox.showerror("Erro", f"Não foi possível salvar a imagem:\n{exporter.error}")
+        elif len(exporter.jobs) == 1 and exporter.written:
             messagebox.showinfo("Sucesso", "Imagem do gráfico salva com sucesso!")
-        except Exception as e:
-            messagebox.showerror("Erro", f"Não foi possível salvar a imagem:\n{e}")
+        elif exporter.written:
+            folder = os.path.dirname(exporter.written[0])
+            messagebox.showinfo("Sucesso", f"{len(exporter.written)} imagens salvas em:\n{folder}")
 
     def action_config_plot(self):
         dialog = tk.Toplevel(self.root)
@@ -418,7 +1050,7 @@ class BeaconApp:
         frame_legendas = ttk.LabelFrame(dialog, text="Legendas (Beacons Selecionados)", padding=10)
         frame_legendas.pack(fill=tk.BOTH, expand=True, padx=15, pady=5)
 
-        macs_selecionados = [self.tree.item(item)['values'][0] for item in self.tree.selection()]
+        macs_selecionados = list(self.tree.selection())
         
         legend_entries = {}
         if not macs_selecionados:
@@ -462,98 +1094,358 @@ class BeaconApp:
         asyncio.set_event_loop(self.loop)
         self.loop.run_forever()
 
+    def record_sample(self, now, snapshot):
+        """
+        Amostra os beacons a cada SAMPLE_INTERVAL, chamada na thread do scanner:
+        os ativos vão direto para o diário (thread-safe) e as amostras ficam na
+        fila até a interface incluí-las no store e no gráfico.
+        """
+        active = [(b['mac'], b['nome'], b['rssi'], b['last_seen'])
+                  for b in snapshot.beacons.values() if now - b['last_seen'] <= ACTIVE_TIMEOUT]
+        # Leituras reproduzidas já estão em disco: não vão de novo para o diário
+        if active and self.replay is None: self.journal.append_many([(now, mac, nome, rssi) for mac, nome, rssi, _ in active])
+        self.samples.append((now, active))
+        if active: self.changes.wake()
+
+    def notify_changes(self):
+        """Chamado na thread do scanner na primeira alteração após cada redesenho"""
+        try: self.root.event_generate("<<BeaconsChanged>>", when="tail")
+        except (RuntimeError, tk.TclError): return False # Laço do Tk ainda não iniciado ou janela fechando
+
+    def schedule_refresh(self, event=None):
+        if self.refresh_job is None:
+            self.refresh_job = self.root.after(self.pacer.delay_ms(time.time()), self.update_ui)
+
+    def plot_buffer(self, mac, nome):
+        h = self.history.get(mac)
+        if h is None or 'buffer' not in h:
+            h = self.history[mac] = {'nome': nome, 'buffer': TieredRssiBuffer(MAX_PLOT_HISTORY, PLOT_LONG_HISTORY,
+                                                                              PLOT_LONG_BUCKET, PLOT_HISTORY_INITIAL)}
+        return h['buffer']
+
+    def drain_samples(self):
+        """
+        Inclui no store e no gráfico as amostras gravadas pelo scanner desde o
+        último quadro. Dispositivos offline não recebem amostras: o intervalo
+        sem leituras vira uma interrupção da linha (ver plot_series).
+        """
+        samples = self.samples
+        while samples:
+            now, active = samples.popleft()
+            for mac, nome, rssi, last_seen in active:
+                buf = self.plot_buffer(mac, nome)
+                last = buf.last()
+                # Guarda o instante real do anúncio, não o da amostra
+                if last is None or last_seen > last[0]: buf.append(last_seen, rssi)
+                self.store.append(now, mac, nome, rssi)
+
     def update_ui(self):
+        self.refresh_job = None
+        started = time.time()
+        self.drain_samples()
+        changed, removed = self.changes.drain()
         if self.is_scanning:
-            beacons_atuais = self.scanner.get_all_beacons(timeout=3.0)
+            beacons_atuais = self.scanner.get_all_beacons(timeout=ACTIVE_TIMEOUT)
             self.last_known_beacons = beacons_atuais
-            current_time_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            for b in beacons_atuais:
-                mac = b['mac']
-                if mac not in self.history: self.history[mac] = {'nome': b['nome'], 'rssi_history': deque(maxlen=MAX_PLOT_HISTORY)}
-                
-                if b['is_active']:
-                    self.history[mac]['rssi_history'].append(b['rssi'])
-                    self.export_data.append([current_time_str, mac, b['nome'], b['rssi']])
-                else:
-                    self.history[mac]['rssi_history'].append(-100)
 
-            if len(self.export_data) > 0 and self.btn_export['state'] == tk.DISABLED: self.btn_export.config(state=tk.NORMAL)
-            self.refresh_table(beacons_atuais)
+            # O scanner esqueceu dispositivos (TTL/limite): as leituras já estão no store e no diário
+            for mac in removed:
+                h = self.history.get(mac)
+                if h is not None and 'buffer' in h: del self.history[mac]
+
+            if len(self.store) > 0 and self.btn_export['state'] == tk.DISABLED: self.btn_export.config(state=tk.NORMAL)
+            self.refresh_table(beacons_atuais, changed)
 
-        self.root.after(1000, self.update_ui)
+        self.pacer.record(started, time.time())
+        # Alterações que chegaram durante o quadro já rearmaram a notificação
+        if len(self.changes) or self.samples: self.schedule_refresh()
 
-    def refresh_table(self, beacons_list):
+    def refresh_table(self, beacons_list, changed=None):
+        """changed: MACs alterados desde o último quadro (None = redesenha todas as linhas)"""
+        started = time.perf_counter()
         try: min_rssi = self.rssi_var.get()
         except tk.TclError: min_rssi = -100 
             
+        search = self.search_var.get().strip().lower()
+        order = INDEX_ORDERS.get(self.sort_col)
+        if order is not None and self.is_scanning and not (beacons_list and beacons_list[0].get('is_imported')):
+            # Ao vivo: ordem e faixa de sinal vêm prontas do índice incremental do scanner
+            reverse = not self.sort_reverse if order == 'rssi' else self.sort_reverse
+            if min_rssi > -100: ordered = self.scanner.query(order, reverse, min_rssi=min_rssi, active_only=True)
+            else: ordered = self.scanner.query(order, reverse)
+            if search: ordered = [b for b in ordered if search in self.search_text(b)]
+            self.sync_table(ordered, changed)
+            self.table_time.observe(time.perf_counter() - started)
+            self.update_plot()
+            return
+
         filtered = [b for b in beacons_list if (b['rssi'] if b.get('is_active', False) else -100) >= min_rssi]
+        if search: filtered = [b for b in filtered if search in self.search_text(b)]
         
         def sort_key(b):
             if self.sort_col == 'nome': return b['nome'].lower() 
             elif self.sort_col == 'mac': return b['mac']
             elif self.sort_col == 'rssi': return b['rssi'] if b.get('is_active', False) else -999 
+            elif self.sort_col == 'filtrado': return b.get('rssi_filtrado', b['rssi']) if b.get('is_active', False) else -999
             elif self.sort_col == 'status': return (b.get('is_active', False), b['rssi']) 
+            elif self.sort_col in ('tipo', 'ident'): return self.decoded_text(b, self.sort_col)
+            elif self.sort_col in ('major', 'minor', 'tx'):
+                value = (b.get('decodificado') or {}).get('tx_power' if self.sort_col == 'tx' else self.sort_col)
+                return -999 if value is None else value
             return 0
 
         sorted_beacons = sorted(filtered, key=sort_key, reverse=self.sort_reverse)
-        selecionados = [self.tree.item(item)['values'][0] for item in self.tree.selection()]
-        
-        for row in self.tree.get_children(): self.tree.delete(row)
-
-        for b in sorted_beacons:
-            mac = b['mac']
-            if b.get('is_imported', False): status_text, rssi_text, tag = "📘 Importado", f"{b['rssi']} dBm", "importado"
-            elif b.get('is_active', False): status_text, rssi_text, tag = "🟢 Online", f"{b['rssi']} dBm", "online"
-            else: status_text, rssi_text, tag = "🔴 Offline", "---", "offline"
-
-            item_id = self.tree.insert("", tk.END, values=(mac, status_text, rssi_text, b['nome']), tags=(tag,))
-            if mac in selecionados: self.tree.selection_add(item_id)
-
+        self.sync_table(sorted_beacons, changed)
+        self.table_time.observe(time.perf_counter() - started)
         self.update_plot()
 
-    def update_plot(self):
-        self.ax.clear()
-        window_selection = self.time_window_var.get()
-        if window_selection == "Tudo": limit, default_xlabel = MAX_PLOT_HISTORY, "Leituras (Todo o histórico ativo)"
-        else: limit, default_xlabel = int(window_selection.replace("s", "")), f"Leituras (últimos {window_selection})"
-
-        self.ax.set_title(self.custom_title if self.custom_title else "Potência do Sinal (RSSI) ao longo do tempo")
-        self.ax.set_xlabel(self.custom_xlabel if self.custom_xlabel else default_xlabel)
-        self.ax.set_ylabel(self.custom_ylabel if self.custom_ylabel else "RSSI (dBm)")
-        self.ax.set_ylim(-100, -20)
-        self.ax.grid(True, linestyle='--', alpha=0.7)
+    def decoded_text(self, b, col):
+        fields = b.get('decodificado')
+        if not fields: return ""
+        return fields.get('tipo', "") if col == 'tipo' else describe(fields)
+
+    def search_text(self, b):
+        """Texto em que a busca procura: nome, MAC e identificação do beacon decodificado"""
+        return f"{b['nome']} {b['mac']} {self.decoded_text(b, 'tipo')} {self.decoded_text(b, 'ident')}".lower()
+
+    def row_for(self, b):
+        """Valores e tag exibidos na tabela para um beacon"""
+        filtered = b.get('rssi_filtrado')
+        filtered_text = f"{filtered:.1f} dBm" if filtered is not None else "---"
+        if b.get('is_imported', False): status_text, rssi_text, tag = "📘 Importado", f"{b['rssi']} dBm", "importado"
+        elif b.get('is_active', False): status_text, rssi_text, tag = "🟢 Online", f"{b['rssi']} dBm", "online"
+        else: status_text, rssi_text, filtered_text, tag = "🔴 Offline", "---", "---", "offline"
+        fields = b.get('decodificado') or {}
+        decoded = (fields.get('tipo', ""), describe(fields), fields.get('major', ""), fields.get('minor', ""),
+                   fields.get('tx_power', ""))
+        return (b['mac'], status_text, rssi_text, filtered_text, b['nome']) + decoded, tag
+
+    def sync_table(self, sorted_beacons, changed=None):
+        """
+        Aplica na Treeview apenas a diferença para a lista ordenada desejada.
+        Cada linha usa o MAC como iid, então a seleção sobrevive naturalmente:
+        linhas que somem são apagadas, novas são inseridas, células alteradas
+        são atualizadas e só as linhas fora da ordem relativa são movidas.
+        Com 'changed', só as linhas desses MACs (e as novas) são recalculadas.
+        """
+        tree = self.tree
+        rows = self.table_rows
+        desired = [b['mac'] for b in sorted_beacons]
+        position = {mac: i for i, mac in enumerate(desired)}
+
+        removed = [mac for mac in rows if mac not in position]
+        if removed:
+            tree.delete(*removed)
+            for mac in removed: del rows[mac]
+
+        # Linhas existentes numa subsequência crescente máxima ficam paradas
+        order = [mac for mac in tree.get_children() if mac in position]
+        keep = stable_positions([position[mac] for mac in order])
+        stable = {order[i] for i in keep}
+
+        for i, b in enumerate(sorted_beacons):
+            mac = desired[i]
+            old = rows.get(mac)
+            if old is None or changed is None or mac in changed: values, tag = self.row_for(b)
+            else: values, tag = old
+
+            if mac not in stable:
+                # Posiciona logo após o antecessor na ordem desejada
+                index = order.index(desired[i - 1]) + 1 if i > 0 else 0
+                if old is None:
+                    tree.insert("", index, iid=mac, values=values, tags=(tag,))
+                    order.insert(index, mac)
+                else:
+                    tree.move(mac, "", index)
+                    order.remove(mac)
+                    order.insert(order.index(desired[i - 1]) + 1 if i > 0 else 0, mac)
+
+            if old is not None and old != (values, tag):
+                tree.item(mac, values=values, tags=(tag,))
+            rows[mac] = (values, tag)
+
+    def plot_window(self):
+        """Largura da janela do gráfico em segundos (None = todo o histórico)"""
+        selection = self.time_window_var.get()
+        if selection == "Tudo": return None
+        if selection.endswith("h"): return float(selection[:-1]) * 3600
+        return float(selection.rstrip("s"))
+
+    def history_window(self, h, t0, t1=math.inf):
+        """(timestamps, rssi) do histórico de um MAC em [t0, t1), por busca binária"""
+        if 'buffer' in h: return h['buffer'].since(t0) if t1 == math.inf else h['buffer'].between(t0, t1)
+        ts = h['timestamps']
+        start = bisect.bisect_left(ts, t0) if t0 > -math.inf else 0
+        stop = bisect.bisect_left(ts, t1) if t1 < math.inf else len(ts)
+        return ts[start:stop], h['rssi'][start:stop]
+
+    def plot_windows(self, macs, t0, t1=math.inf):
+        """[(mac, histórico, timestamps, rssi)] dos MACs com histórico, em [t0, t1)"""
+        windows = []
+        for mac in macs:
+            h = self.history.get(mac)
+            if h is None: continue
+            ts, rs = self.history_window(h, t0, t1)
+            windows.append((mac, h, ts, rs))
+        return windows
+
+    def plot_series(self, windows, ref, scale, width=None):
+        """
+        (chave, legenda, xs, ys) das variantes (bruto/filtrado) de cada janela,
+        com x relativo a ref em unidades de 'scale' segundos. width reduz as
+        séries por LTTB (um ponto por pixel); None mantém a resolução completa.
+        Intervalos sem leituras maiores que PLOT_GAP interrompem a linha (em
+        séries longas, que incluem as médias por balde, a partir de dois baldes).
+        """
+        signal = self.signal_var.get()
+        filters = self.scanner.filters
+        series = []
+        for mac, h, ts, rs in windows:
+            default_leg = f"{h['nome']} ({mac[-5:]})"
+            leg = self.custom_legends.get(mac, default_leg)
+            # O filtro roda sobre a série completa da janela, antes da redução por LTTB
+            variants = []
+            if signal != "Filtrado": variants.append((mac, leg, rs))
+            if signal != "Bruto": variants.append((mac + "#filtrado", f"{leg} (filtrado)", filters.filter_series(rs)))
+            gap = PLOT_GAP if not len(ts) or ts[-1] - ts[0] <= PLOT_RAW_SPAN else max(PLOT_GAP, 2 * PLOT_LONG_BUCKET)
+            for key, label, values in variants:
+                xs, ys = break_gaps(ts, values, gap)
+                if width is not None and len(xs) > width: xs, ys = lttb(xs, ys, width)
+                series.append((key, label, (xs - ref) / scale, ys))
+        return series
+
+    def time_unit(self, span):
+        """(escala em segundos, unidade) do eixo X para uma janela de 'span' segundos"""
+        if span <= 600: return 1, "s"
+        if span <= 3 * 3600: return 60, "min"
+        return 3600, "h"
+
+    def plot_titles(self, default_xlabel):
+        return (self.custom_title if self.custom_title else "Potência do Sinal (RSSI) ao longo do tempo",
+                self.custom_xlabel if self.custom_xlabel else default_xlabel,
+                self.custom_ylabel if self.custom_ylabel else "RSSI (dBm)")
+
+    def plot_frame(self):
+        """(janelas, referência, span, escala, unidade, rótulo do eixo X) do gráfico exibido"""
+        window = self.plot_window()
+        live = self.import_end is None or self.is_scanning
+        ref = self.scanner.clock() if live else self.import_end
+        t0 = -math.inf if window is None else ref - window
+        windows = self.plot_windows(self.tree.selection(), t0)
+        oldest = min([ref] + [ts[0] for _, _, ts, _ in windows if len(ts)])
+
+        # Eixo X fixo para a janela escolhida; em "Tudo" cresce em degraus para
+        # não exigir um redesenho completo a cada leitura nova.
+        if window is None:
+            span = 60.0
+            while span < ref - oldest: span *= 2
+        else:
+            span = window
+        scale, unit = self.time_unit(span)
+        reference = "agora" if live else "fim da gravação"
+        return windows, ref, span, scale, f"Tempo relativo a {reference} ({unit})"
 
-        macs_selecionados = [self.tree.item(item)['values'][0] for item in self.tree.selection()]
+    def update_plot(self):
+        started = time.perf_counter()
+        heatmap = self.view_var.get() == "Mapa de calor"
+        if heatmap != self.heatmap.active:
+            self.plot.set_active(not heatmap)
+            self.heatmap.set_active(heatmap)
+        if heatmap:
+            self.update_heatmap()
+            self.plot_time.observe(time.perf_counter() - started)
+            return
+        windows, ref, span, scale, default_xlabel = self.plot_frame()
+        width = max(100, int(self.ax.bbox.width)) # Um ponto por pixel basta
+        series = [(key, label, xs, ys, len(xs) <= MARKER_LIMIT)
+                  for key, label, xs, ys in self.plot_series(windows, ref, scale, width)]
+        title, xlabel, ylabel = self.plot_titles(default_xlabel)
+        self.plot.update(series, title=title, xlabel=xlabel, ylabel=ylabel, xlim=(-span / scale, 0))
+        self.plot_time.observe(time.perf_counter() - started)
+
+    def reset_heatmap(self):
+        """Descarta a matriz do mapa de calor (o histórico foi trocado ou apagado)"""
+        self.heat_matrix = HeatmapMatrix()
+        self.heat_oldest = None
+
+    def update_heatmap(self):
+        """
+        Mapa de calor dos selecionados (ou de todos os dispositivos, sem
+        seleção). A matriz só é refeita quando as linhas ou o balde mudam; nos
+        demais quadros apenas as colunas mais novas são recalculadas.
+        """
+        window = self.plot_window()
+        live = self.import_end is None or self.is_scanning
+        ref = self.scanner.clock() if live else self.import_end
+        macs = [mac for mac in (self.tree.selection() or self.history) if mac in self.history]
+        keys = sorted(macs, key=lambda mac: (self.history[mac]['nome'], mac))
+        matrix = self.heat_matrix
+
+        windows = None
+        if window is None:
+            # Em "Tudo" o balde cresce em degraus, como o eixo X do gráfico de linhas
+            if tuple(keys) != matrix.keys or self.heat_oldest is None:
+                windows = self.plot_windows(keys, -math.inf)
+                self.heat_oldest = min([ref] + [ts[0] for _, _, ts, _ in windows if len(ts)])
+            span = 60.0
+            while span < ref - self.heat_oldest: span *= 2
+        else:
+            span = window
+        bucket = span / matrix.columns
 
-        if not macs_selecionados:
-            self.ax.text(0.5, 0.5, "Selecione dispositivos na tabela acima para visualizá-los aqui.", horizontalalignment='center', verticalalignment='center', transform=self.ax.transAxes, color='gray')
+        if matrix.needs_rebuild(keys, bucket):
+            if windows is None: windows = self.plot_windows(keys, ref - span)
+            matrix.rebuild(keys, [(ts, rs) for _, _, ts, rs in windows], bucket, ref)
         else:
-            for mac in macs_selecionados:
-                if mac in self.history:
-                    dados = list(self.history[mac]['rssi_history'])[-limit:]
-                    default_leg = f"{self.history[mac]['nome']} ({mac[-5:]})"
-                    leg = self.custom_legends.get(mac, default_leg)
-                    self.ax.plot(range(len(dados)), dados, label=leg, marker='o', markersize=3)
-            self.ax.legend(loc="lower left")
-        
-        self.fig.tight_layout() # Previne textos cortados nas bordas do gráfico
-        self.canvas.draw()
+            start = matrix.advance(ref)
+            matrix.update_tail([(ts, rs) for _, _, ts, rs in self.plot_windows(keys, start)], start)
+
+        scale, unit = self.time_unit(span)
+        reference = "agora" if live else "fim da gravação"
+        labels = [self.custom_legends.get(mac, f"{self.history[mac]['nome']} ({mac[-5:]})") for mac in keys]
+        self.heatmap.update(
+            matrix.values, labels,
+            title=self.custom_title if self.custom_title else f"RSSI médio por dispositivo (baldes de {bucket / scale:g} {unit})",
+            xlabel=self.custom_xlabel if self.custom_xlabel else f"Tempo relativo a {reference} ({unit})",
+            ylabel=f"{len(keys)} dispositivos",
+            extent=((matrix.origin - ref) / scale, (matrix.end - ref) / scale),
+            xlim=(-span / scale, 0),
+        )
 
-    def on_closing(self):
-        if len(self.export_data) > 0:
-            resposta = messagebox.askyesnocancel("Sair do Aplicativo", "Você possui dados coletados não salvos.\n\nDeseja EXPORTAR os dados antes de fechar o aplicativo?")
-            if resposta is None: return 
-            elif resposta is True:
-                if not self.action_export(): return 
+    def plot_spec(self, series, title, xlabel, ylabel, xlim):
+        """PlotSpec para exportação, com as cores das linhas exibidas quando existirem"""
+        lines = self.plot.lines
+        return PlotSpec(title, xlabel, ylabel, xlim, tuple(self.ax.get_ylim()),
+                        [(label, xs, ys, lines[key].get_color() if key in lines else None) for key, label, xs, ys in series],
+                        tuple(self.fig.get_size_inches()))
 
+    def on_closing(self):
+        # A captura ao vivo já está no diário em disco; nada se perde ao fechar
         print("A encerrar...")
         if self.is_scanning: asyncio.run_coroutine_threadsafe(self.scanner.stop(), self.loop)
+        self.journal.stop()
+        self.spill_journal.stop()
+        if self.metrics_server is not None: self.metrics_server.stop()
+        if self.journal.segments: print(f"Captura salva em: {self.journal.directory}")
         self.loop.call_soon_threadsafe(self.loop.stop)
         self.root.destroy()
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Radar BLE - interface gráfica")
+    parser.add_argument("--stream", default=None, metavar="ENDEREÇO",
+                        help="Lê os anúncios de um stream (host:porta ou unix:/caminho), por exemplo do agregador, em vez do rádio local")
+    parser.add_argument("--metrics-port", type=int, default=os.environ.get("RADAR_BLE_METRICS_PORT"), metavar="PORTA",
+                        help="Expõe as métricas em http://127.0.0.1:PORTA/metrics")
+    args = parser.parse_args()
+    source_factory = None
+    if args.stream:
+        from advert_stream import StreamSource
+        from aggregator import parse_address
+        host, stream_port, path = parse_address(args.stream)
+        source_factory = partial(StreamSource, port=stream_port, host=host, path=path)
+
     root = tk.Tk()
-    app = BeaconApp(root)
+    app = BeaconApp(root, metrics_port=args.metrics_port, source_factory=source_factory)
     root.protocol("WM_DELETE_WINDOW", app.on_closing)
     root.mainloop()
@@ -0,0 +1,191 @@
+"""
+Suíte de benchmarks do Radar BLE usando a fonte sintética de anúncios.
+
+Mede:
+  * vazão do BeaconScanner._callback (anúncios/s), inclusive com mais
+    dispositivos do que cabem no orçamento do AdvertHistory;
+  * latência do get_all_beacons em função do número de dispositivos;
+  * tempo de quadro de update_ui / refresh_table / update_plot na BeaconApp
+    (requer display; é ignorado em ambientes sem interface gráfica).
+
+Uso:
+    python benchmark.py
+    python benchmark.py --devices 5000 --adverts 500000 --sizes 100 1000 10000 --json
+    python benchmark.py --callback-devices 2000 10000 50000 --max-rate 20 --no-gui
+"""
+import argparse
+import json
+import statistics
+import tempfile
+import time
+from functools import partial
+
+from beacon_scanner import BeaconScanner
+from ingest_gate import IngestGate
+from synthetic_source import SyntheticAdvertSource
+
+
+def make_scanner(num_devices, ingest=None, **source_kwargs):
+    factory = partial(SyntheticAdvertSource, num_devices=num_devices, **source_kwargs)
+    return BeaconScanner(source_factory=factory, ingest=ingest)
+
+
+class SimulatedClock:
+    """
+    Relógio do scanner no benchmark do callback: o instante simulado do
+    anúncio em entrega (como ReplaySource.clock), para que o IngestGate e o
+    histórico vejam a taxa da fonte sintética e não a do laço de medição.
+    """
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def populate(scanner, rounds=1):
+    """Envia 'rounds' anúncios por dispositivo diretamente ao callback."""
+    source = scanner.scanner
+    for device, adv in source.generate(rounds * len(source.slots)):
+        scanner._callback(device, adv)
+    scanner.publish()
+
+
+def timed(func, repeat):
+    """Executa func 'repeat' vezes e retorna a lista de durações em segundos."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def summarize(durations):
+    durations = sorted(durations)
+    p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+    return {"median_ms": statistics.median(durations) * 1000, "p95_ms": p95 * 1000, "runs": len(durations)}
+
+
+def bench_callback(num_devices, num_adverts, rssi_pattern="random_walk", max_rate=None):
+    ingest = IngestGate(max_rate) if max_rate else None
+    scanner = make_scanner(num_devices, ingest, rssi_pattern=rssi_pattern, adverts_per_second=50000)
+    source = scanner.scanner
+    # Os anúncios são pré-gerados (com o instante simulado de cada um) para medir apenas o custo do callback
+    origin = time.time()
+    adverts = [(origin + source.sim_time, device, adv) for device, adv in source.generate(num_adverts)]
+    clock = scanner.clock = SimulatedClock(origin)
+    callback = scanner._callback
+
+    start = time.perf_counter()
+    for t, device, adv in adverts:
+        clock.now = t
+        callback(device, adv)
+    elapsed = time.perf_counter() - start
+
+    return {"devices": num_devices, "adverts": num_adverts, "seconds": elapsed,
+            "adverts_per_second": num_adverts / elapsed, "us_per_advert": elapsed / num_adverts * 1e6,
+            "folded": ingest.folded + ingest.duplicates if ingest is not None else 0,
+            "history_devices": len(scanner.history), "history_evicted": scanner.history.evicted}
+
+
+def bench_get_all_beacons(sizes, repeat=20):
+    results = []
+    for n in sizes:
+        scanner = make_scanner(n)
+        populate(scanner)
+        stats = summarize(timed(lambda: scanner.get_all_beacons(timeout=3.0), repeat))
+        stats["devices"] = n
+        results.append(stats)
+    return results
+
+
+def bench_gui(num_devices, selected=12, repeat=10):
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception as e:
+        return {"skipped": f"Tk indisponível: {e}"}
+
+    from beacon_scanner_gui import BeaconApp
+
+    root.withdraw()
+    scanner = make_scanner(num_devices)
+    # Diário num diretório temporário: o benchmark não mistura segmentos com as capturas reais
+    journal_dir = tempfile.TemporaryDirectory(prefix="radar-bench-")
+    app = BeaconApp(root, scanner=scanner, journal_dir=journal_dir.name)
+    try:
+        populate(scanner)
+        app.is_scanning = True
+
+        def step(func):
+            func()
+            root.update_idletasks()
+
+        result = {"devices": num_devices, "selected": selected}
+        result["update_ui"] = summarize(timed(lambda: step(app.update_ui), repeat))
+
+        children = app.tree.get_children()
+        app.tree.selection_set(children[:selected])
+        root.update()
+        result["refresh_table"] = summarize(timed(lambda: step(lambda: app.refresh_table(app.last_known_beacons)), repeat))
+        result["update_plot"] = summarize(timed(lambda: step(app.update_plot), repeat))
+        return result
+    finally:
+        app.is_scanning = False
+        app.loop.call_soon_threadsafe(app.loop.stop)
+        app.journal.stop()
+        app.spill_journal.stop()
+        root.destroy()
+        journal_dir.cleanup()
+
+
+def print_report(report):
+    print("== _callback ==")
+    for cb in report["callback"]:
+        print(f"  {cb['adverts']} anúncios / {cb['devices']} dispositivos: "
+              f"{cb['adverts_per_second']:,.0f} anúncios/s ({cb['us_per_advert']:.2f} µs/anúncio)" +
+              (f", {cb['folded']} dobrados pelo limite de taxa" if cb["folded"] else "") +
+              (f", {cb['history_evicted']} históricos descartados" if cb["history_evicted"] else ""))
+
+    print("== get_all_beacons ==")
+    for r in report["get_all_beacons"]:
+        print(f"  {r['devices']:>7} dispositivos: mediana {r['median_ms']:.2f} ms, p95 {r['p95_ms']:.2f} ms")
+
+    gui = report.get("gui")
+    if gui is not None:
+        print("== BeaconApp ==")
+        if "skipped" in gui:
+            print(f"  ignorado ({gui['skipped']})")
+        else:
+            for key in ("update_ui", "refresh_table", "update_plot"):
+                print(f"  {key:<14} mediana {gui[key]['median_ms']:.2f} ms, p95 {gui[key]['p95_ms']:.2f} ms "
+                      f"({gui['devices']} dispositivos, {gui['selected']} selecionados)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do Radar BLE com anúncios sintéticos")
+    parser.add_argument("--devices", type=int, default=2000, help="Dispositivos simulados no teste da interface")
+    parser.add_argument("--callback-devices", type=int, nargs="+", default=[2000, 10000],
+                        help="Números de dispositivos no teste do callback (10000 passa do orçamento padrão do AdvertHistory)")
+    parser.add_argument("--adverts", type=int, default=200000, help="Anúncios enviados ao callback")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000, 10000], help="Números de dispositivos para o get_all_beacons")
+    parser.add_argument("--pattern", default="random_walk", choices=SyntheticAdvertSource.PATTERNS)
+    parser.add_argument("--max-rate", type=float, default=0, metavar="HZ", help="Liga o IngestGate no teste do callback (anúncios/s por MAC)")
+    parser.add_argument("--no-gui", action="store_true", help="Não executa os benchmarks da interface")
+    parser.add_argument("--json", action="store_true", help="Imprime o resultado em JSON")
+    args = parser.parse_args()
+
+    report = {
+        "callback": [bench_callback(n, args.adverts, args.pattern, args.max_rate) for n in args.callback_devices],
+        "get_all_beacons": bench_get_all_beacons(args.sizes),
+    }
+    if not args.no_gui:
+        report["gui"] = bench_gui(args.devices)
+
+    if args.json: print(json.dumps(report, indent=2))
+    else: print_report(report)
+
+
+if __name__ == "__main__":
+    main()
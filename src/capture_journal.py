@@ -0,0 +1,213 @@
+import csv
+import glob
+import os
+import threading
+import time
+from collections import deque
+
+try:
+    import fcntl
+except ImportError:  # Windows: só o registro do próprio processo protege os segmentos abertos
+    fcntl = None
+
+from telemetry_store import CSV_HEADER, format_timestamp
+
+PART_SUFFIX = ".part"
+
+# Segmentos '.part' abertos por diários deste processo
+_live_parts = set()
+
+
+def _lock(f):
+    """Trava exclusiva (sem esperar) no arquivo aberto; False se outro escritor a detém."""
+    if fcntl is None: return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def recover_segments(directory, prefix="captura"):
+    """
+    Finaliza segmentos '.part' do diário 'prefix' deixados por uma sessão que
+    terminou de forma abrupta: descarta a última linha incompleta e renomeia
+    para '.csv'. Segmentos ainda abertos por um diário vivo (deste ou de outro
+    processo, que mantém uma trava no arquivo) são deixados como estão.
+    Retorna a lista dos arquivos recuperados.
+    """
+    recovered = []
+    for part in sorted(glob.glob(os.path.join(directory, f"{prefix}-*.csv" + PART_SUFFIX))):
+        if part in _live_parts: continue
+        try:
+            with open(part, "r+b") as f:
+                if not _lock(f): continue
+                data = f.read()
+                end = data.rfind(b"\n") + 1
+                if end < len(data):
+                    f.truncate(end)
+            final = part[:-len(PART_SUFFIX)]
+            os.replace(part, final)
+        except OSError:
+            continue # Em uso por outro processo (Windows) ou removido nesse meio tempo
+        recovered.append(final)
+    return recovered
+
+
+class CaptureJournal:
+    """
+    Diário de captura em disco, contínuo e resistente a falhas.
+
+    As leituras são enfileiradas por append() (seguro entre threads) e gravadas
+    em lotes por uma thread dedicada a cada flush_interval segundos, no mesmo
+    layout CSV da exportação. Os segmentos são rotacionados por tamanho
+    (max_bytes) e por idade (max_age); o segmento aberto tem o sufixo '.part'
+    e é recuperado na próxima inicialização caso o aplicativo seja encerrado
+    sem fechar o diário. Segmentos antigos são apagados quando os segmentos
+    do diário passam de max_total_bytes.
+
+    Vários diários podem dividir o diretório (a interface e o daemon, e os
+    prefixos 'captura' e 'esquecidos'): recuperação e retenção só tocam nos
+    arquivos 'prefix-*', e o segmento aberto fica travado (flock) para que
+    outro diário com o mesmo prefixo não o recupere enquanto é gravado.
+    """
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, max_age=3600.0, flush_interval=1.0,
+                 max_total_bytes=1024 * 1024 * 1024, prefix="captura"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self.max_total_bytes = max_total_bytes
+        self.prefix = prefix
+
+        os.makedirs(directory, exist_ok=True)
+        self.recovered = recover_segments(directory, prefix)
+
+        self.segments = []          # Segmentos finalizados da sessão atual
+        self.rows_written = 0
+        self.deleted_segments = 0   # Apagados pela retenção (max_total_bytes)
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._file = None
+        self._writer = None
+        self._path = None
+        self._opened_at = 0.0
+        self._seq = 0
+        self._session = time.strftime("%Y%m%d-%H%M%S")
+
+    def start(self):
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="capture-journal", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Grava o que estiver pendente e finaliza o segmento aberto."""
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._write_pending()
+            self._close_segment()
+
+    def append(self, timestamp, mac, nome, rssi):
+        self._pending.append((timestamp, mac, nome, rssi))
+
+    def append_many(self, rows):
+        self._pending.extend(rows)
+
+    def pending(self):
+        return len(self._pending)
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._write_pending()
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def _write_pending(self):
+        pending = self._pending
+        if not pending: return
+
+        rows = []
+        try:
+            while True: rows.append(pending.popleft())
+        except IndexError:
+            pass
+
+        if self._file is None or self._should_rotate():
+            self._close_segment()
+            self._open_segment()
+        self._writer.writerows((format_timestamp(ts), mac, nome, rssi) for ts, mac, nome, rssi in rows)
+        self.rows_written += len(rows)
+
+    def _should_rotate(self):
+        return self._file.tell() >= self.max_bytes or time.time() - self._opened_at >= self.max_age
+
+    def _open_segment(self):
+        # Nome livre: outra sessão iniciada no mesmo segundo (outro processo ou
+        # nova sessão deste diário) pode já ter usado o número
+        while True:
+            self._seq += 1
+            path = os.path.join(self.directory, f"{self.prefix}-{self._session}-{self._seq:04d}.csv")
+            if os.path.exists(path): continue
+            try: self._file = open(path + PART_SUFFIX, "x", newline="", encoding="utf-8")
+            except FileExistsError: continue
+            break
+        self._path = path
+        _live_parts.add(path + PART_SUFFIX)
+        _lock(self._file)
+        self._writer = csv.writer(self._file, delimiter=",")
+        self._writer.writerow(CSV_HEADER)
+        self._opened_at = time.time()
+
+    def _close_segment(self):
+        if self._file is None: return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        # Com flock, renomeia ainda travado: outro diário nunca vê o '.part' solto
+        if fcntl is not None: os.replace(self._path + PART_SUFFIX, self._path)
+        self._file.close()
+        if fcntl is None: os.replace(self._path + PART_SUFFIX, self._path)
+        _live_parts.discard(self._path + PART_SUFFIX)
+        self.segments.append(self._path)
+        self._file = self._writer = self._path = None
+        self._enforce_retention()
+
+    def _enforce_retention(self):
+        files = sorted(glob.glob(os.path.join(self.directory, f"{self.prefix}-*.csv")), key=os.path.getmtime)
+        total = sum(os.path.getsize(p) for p in files)
+        for path in files:
+            if total <= self.max_total_bytes: break
+            total -= os.path.getsize(path)
+            os.remove(path)
+            self.deleted_segments += 1
+            if path in self.segments: self.segments.remove(path)
+
+    def rotate(self):
+        """Finaliza o segmento atual; as próximas leituras vão para um novo arquivo."""
+        with self._lock:
+            self._write_pending()
+            self._close_segment()
+
+    def new_session(self):
+        """
+        Inicia uma nova sessão: o segmento atual é finalizado e sai da lista
+        da sessão (self.segments), mas os arquivos continuam no diretório. A
+        numeração dos segmentos continua, para que duas sessões no mesmo
+        segundo não escrevam no mesmo arquivo.
+        """
+        with self._lock:
+            self._pending.clear()
+            self._close_segment()
+            self.segments = []
+            self.rows_written = 0
+            self._session = time.strftime("%Y%m%d-%H%M%S")
@@ -0,0 +1,56 @@
+import threading
+
+
+class ChangeQueue:
+    """
+    Fila coalescente de alterações entre a thread do scanner e um consumidor
+    (a interface, por exemplo).
+
+    O scanner chama push(alterados, removidos) após cada publicação; os MACs
+    se acumulam em conjuntos, então um dispositivo que mudou em dez lotes
+    aparece uma única vez no próximo drain(). notify (opcional) é chamado na
+    thread do produtor só na primeira alteração depois de cada drain(): o
+    consumidor é acordado uma vez por rodada, não por lote. Se notify retornar
+    False (consumidor ainda não pronto), a notificação continua armada.
+    """
+    def __init__(self, notify=None):
+        self.notify = notify
+        self.batches = 0                # Lotes recebidos desde o último drain()
+        self._changed = set()
+        self._removed = set()
+        self._armed = True              # Próximo push()/wake() chama notify
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._changed) + len(self._removed)
+
+    def push(self, changed, removed=()):
+        with self._lock:
+            if removed:
+                self._changed.difference_update(removed)
+                self._removed.update(removed)
+            if changed:
+                self._removed.difference_update(changed) # Voltou depois de esquecido
+                self._changed.update(changed)
+            self.batches += 1
+            wake, self._armed = self._armed, False
+        if wake: self._notify()
+
+    def wake(self):
+        """Acorda o consumidor sem alterações de MAC (ex.: novas amostras gravadas)."""
+        with self._lock:
+            wake, self._armed = self._armed, False
+        if wake: self._notify()
+
+    def _notify(self):
+        if self.notify is not None and self.notify() is False:
+            with self._lock: self._armed = True
+
+    def drain(self):
+        """Retorna (alterados, removidos) acumulados e rearma a notificação."""
+        with self._lock:
+            changed, removed = self._changed, self._removed
+            self._changed, self._removed = set(), set()
+            self.batches = 0
+            self._armed = True
+        return changed, removed
@@ -0,0 +1,306 @@
+import csv
+import gc
+import io
+import multiprocessing
+import operator
+import os
+import threading
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from telemetry_store import TelemetryStore, parse_timestamp
+
+# Arquivos menores que isto são processados na própria thread, sem processos auxiliares
+PARALLEL_THRESHOLD = 16 * 1024 * 1024
+
+
+class ImportCancelled(Exception):
+    """A importação foi cancelada pelo usuário."""
+
+
+class ChunkResult:
+    """
+    Leituras de um bloco do CSV em colunas compactas, com ids locais de
+    dispositivo, e as mesmas leituras já agrupadas por dispositivo.
+    """
+    __slots__ = ("devices", "timestamps", "device_ids", "rssi", "is_sorted", "series", "last_rows")
+
+    def __init__(self, devices, timestamps, device_ids, rssi, is_sorted, series, last_rows):
+        self.devices = devices          # id local -> (MAC, nome)
+        self.timestamps = timestamps
+        self.device_ids = device_ids
+        self.rssi = rssi
+        self.is_sorted = is_sorted
+        self.series = series            # id local -> (timestamps, rssi)
+        self.last_rows = last_rows      # id local -> posição da última leitura no bloco
+
+
+def _lookup_table(column, convert):
+    """Converte cada valor distinto da coluna uma única vez e retorna o dicionário de consulta."""
+    return {text: convert(text) for text in set(column)}
+
+
+def _parse_columns(text):
+    """
+    Caminho vetorizado para blocos bem formados (sem aspas e o mesmo número de
+    campos em todas as linhas; colunas além das quatro primeiras, como as
+    colunas extras da exportação, são descartadas): o texto é quebrado numa
+    lista plana de campos e cada coluna é convertida com map/slices em C, sem
+    laço Python por linha.
+    Retorna None se o bloco exigir o caminho linha a linha.
+    """
+    if '"' in text: return None
+    if "\r" in text:
+        text = text.replace("\r\n", "\n")
+        if "\r" in text: return None
+    if text.startswith("Timestamp,"): text = text[text.find("\n") + 1:]
+    if text.endswith("\n"): text = text[:-1]
+    if not text: return ChunkResult([], array("d"), array("I"), array("b"), True, [], [])
+
+    # Largura de cada linha (contagem de vírgulas com map em C): linhas de
+    # larguras diferentes desalinhariam as colunas fatiadas abaixo
+    lines = text.split("\n")
+    widths = set(map(str.count, lines, repeat(",", len(lines))))
+    if len(widths) != 1: return None
+    width = widths.pop() + 1
+    if width < 4: return None
+    fields = ",".join(lines).split(",")
+
+    try:
+        ts_column, rssi_column = fields[0::width], fields[3::width]
+        timestamps = array("d", map(_lookup_table(ts_column, parse_timestamp).__getitem__, ts_column))
+        rssi = array("b", map(_lookup_table(rssi_column, int).__getitem__, rssi_column))
+    except (ValueError, OverflowError):
+        return None
+
+    keys = list(zip(fields[1::width], fields[2::width]))
+    devices = list(dict.fromkeys(keys))  # Ordem da primeira aparição
+    table = {key: i for i, key in enumerate(devices)}
+    ids_list = list(map(table.__getitem__, keys))
+    device_ids = array("I", ids_list)
+    is_sorted = all(map(operator.le, timestamps, timestamps[1:]))
+
+    # Agrupa por dispositivo com uma ordenação estável dos índices das linhas
+    n = len(ids_list)
+    order = sorted(range(n), key=ids_list.__getitem__)
+    grouped_ts = operator.itemgetter(*order)(timestamps) if n > 1 else tuple(timestamps)
+    grouped_rssi = operator.itemgetter(*order)(rssi) if n > 1 else tuple(rssi)
+
+    counts = Counter(ids_list)
+    series, last_rows = [], []
+    pos = 0
+    for device_id in range(len(devices)):
+        count = counts[device_id]
+        series.append((array("d", grouped_ts[pos:pos + count]), array("b", grouped_rssi[pos:pos + count])))
+        last_rows.append(order[pos + count - 1])
+        pos += count
+
+    return ChunkResult(devices, timestamps, device_ids, rssi, is_sorted, series, last_rows)
+
+
+def parse_chunk(data):
+    """
+    Converte um bloco de linhas completas do CSV (Timestamp, MAC, Nome, RSSI)
+    em colunas. Linhas inválidas são ignoradas, como na importação original.
+    Os timestamps se repetem a cada segundo, então são convertidos uma única
+    vez por texto distinto.
+    """
+    # Milhões de objetos temporários: o coletor de ciclos só atrapalharia aqui
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _parse_chunk(data.decode("utf-8", errors="replace"))
+    finally:
+        if gc_was_enabled: gc.enable()
+
+
+def _parse_chunk(text):
+    fast = _parse_columns(text)
+    if fast is not None: return fast
+
+    if '"' in text:
+        rows = csv.reader(io.StringIO(text, newline=""), delimiter=",")
+    else:
+        # Sem aspas não há vírgulas dentro dos campos
+        rows = (line.split(",") for line in text.splitlines())
+
+    local_ids = {}
+    devices = []
+    series = []
+    last_rows = []
+    timestamps, device_ids, rssi_col = array("d"), array("I"), array("b")
+    ts_cache = {}
+    last_ts = 0.0
+    is_sorted = True
+
+    for row in rows:
+        if len(row) < 4: continue
+        try: rssi = int(row[3])
+        except ValueError: continue
+
+        ts_text = row[0]
+        ts = ts_cache.get(ts_text)
+        if ts is None:
+            try: ts = ts_cache[ts_text] = parse_timestamp(ts_text)
+            except ValueError: ts = last_ts # Mantém o último instante válido
+        if ts < last_ts: is_sorted = False
+        last_ts = ts
+
+        key = (row[1], row[2])
+        device_id = local_ids.get(key)
+        if device_id is None:
+            device_id = local_ids[key] = len(devices)
+            devices.append(key)
+            series.append((array("d"), array("b")))
+            last_rows.append(0)
+
+        if rssi < -128: rssi = -128
+        elif rssi > 127: rssi = 127
+        last_rows[device_id] = len(timestamps)
+        timestamps.append(ts)
+        device_ids.append(device_id)
+        rssi_col.append(rssi)
+        dev_ts, dev_rssi = series[device_id]
+        dev_ts.append(ts)
+        dev_rssi.append(rssi)
+
+    return ChunkResult(devices, timestamps, device_ids, rssi_col, is_sorted, series, last_rows)
+
+
+def iter_chunks(f, chunk_bytes):
+    """Lê o arquivo binário em blocos grandes terminados em quebra de linha."""
+    remainder = b""
+    while True:
+        data = f.read(chunk_bytes)
+        if not data:
+            if remainder: yield remainder
+            return
+        data = remainder + data
+        cut = data.rfind(b"\n") + 1
+        if cut == 0:
+            remainder = data
+            continue
+        remainder = data[cut:]
+        yield data[:cut]
+
+
+class ImportResult:
+    """Resultado da importação: store colunar, séries por MAC e última leitura de cada MAC."""
+    def __init__(self):
+        self.store = TelemetryStore()
+        self.series = {}    # MAC -> (timestamps, rssi)
+        self.latest = {}    # MAC -> {'mac', 'nome', 'rssi'}
+        self.first_name = {}
+
+    def merge(self, chunk):
+        store = self.store
+        mapping = [store.intern(mac, nome) for mac, nome in chunk.devices]
+        global_ids = array("I", map(mapping.__getitem__, chunk.device_ids))
+        store.extend(chunk.timestamps, global_ids, chunk.rssi, is_sorted=chunk.is_sorted)
+
+        latest_row = {}
+        for d, (mac, nome) in enumerate(chunk.devices):
+            dev_ts, dev_rssi = chunk.series[d]
+            series = self.series.get(mac)
+            if series is None:
+                series = self.series[mac] = (array("d"), array("b"))
+                self.first_name[mac] = nome
+            series[0].extend(dev_ts)
+            series[1].extend(dev_rssi)
+            # A última linha do bloco define a leitura mais recente do MAC
+            row = chunk.last_rows[d]
+            if row >= latest_row.get(mac, -1):
+                latest_row[mac] = row
+                self.latest[mac] = {'mac': mac, 'nome': nome, 'rssi': dev_rssi[-1]}
+
+
+class CsvImporter:
+    """
+    Importa um CSV de leituras em segundo plano, sem travar a interface.
+
+    O arquivo é lido em blocos grandes; cada bloco é convertido por parse_chunk
+    num processo auxiliar (arquivos grandes) ou na própria thread (arquivos
+    pequenos), e os resultados são mesclados em ordem diretamente em buffers
+    compactos. O progresso fica em self.progress (0.0 a 1.0) e cancel() pode
+    ser chamado de qualquer thread.
+    """
+    def __init__(self, filepath, chunk_bytes=8 * 1024 * 1024, workers=None):
+        self.filepath = filepath
+        self.chunk_bytes = chunk_bytes
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.total_bytes = os.path.getsize(filepath)
+        self.bytes_done = 0
+        self.result = None
+        self.error = None
+        self._cancel = threading.Event()
+        self._thread = None
+
+    @property
+    def progress(self):
+        if not self.total_bytes: return 1.0
+        return min(1.0, self.bytes_done / self.total_bytes)
+
+    @property
+    def done(self):
+        return self._thread is not None and not self._thread.is_alive()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run_safe, name="csv-import", daemon=True)
+        self._thread.start()
+
+    def _run_safe(self):
+        try:
+            self.result = self.run()
+        except ImportCancelled:
+            self.result = None
+        except Exception as e:
+            self.error = e
+
+    def run(self):
+        """Executa a importação de forma síncrona e retorna um ImportResult."""
+        result = ImportResult()
+        with open(self.filepath, "rb") as f:
+            if self.total_bytes < PARALLEL_THRESHOLD or self.workers == 1:
+                for data in iter_chunks(f, self.chunk_bytes):
+                    self._check_cancel()
+                    result.merge(parse_chunk(data))
+                    self.bytes_done += len(data)
+            else:
+                self._run_parallel(f, result)
+        self._check_cancel()
+        return result
+
+    def _run_parallel(self, f, result):
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+            in_flight = []
+            try:
+                for data in iter_chunks(f, self.chunk_bytes):
+                    self._check_cancel()
+                    in_flight.append((pool.submit(parse_chunk, data), len(data)))
+                    # Limita os blocos em memória; os resultados são mesclados em ordem
+                    if len(in_flight) >= self.workers * 2:
+                        self._merge_next(in_flight, result)
+                while in_flight:
+                    self._check_cancel()
+                    self._merge_next(in_flight, result)
+            except ImportCancelled:
+                for future, _ in in_flight: future.cancel()
+                raise
+
+    def _merge_next(self, in_flight, result):
+        future, size = in_flight.pop(0)
+        result.merge(future.result())
+        self.bytes_done += size
+
+    def _check_cancel(self):
+        if self._cancel.is_set(): raise ImportCancelled()
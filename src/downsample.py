@@ -0,0 +1,73 @@
+import numpy as np
+
+
+def break_gaps(xs, ys, max_gap):
+    """
+    Insere um ponto NaN entre leituras separadas por mais de max_gap (mesma
+    unidade de xs): o Matplotlib interrompe a linha ali em vez de ligar os
+    dois lados do intervalo sem dados. Retorna dois arrays NumPy.
+    """
+    x = np.asarray(xs, dtype=np.float64)
+    y = np.asarray(ys, dtype=np.float64)
+    cut = np.flatnonzero(np.diff(x) > max_gap) + 1
+    if not len(cut): return x, y
+    return np.insert(x, cut, (x[cut - 1] + x[cut]) / 2), np.insert(y, cut, np.nan)
+
+
+def lttb(xs, ys, threshold):
+    """
+    Reduz uma série a 'threshold' pontos com o algoritmo Largest-Triangle-Three-Buckets,
+    que preserva a forma visual (picos e vales) da curva.
+
+    xs devem estar em ordem crescente. Retorna dois arrays NumPy. O laço é por
+    balde (no máximo 'threshold' iterações), com as contas de cada balde vetorizadas.
+    Pontos NaN (interrupções de break_gaps) ficam fora da redução e voltam
+    entre os pontos escolhidos dos dois lados de cada interrupção.
+    """
+    x = np.asarray(xs, dtype=np.float64)
+    y = np.asarray(ys, dtype=np.float64)
+    if threshold >= len(x) or threshold < 3:
+        return x, y
+    gaps = np.isnan(y)
+    if not gaps.any():
+        out = _lttb_index(x, y, threshold)
+        return x[out], y[out]
+
+    valid = np.flatnonzero(~gaps)
+    out = valid[_lttb_index(x[valid], y[valid], threshold)]
+    before = np.cumsum(gaps)[out] # Interrupções anteriores a cada ponto escolhido
+    cut = np.flatnonzero(np.diff(before)) + 1
+    xs, ys = x[out], y[out]
+    return np.insert(xs, cut, (xs[cut - 1] + xs[cut]) / 2), np.insert(ys, cut, np.nan)
+
+
+def _lttb_index(x, y, threshold):
+    """Posições escolhidas pelo LTTB (série sem NaN)."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Limites dos baldes intermediários (o primeiro e o último ponto são mantidos)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    out = np.empty(threshold, dtype=np.int64)
+    out[0] = 0
+    out[-1] = n - 1
+
+    # Média de cada balde, usada como terceiro vértice do triângulo
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_x = np.append(sums_x / counts, x[-1])
+    avg_y = np.append(sums_y / counts, y[-1])
+
+    a = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        bx, by = x[start:stop], y[start:stop]
+        cx, cy = avg_x[i + 1], avg_y[i + 1]
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - cx) * (by - ay) - (ax - bx) * (cy - ay))
+        a = start + int(area.argmax())
+        out[i + 1] = a
+
+    return out
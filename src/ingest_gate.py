@@ -0,0 +1,99 @@
+class IngestGate:
+    """
+    Estágio de entrada do scanner: decide, logo no início do callback, se um
+    anúncio passa pelo processamento completo (nome, histórico, filtros,
+    stream, decodificação) ou é apenas dobrado no agregado do dispositivo.
+
+    Cada MAC tem um intervalo aberto que começa no último anúncio aceito.
+    Dentro de 1/max_rate segundos, anúncios com o mesmo payload não são
+    processados: entram na contagem, no mínimo, no máximo e na soma do RSSI
+    do intervalo. Cópias exatas (mesmo RSSI e payload a menos de
+    duplicate_window segundos do último anúncio aceito, como os relatos
+    repetidos de alguns adaptadores) são descartadas mesmo sem limite de taxa
+    e não entram no agregado. A janela não é renovada pelas cópias: um
+    dispositivo que repete o mesmo anúncio continua tendo um aceito a cada
+    duplicate_window segundos. Payload diferente sempre passa, para não
+    perder mudanças de telemetria.
+
+    admit() retorna False para anúncios dobrados e cópias; quem chama deve
+    ainda assim contar o anúncio como sinal de vida do dispositivo (o
+    BeaconScanner atualiza o last_seen).
+
+    Quando o intervalo termina (próximo anúncio aceito ou flush() após o
+    prazo), o agregado (anúncios, RSSI mínimo/máximo/médio) fica em
+    self.closed[MAC] até o scanner recolhê-lo com take().
+
+    Contadores: received (anúncios avaliados), accepted, folded (dobrados no
+    agregado) e duplicates (cópias descartadas).
+    """
+    def __init__(self, max_rate=20.0, duplicate_window=0.05):
+        self.max_rate = max_rate
+        self.min_interval = 1.0 / max_rate if max_rate else 0.0
+        self.duplicate_window = duplicate_window
+        self.received = 0
+        self.accepted = 0
+        self.folded = 0
+        self.duplicates = 0
+        self.closed = {}        # MAC -> (início, anúncios, RSSI mín, RSSI máx, RSSI médio)
+        self._state = {}        # MAC -> [início, anúncios, mín, máx, soma, último instante, último RSSI, manufacturer, service]
+        self._folding = set()   # MACs com anúncios dobrados no intervalo aberto
+
+    def __len__(self):
+        return len(self._state)
+
+    def admit(self, mac, now, rssi, manufacturer_data, service_data):
+        """True se o anúncio deve ser processado; False se foi dobrado ou descartado."""
+        self.received += 1
+        state = self._state.get(mac)
+        if state is not None and manufacturer_data == state[7] and service_data == state[8]:
+            if rssi == state[6] and now - state[0] < self.duplicate_window:
+                self.duplicates += 1
+                state[5] = now
+                return False
+            if now - state[0] < self.min_interval:
+                self.folded += 1
+                state[1] += 1
+                if rssi < state[2]: state[2] = rssi
+                elif rssi > state[3]: state[3] = rssi
+                state[4] += rssi
+                state[5] = now
+                state[6] = rssi
+                self._folding.add(mac)
+                return False
+
+        if state is not None: self._close(mac, state)
+        self._state[mac] = [now, 1, rssi, rssi, rssi, now, rssi, manufacturer_data, service_data]
+        self.accepted += 1
+        return True
+
+    def _close(self, mac, state):
+        count = state[1]
+        if count: self.closed[mac] = (state[0], count, state[2], state[3], state[4] / count)
+        self._folding.discard(mac)
+
+    def flush(self, now):
+        """
+        Fecha os intervalos com anúncios dobrados cujo prazo já passou (o
+        dispositivo calou antes do próximo anúncio aceito). Retorna os MACs.
+        """
+        limit = now - self.min_interval
+        done = [mac for mac in self._folding if self._state[mac][0] <= limit]
+        for mac in done:
+            state = self._state[mac]
+            self._close(mac, state)
+            state[1] = 0 # Prazo vencido e sem anúncios: o próximo anúncio é aceito e abre outro intervalo
+        return done
+
+    def take(self, mac):
+        """Retorna e remove o agregado do último intervalo fechado do MAC (ou None)."""
+        return self.closed.pop(mac, None)
+
+    def forget(self, mac):
+        self._state.pop(mac, None)
+        self._folding.discard(mac)
+        self.closed.pop(mac, None)
+
+    def clear(self):
+        self._state.clear()
+        self._folding.clear()
+        self.closed.clear()
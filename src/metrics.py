@@ -0,0 +1,369 @@
+"""
+Métricas internas do Radar BLE: contadores, medidores e histogramas, com
+exposição no formato texto do Prometheus e um profiler por amostragem.
+
+As métricas são lidas sob demanda: contadores e medidores podem receber uma
+função (fn) que lê o valor direto do objeto observado na hora da coleta, sem
+custo no caminho quente. Só os histogramas são alimentados por quem mede.
+
+Uso:
+    registry = MetricsRegistry()
+    register_scanner(registry, scanner)
+    register_journal(registry, journal)
+    registry.snapshot()                                 # API em processo
+    MetricsServer(registry, port=9464).start()          # GET http://127.0.0.1:9464/metrics
+"""
+import collections
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from beacon_scanner import LATENCY_SAMPLE_EVERY
+
+# Limites (segundos) dos histogramas de latência
+CALLBACK_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3, 1e-2)
+FRAME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_labels(labels):
+    if not labels: return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"): return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15: return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contador crescente. Com fn, o valor é lido do objeto observado na coleta."""
+    kind = "counter"
+
+    def __init__(self, fn=None):
+        self.fn = fn
+        self._value = 0
+
+    def inc(self, amount=1):
+        self._value += amount
+
+    @property
+    def value(self):
+        return self.fn() if self.fn is not None else self._value
+
+
+class Gauge(Counter):
+    """Valor instantâneo (tamanho de fila, memória, ...)."""
+    kind = "gauge"
+
+    def set(self, value):
+        self._value = value
+
+
+class Histogram:
+    """
+    Histograma de buckets fixos (cumulativos na exposição). observe() é
+    chamado por uma única thread por histograma; a coleta só lê.
+    """
+    kind = "histogram"
+
+    def __init__(self, buckets=FRAME_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)    # O último é o +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        buckets = self.buckets
+        while i < len(buckets) and value > buckets[i]: i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        """Context manager que observa a duração do bloco."""
+        return _Timer(self)
+
+    def quantile(self, q):
+        """Estimativa do quantil q (limite superior do bucket), ou None sem observações."""
+        if not self.count: return None
+        target = q * self.count
+        total = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            total += n
+            if total >= target: return bound
+        return float("inf")
+
+    @property
+    def value(self):
+        return {"count": self.count, "sum": self.sum, "p50": self.quantile(0.5), "p99": self.quantile(0.99)}
+
+
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class MetricsRegistry:
+    """Conjunto de métricas por (nome, rótulos), com ajuda para a exposição."""
+    def __init__(self):
+        self._metrics = {}  # nome -> (ajuda, {rótulos ordenados: métrica})
+        self._lock = threading.Lock()
+
+    def _add(self, name, help_text, metric, labels):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            entry = self._metrics.setdefault(name, (help_text, {}))
+            existing = entry[1].get(key)
+            if existing is not None:
+                if existing.kind != metric.kind: raise ValueError(f"Métrica {name} já registrada como {existing.kind}")
+                if getattr(metric, "fn", None) is not None: existing.fn = metric.fn
+                return existing
+            entry[1][key] = metric
+        return metric
+
+    def counter(self, name, help_text="", fn=None, labels=None):
+        return self._add(name, help_text, Counter(fn), labels)
+
+    def gauge(self, name, help_text="", fn=None, labels=None):
+        return self._add(name, help_text, Gauge(fn), labels)
+
+    def histogram(self, name, help_text="", buckets=FRAME_BUCKETS, labels=None):
+        return self._add(name, help_text, Histogram(buckets), labels)
+
+    def get(self, name, labels=None):
+        entry = self._metrics.get(name)
+        if entry is None: return None
+        return entry[1].get(tuple(sorted((labels or {}).items())))
+
+    def snapshot(self):
+        """{nome{rótulos}: valor} de todas as métricas; histogramas viram dicts com count/sum/p50/p99."""
+        with self._lock: items = [(name, list(series.items())) for name, (_, series) in self._metrics.items()]
+        return {name + _format_labels(dict(key)): metric.value for name, series in items for key, metric in series}
+
+    def render(self):
+        """Texto no formato de exposição do Prometheus (versão 0.0.4)."""
+        with self._lock: items = [(name, help_text, list(series.items())) for name, (help_text, series) in self._metrics.items()]
+        lines = []
+        for name, help_text, series in items:
+            if help_text: lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {series[0][1].kind}")
+            for key, metric in series:
+                labels = dict(key)
+                if metric.kind != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(metric.value)}")
+                    continue
+                total = 0
+                for bound, n in zip(metric.buckets + (float("inf"),), metric.counts):
+                    total += n
+                    lines.append(f"{name}_bucket{_format_labels(dict(labels, le=_format_value(float(bound))))} {total}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(metric.sum)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+
+def register_scanner(registry, scanner):
+    """Métricas do BeaconScanner; liga também os histogramas de latência do callback e da publicação."""
+    scanner.callback_latency = registry.histogram("radar_callback_seconds", f"Duração do callback de anúncios (1 em cada {LATENCY_SAMPLE_EVERY})", CALLBACK_BUCKETS)
+    scanner.publish_latency = registry.histogram("radar_publish_seconds", "Duração da publicação de um snapshot", FRAME_BUCKETS)
+    registry.counter("radar_adverts_total", "Anúncios recebidos pelo callback", lambda: scanner.adverts)
+    registry.gauge("radar_adverts_per_second", "Anúncios por segundo (último segundo)", lambda: scanner.adverts_per_second)
+    registry.gauge("radar_devices", "Dispositivos em memória no scanner", lambda: len(scanner.beacons))
+    registry.gauge("radar_snapshot_devices", "Dispositivos no último snapshot publicado", lambda: len(scanner.snapshot.beacons))
+    registry.gauge("radar_snapshot_version", "Versão do último snapshot publicado", lambda: scanner.snapshot.version)
+    registry.gauge("radar_dirty_devices", "Dispositivos alterados aguardando publicação", lambda: len(scanner._dirty))
+    registry.gauge("radar_filter_pending", "Leituras aguardando o banco de filtros", lambda: scanner.filters.pending())
+    registry.gauge("radar_history_bytes", "Memória reservada pelo histórico de anúncios", lambda: scanner.history.memory_bytes())
+    registry.counter("radar_history_dropped_samples_total", "Amostras descartadas pelo orçamento de memória do histórico",
+                     lambda: scanner.history.dropped)
+    registry.counter("radar_history_evicted_total", "Dispositivos descartados do histórico por falta de orçamento",
+                     lambda: scanner.history.evicted)
+    registry.gauge("radar_history_capacity", "Amostras por dispositivo no histórico (reduzida conforme o nº de dispositivos)",
+                   lambda: scanner.history.capacity)
+    registry.counter("radar_evicted_total", "Dispositivos esquecidos por TTL ou limite", lambda: scanner.evicted)
+    registry.counter("radar_coalesced_total", "Endereços rotativos unidos a um dispositivo conhecido", lambda: scanner.coalesced)
+    ingest = scanner.ingest
+    if ingest is not None:
+        registry.counter("radar_ingest_accepted_total", "Anúncios aceitos pelo estágio de entrada", lambda: ingest.accepted)
+        registry.counter("radar_ingest_folded_total", "Anúncios acima da taxa máxima dobrados no agregado do dispositivo",
+                         lambda: ingest.folded)
+        registry.counter("radar_ingest_duplicates_total", "Cópias exatas de anúncios descartadas", lambda: ingest.duplicates)
+
+
+def register_journal(registry, journal):
+    """Métricas de um CaptureJournal, rotuladas pelo prefixo dos segmentos."""
+    labels = {"journal": journal.prefix}
+    registry.gauge("radar_journal_pending_rows", "Leituras aguardando gravação no diário", journal.pending, labels)
+    registry.counter("radar_journal_rows_total", "Leituras gravadas no diário", lambda: journal.rows_written, labels)
+    registry.counter("radar_journal_deleted_segments_total", "Segmentos apagados pela retenção do diário",
+                     lambda: journal.deleted_segments, labels)
+
+
+def register_stream(registry, stream):
+    """Métricas de um AdvertStreamServer."""
+    registry.gauge("radar_stream_subscribers", "Assinantes conectados ao stream de anúncios", lambda: len(stream.subscribers))
+    registry.gauge("radar_stream_pending", "Anúncios aguardando o próximo lote do stream", stream.pending)
+    registry.counter("radar_stream_records_total", "Registros enviados aos assinantes", lambda: stream.records_sent)
+    registry.counter("radar_stream_dropped_total", "Registros descartados por assinantes lentos", lambda: stream.dropped)
+    registry.counter("radar_stream_disconnected_total", "Assinantes desconectados por atraso", lambda: stream.disconnected)
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """
+    Profiler por amostragem para investigar o caminho quente sem instrumentar
+    o código: a cada 'interval' segundos uma thread própria lê a pilha das
+    demais threads (sys._current_frames) e conta as pilhas vistas. O custo
+    fica na thread do profiler e só existe enquanto ele está ligado.
+
+    As contagens são alteradas sob self._lock, uma vez por rodada; collapsed()
+    e top() trabalham numa cópia tirada sob o mesmo lock (counts()).
+    """
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self.stacks = collections.Counter()     # pilha (raiz;...;folha) -> amostras
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+
+    def toggle(self):
+        """Liga ou desliga; retorna True se ficou ligado."""
+        if self.running: self.stop()
+        else: self.start()
+        return self.running
+
+    def clear(self):
+        with self._lock:
+            self.stacks.clear()
+            self.samples = 0
+
+    def counts(self):
+        """Cópia das contagens por pilha, segura enquanto o profiler roda."""
+        with self._lock: return dict(self.stacks)
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop_event.wait(self.interval):
+            seen = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me: continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    name = names.get(code)
+                    if name is None: name = names[code] = _frame_name(frame)
+                    stack.append(name)
+                    frame = frame.f_back
+                stack.reverse()
+                seen.append(";".join(stack))
+            with self._lock:
+                self.stacks.update(seen)
+                self.samples += 1
+
+    def collapsed(self):
+        """Pilhas no formato 'collapsed' (uma por linha com a contagem), aceito por flamegraph.pl e speedscope."""
+        return "".join(f"{stack} {n}\n" for stack, n in collections.Counter(self.counts()).most_common())
+
+    def top(self, n=20):
+        """[(função, amostras em que estava no topo da pilha)] das n mais frequentes."""
+        leaves = collections.Counter()
+        for stack, count in self.counts().items(): leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(n)
+
+
+class MetricsServer:
+    """
+    Servidor HTTP local (127.0.0.1 por padrão) com as métricas e o profiler:
+
+        GET  /metrics          métricas no formato texto do Prometheus
+        GET  /profile          pilhas coletadas (formato collapsed)
+        POST /profile/start    liga o profiler
+        POST /profile/stop     desliga o profiler
+
+    port=0 escolhe uma porta livre (ver self.port depois de start()).
+    """
+    def __init__(self, registry, port=9464, host="127.0.0.1", profiler=None):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.profiler = profiler if profiler is not None else SamplingProfiler()
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        if self._server is not None: return
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, code, body, content_type="text/plain; charset=utf-8"):
+                data = body.encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path == "/metrics": self._reply(200, server.registry.render(), "text/plain; version=0.0.4; charset=utf-8")
+                elif path == "/profile": self._reply(200, server.profiler.collapsed())
+                else: self._reply(404, "não encontrado\n")
+
+            def do_POST(self):
+                path = self.path.split("?", 1)[0]
+                if path == "/profile/start": server.profiler.start()
+                elif path == "/profile/stop": server.profiler.stop()
+                else: return self._reply(404, "não encontrado\n")
+                self._reply(200, f"profiler {'ligado' if server.profiler.running else 'desligado'}, {server.profiler.samples} amostras\n")
+
+            def log_message(self, *args):
+                pass # Coletas periódicas não poluem a saída
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._server is None: return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = self._thread = None
+        self.profiler.stop()
@@ -0,0 +1,133 @@
+"""
+Exportação do gráfico de RSSI fora da tela e fora da thread da interface.
+
+A interface monta um PlotSpec (cópia das séries, títulos, legendas, cores e
+limites do gráfico) e o PlotExporter desenha cada um numa Figure própria, com
+o backend Agg (PNG/JPEG) ou o vetorial do formato (PDF/SVG), sem tocar na
+figura ao vivo. Antes de desenhar, cada série é reduzida por LTTB: um ponto
+por pixel nas imagens e no máximo VECTOR_MAX_POINTS nos formatos vetoriais,
+o que mantém PDF/SVG pequenos sem perder picos e vales.
+
+Uma exportação única roda numa thread; exportações em lote (uma figura por
+dispositivo ou por período) são divididas entre processos auxiliares.
+"""
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from downsample import lttb
+
+MARKER_LIMIT = 300 # Acima disto as linhas do gráfico são desenhadas sem marcadores
+VECTOR_FORMATS = ("pdf", "svg", "eps", "ps")
+VECTOR_MAX_POINTS = 4000 # Pontos por série nos formatos vetoriais
+EXPORT_DPI = 300
+
+
+class PlotSpec:
+    """
+    Retrato do gráfico para exportação. series: lista de (legenda, xs, ys, cor),
+    com xs/ys arrays NumPy já copiados e cor None para usar o ciclo padrão.
+    """
+    __slots__ = ("title", "xlabel", "ylabel", "xlim", "ylim", "series", "figsize")
+
+    def __init__(self, title, xlabel, ylabel, xlim, ylim, series, figsize=(8, 4)):
+        self.title = title
+        self.xlabel = xlabel
+        self.ylabel = ylabel
+        self.xlim = xlim
+        self.ylim = ylim
+        self.series = series
+        self.figsize = figsize
+
+
+def file_slug(text):
+    """Trecho seguro para nome de arquivo (ex.: MAC ou instante)."""
+    return re.sub(r"[^0-9A-Za-z_-]+", "-", text).strip("-") or "grafico"
+
+
+def render_plot(spec, filepath, dpi=EXPORT_DPI):
+    """Desenha o PlotSpec numa figura fora da tela e grava em filepath (formato pela extensão)."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    vector = os.path.splitext(filepath)[1].lower().lstrip(".") in VECTOR_FORMATS
+    limit = VECTOR_MAX_POINTS if vector else max(100, int(spec.figsize[0] * dpi))
+
+    fig = Figure(figsize=spec.figsize)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    for label, xs, ys, color in spec.series:
+        if len(xs) > limit: xs, ys = lttb(xs, ys, limit)
+        ax.plot(xs, ys, marker='o' if len(xs) <= MARKER_LIMIT else '', markersize=3, label=label, color=color)
+    ax.set_title(spec.title)
+    ax.set_xlabel(spec.xlabel)
+    ax.set_ylabel(spec.ylabel)
+    ax.set_xlim(*spec.xlim)
+    ax.set_ylim(*spec.ylim)
+    ax.grid(True, linestyle='--', alpha=0.7)
+    if spec.series: ax.legend(loc="lower left")
+    fig.tight_layout()
+    fig.savefig(filepath, dpi=dpi, bbox_inches='tight')
+    return filepath
+
+
+class PlotExporter:
+    """
+    Grava uma lista de (PlotSpec, caminho) em segundo plano, no molde do
+    CsvImporter: start(), progress (0.0 a 1.0), done, cancel(), e os arquivos
+    gravados em self.written (ou a exceção em self.error).
+    """
+    def __init__(self, jobs, dpi=EXPORT_DPI, workers=None):
+        self.jobs = jobs
+        self.dpi = dpi
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.written = []
+        self.error = None
+        self._cancel = threading.Event()
+        self._thread = None
+
+    @property
+    def progress(self):
+        if not self.jobs: return 1.0
+        return len(self.written) / len(self.jobs)
+
+    @property
+    def done(self):
+        return self._thread is not None and not self._thread.is_alive()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run_safe, name="plot-export", daemon=True)
+        self._thread.start()
+
+    def _run_safe(self):
+        try:
+            self.run()
+        except Exception as e:
+            self.error = e
+
+    def run(self):
+        """Executa a exportação de forma síncrona e retorna os caminhos gravados."""
+        if len(self.jobs) == 1 or self.workers == 1:
+            for spec, filepath in self.jobs:
+                if self._cancel.is_set(): break
+                self.written.append(render_plot(spec, filepath, self.dpi))
+            return self.written
+
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(self.jobs)), mp_context=context) as pool:
+            futures = [pool.submit(render_plot, spec, filepath, self.dpi) for spec, filepath in self.jobs]
+            for future in futures:
+                if self._cancel.is_set():
+                    for pending in futures: pending.cancel()
+                    break
+                self.written.append(future.result())
+        return self.written
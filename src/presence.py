@@ -0,0 +1,485 @@
+"""
+Análise de presença: sessões, tempo de permanência e estatísticas de RSSI
+por dispositivo.
+
+Uma sessão de presença começa na primeira leitura de um dispositivo e
+termina quando ele fica mais de 'gap' segundos sem leituras; a permanência
+é a soma das durações (saída - entrada) das sessões. Por dispositivo o
+relatório traz primeira/última leitura, nº de leituras e de sessões,
+permanência e RSSI médio, variância, desvio, mínimo, P10, mediana, P90 e
+máximo (percentis pelo posto mais próximo).
+
+Gravações .rble são analisadas em paralelo: os MACs são divididos em shards
+de tamanho equilibrado e cada processo abre o próprio mmap da gravação, sem
+copiar dados entre processos. Em cada shard o cálculo é vetorizado com NumPy
+(cortes de sessão por diff, somas por reduceat e ordenação única para os
+percentis). Arquivos CSV passam antes pela importação paralela de
+csv_import.py.
+
+SessionTracker faz a mesma detecção incrementalmente sobre o scanner ao
+vivo e gera um PresenceReport no mesmo formato.
+
+Uso pela linha de comando:
+    python presence.py captura.rble --gap 30 --resumo resumo.csv --sessoes sessoes.csv
+"""
+import argparse
+import csv
+import math
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from csv_import import CsvImporter, ImportCancelled
+from recording import Recording
+from telemetry_store import format_timestamp
+
+SESSION_GAP = 30.0 # Segundos sem leituras que encerram uma sessão de presença
+PERCENTILES = (10, 50, 90)
+# Gravações com menos leituras que isto são analisadas na própria thread
+PARALLEL_THRESHOLD = 2_000_000
+MAX_LIVE_SESSIONS = 100_000 # Sessões encerradas mantidas pelo SessionTracker
+
+DEVICE_HEADER = ["MAC", "Nome", "Primeira Leitura", "Última Leitura", "Leituras", "Sessões", "Permanência (s)",
+                 "RSSI Médio", "RSSI Variância", "RSSI Desvio", "RSSI Mín", "RSSI P10", "RSSI Mediana", "RSSI P90",
+                 "RSSI Máx"]
+SESSION_HEADER = ["MAC", "Nome", "Entrada", "Saída", "Duração (s)", "Leituras", "RSSI Médio"]
+
+
+def _rank_positions(counts, q):
+    """Posição (0-based) do percentil q pelo posto mais próximo em grupos de 'counts' valores."""
+    return np.maximum(np.ceil(counts * (q / 100.0)).astype(np.int64) - 1, 0)
+
+
+class PresenceReport:
+    """
+    Resultado da análise em colunas NumPy: uma linha por dispositivo (MAC) e
+    uma por sessão (session_device aponta para a linha do dispositivo).
+    """
+    __slots__ = ("macs", "names", "first", "last", "count", "sessions", "dwell", "mean", "var", "rssi",
+                 "session_device", "enter", "exit", "session_count", "session_mean")
+
+    def __init__(self, macs, names, first, last, count, sessions, dwell, mean, var, rssi,
+                 session_device, enter, exit, session_count, session_mean):
+        self.macs = macs
+        self.names = names
+        self.first = first
+        self.last = last
+        self.count = count
+        self.sessions = sessions
+        self.dwell = dwell
+        self.mean = mean
+        self.var = var
+        self.rssi = rssi                        # n × 5: mín, P10, mediana, P90, máx
+        self.session_device = session_device
+        self.enter = enter
+        self.exit = exit
+        self.session_count = session_count
+        self.session_mean = session_mean
+
+    def __len__(self):
+        return len(self.macs)
+
+    @classmethod
+    def empty(cls):
+        f, i = np.zeros(0), np.zeros(0, dtype=np.int64)
+        return cls([], [], f, f, i, i, f, f, f, np.zeros((0, 5)), i, f, f, i, f)
+
+    @classmethod
+    def concat(cls, reports):
+        """Junta relatórios de shards distintos (MACs disjuntos) num só, ordenado por MAC."""
+        reports = [r for r in reports if len(r)]
+        if not reports: return cls.empty()
+        offsets = np.cumsum([0] + [len(r) for r in reports[:-1]])
+        macs = [mac for r in reports for mac in r.macs]
+        names = [nome for r in reports for nome in r.names]
+        cat = lambda attr: np.concatenate([getattr(r, attr) for r in reports])
+        session_device = np.concatenate([r.session_device + off for r, off in zip(reports, offsets)])
+
+        order = np.array(sorted(range(len(macs)), key=macs.__getitem__), dtype=np.int64)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        session_device = rank[session_device]
+        s_order = np.lexsort((cat("enter"), session_device))
+        return cls([macs[i] for i in order], [names[i] for i in order], cat("first")[order], cat("last")[order],
+                   cat("count")[order], cat("sessions")[order], cat("dwell")[order], cat("mean")[order],
+                   cat("var")[order], cat("rssi")[order], session_device[s_order], cat("enter")[s_order],
+                   cat("exit")[s_order], cat("session_count")[s_order], cat("session_mean")[s_order])
+
+    def device_rows(self, order="dwell", reverse=True, limit=None):
+        """
+        Linhas (no layout de DEVICE_HEADER, com instantes formatados) ordenadas
+        pela coluna 'order' (first, last, count, sessions, dwell, mean ou mac).
+        """
+        n = len(self)
+        if order == "mac": index = np.array(sorted(range(n), key=self.macs.__getitem__, reverse=reverse), dtype=np.int64)
+        else:
+            index = np.argsort(getattr(self, order), kind="stable")
+            if reverse: index = index[::-1]
+        if limit is not None: index = index[:limit]
+        return [self._device_row(i) for i in index.tolist()]
+
+    def _device_row(self, i):
+        mn, p10, p50, p90, mx = self.rssi[i].tolist()
+        var = float(self.var[i])
+        return (self.macs[i], self.names[i], format_timestamp(self.first[i]), format_timestamp(self.last[i]),
+                int(self.count[i]), int(self.sessions[i]), round(float(self.dwell[i]), 1),
+                round(float(self.mean[i]), 1), round(var, 2), round(math.sqrt(var), 2),
+                int(mn), int(p10), int(p50), int(p90), int(mx))
+
+    def session_rows(self, limit=None):
+        """Linhas no layout de SESSION_HEADER, por dispositivo e em ordem de entrada."""
+        n = len(self.enter) if limit is None else min(limit, len(self.enter))
+        macs, names, devs = self.macs, self.names, self.session_device
+        return [(macs[devs[i]], names[devs[i]], format_timestamp(self.enter[i]), format_timestamp(self.exit[i]),
+                 round(float(self.exit[i] - self.enter[i]), 1), int(self.session_count[i]),
+                 round(float(self.session_mean[i]), 1)) for i in range(n)]
+
+    def write_csv(self, filepath):
+        """Exporta o resumo por dispositivo (maior permanência primeiro). Retorna o nº de linhas."""
+        return _write_table(filepath, DEVICE_HEADER, self.device_rows())
+
+    def write_sessions_csv(self, filepath):
+        """Exporta a tabela de sessões. Retorna o nº de linhas."""
+        return _write_table(filepath, SESSION_HEADER, self.session_rows())
+
+
+def _write_table(filepath, header, rows):
+    with open(filepath, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter=",")
+        writer.writerow(header)
+        writer.writerows(rows)
+    return len(rows)
+
+
+def summarize(groups, gap=SESSION_GAP):
+    """
+    Analisa uma lista de (MAC, nome, timestamps, rssi), um item por MAC, e
+    retorna um PresenceReport. As séries podem ser arrays, memoryviews ou
+    arrays NumPy; se alguma estiver fora de ordem de tempo, tudo é reordenado.
+    """
+    groups = [g for g in groups if len(g[2])]
+    if not groups: return PresenceReport.empty()
+    counts = np.array([len(g[2]) for g in groups], dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    ends = starts + counts - 1
+    ts = np.concatenate([np.asarray(g[2], dtype=np.float64) for g in groups])
+    rs = np.concatenate([np.asarray(g[3], dtype=np.int8) for g in groups]).astype(np.int64)
+    dev = np.repeat(np.arange(len(groups)), counts)
+
+    step = np.diff(ts)
+    same_device = dev[1:] == dev[:-1]
+    if np.any(step[same_device] < 0):
+        order = np.lexsort((ts, dev))
+        ts, rs = ts[order], rs[order]
+        step = np.diff(ts)
+
+    # Cortes de sessão: início de cada dispositivo ou intervalo maior que gap
+    cut = np.ones(len(ts), dtype=bool)
+    cut[1:] = ~same_device | (step > gap)
+    s_start = np.flatnonzero(cut)
+    s_end = np.append(s_start[1:], len(ts)) - 1
+    s_dev = dev[s_start]
+    s_count = s_end - s_start + 1
+    enter, leave = ts[s_start], ts[s_end]
+    s_mean = np.add.reduceat(rs, s_start) / s_count
+
+    n = len(groups)
+    total = np.add.reduceat(rs, starts)
+    mean = total / counts
+    var = np.maximum(np.add.reduceat(rs * rs, starts) / counts - mean * mean, 0.0)
+
+    # Percentis: uma só ordenação pela chave (dispositivo, RSSI)
+    ranked = np.sort(dev * 256 + (rs + 128)) - dev * 256 - 128
+    rssi = np.empty((n, 5))
+    rssi[:, 0] = ranked[starts]
+    for col, q in enumerate(PERCENTILES, 1): rssi[:, col] = ranked[starts + _rank_positions(counts, q)]
+    rssi[:, 4] = ranked[ends]
+
+    return PresenceReport([g[0] for g in groups], [g[1] for g in groups], ts[starts], ts[ends], counts,
+                          np.bincount(s_dev, minlength=n), np.bincount(s_dev, weights=leave - enter, minlength=n),
+                          mean, var, rssi, s_dev, enter, leave, s_count, s_mean)
+
+
+def _recording_groups(rec, macs):
+    for mac in macs:
+        entries = rec.by_mac[mac]
+        ts, rs = rec.series(mac)
+        yield mac, max(entries, key=lambda e: e.t_max).nome, ts, rs
+
+
+def _analyze_shard(filepath, macs, gap):
+    """Executado nos processos de trabalho: cada um mapeia a gravação por conta própria."""
+    with Recording(filepath) as rec:
+        return summarize(list(_recording_groups(rec, macs)), gap)
+
+
+def plan_shards(sizes, shards):
+    """
+    Divide {chave: nº de leituras} em até 'shards' listas de custo parecido
+    (maior primeiro, sempre no shard mais leve).
+    """
+    bins = [[0, []] for _ in range(max(1, min(shards, len(sizes))))]
+    for key, size in sorted(sizes.items(), key=lambda item: -item[1]):
+        lightest = min(bins, key=lambda b: b[0])
+        lightest[0] += size
+        lightest[1].append(key)
+    return [keys for _, keys in bins if keys]
+
+
+class PresenceAnalysis:
+    """
+    Analisa um arquivo (.rble ou CSV) em segundo plano, no mesmo molde do
+    CsvImporter: start(), progress (0.0 a 1.0), done, cancel(), e o
+    PresenceReport em self.result (ou a exceção em self.error).
+    """
+    def __init__(self, filepath, gap=SESSION_GAP, workers=None):
+        self.filepath = filepath
+        self.gap = gap
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.result = None
+        self.error = None
+        self.elapsed = 0.0
+        self._importer = None
+        self._shards_done = 0
+        self._shards = 1
+        self._cancel = threading.Event()
+        self._thread = None
+
+    @property
+    def progress(self):
+        if self._importer is not None: return self._importer.progress
+        return self._shards_done / self._shards
+
+    @property
+    def done(self):
+        return self._thread is not None and not self._thread.is_alive()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+        if self._importer is not None: self._importer.cancel()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run_safe, name="presence-analysis", daemon=True)
+        self._thread.start()
+
+    def _run_safe(self):
+        try:
+            self.result = self.run()
+        except ImportCancelled:
+            self.result = None
+        except Exception as e:
+            self.error = e
+
+    def run(self):
+        """Executa a análise de forma síncrona e retorna um PresenceReport."""
+        started = time.perf_counter()
+        if self.filepath.lower().endswith(".rble"): report = self._run_recording()
+        else:
+            self._importer = CsvImporter(self.filepath, workers=self.workers)
+            result = self._importer.run()
+            self._check_cancel()
+            report = summarize([(mac, result.first_name[mac], ts, rs) for mac, (ts, rs) in result.series.items()],
+                               self.gap)
+        self.elapsed = time.perf_counter() - started
+        return report
+
+    def _run_recording(self):
+        with Recording(self.filepath) as rec:
+            sizes = {mac: sum(e.count for e in entries) for mac, entries in rec.by_mac.items()}
+            if len(rec) < PARALLEL_THRESHOLD or self.workers == 1:
+                return summarize(list(_recording_groups(rec, sizes)), self.gap)
+
+        # Mais shards que processos: o progresso anda em passos menores e os shards se equilibram
+        shards = plan_shards(sizes, self.workers * 4)
+        self._shards = len(shards)
+        context = multiprocessing.get_context("spawn")
+        parts = []
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+            futures = [pool.submit(_analyze_shard, self.filepath, macs, self.gap) for macs in shards]
+            try:
+                for future in futures:
+                    self._check_cancel()
+                    parts.append(future.result())
+                    self._shards_done += 1
+            except ImportCancelled:
+                for future in futures: future.cancel()
+                raise
+        return PresenceReport.concat(parts)
+
+    def _check_cancel(self):
+        if self._cancel.is_set(): raise ImportCancelled()
+
+
+class SessionTracker:
+    """
+    Detecção incremental de sessões sobre o scanner ao vivo.
+
+    attach(scanner) registra um listener (a cada publicação, só os MACs
+    alterados são examinados) e um sampler que encerra, uma vez por segundo,
+    as sessões caladas há mais de 'gap'. As sessões abertas ficam num
+    OrderedDict na ordem da última leitura, então encerrar as ociosas não
+    percorre os dispositivos ativos. As leituras contadas são as do snapshot
+    publicado (no máximo uma por dispositivo a cada publicação). RSSI de cada
+    dispositivo: contagem, soma, soma dos quadrados e histograma de 256
+    posições, o bastante para média, variância e percentis exatos.
+
+    Dispositivos esquecidos pelo scanner têm a sessão encerrada e saem do
+    relatório (as leituras deles continuam no diário em disco).
+    """
+    def __init__(self, gap=SESSION_GAP, max_sessions=MAX_LIVE_SESSIONS):
+        self.gap = gap
+        self.stats = {}                     # MAC -> [nome, primeira, última, leituras, soma, soma², histograma]
+        self.open = OrderedDict()           # MAC -> [entrada, última leitura, leituras, soma do RSSI]
+        self.closed = deque(maxlen=max_sessions) # (MAC, nome, entrada, saída, leituras, RSSI médio)
+        self.dwell = {}                     # MAC -> permanência das sessões já encerradas
+        self.sessions = {}                  # MAC -> nº de sessões (abertas e encerradas)
+        self._scanner = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.stats)
+
+    def attach(self, scanner, interval=1.0):
+        self._scanner = scanner
+        scanner.subscribe(self.on_changes)
+        scanner.add_sampler(lambda now, snapshot: self.close_idle(now), interval)
+
+    def on_changes(self, changed, removed):
+        """Listener do scanner (thread do scanner)."""
+        beacons = self._scanner.snapshot.beacons
+        with self._lock:
+            for mac in changed:
+                b = beacons.get(mac)
+                if b is not None: self._observe(mac, b['nome'], b['last_seen'], b['rssi'])
+            for mac in removed:
+                self._close(mac)
+                self.stats.pop(mac, None)
+                self.dwell.pop(mac, None)
+                self.sessions.pop(mac, None)
+
+    def observe(self, mac, nome, t, rssi):
+        """Registra uma leitura avulsa (fora do scanner, ex.: uma reprodução)."""
+        with self._lock: self._observe(mac, nome, t, rssi)
+
+    def _observe(self, mac, nome, t, rssi):
+        stats = self.stats.get(mac)
+        if stats is None:
+            stats = self.stats[mac] = [nome, t, t, 0, 0, 0, array("I", bytes(1024))]
+        elif t <= stats[2]: return # Nenhuma leitura nova (ex.: aviso de que ficou inativo)
+        rssi = -128 if rssi < -128 else (127 if rssi > 127 else int(rssi))
+        stats[0] = nome
+        stats[2] = t
+        stats[3] += 1
+        stats[4] += rssi
+        stats[5] += rssi * rssi
+        stats[6][rssi + 128] += 1
+
+        session = self.open.get(mac)
+        if session is not None and t - session[1] > self.gap:
+            self._close(mac)
+            session = None
+        if session is None:
+            self.open[mac] = [t, t, 1, rssi]
+            self.sessions[mac] = self.sessions.get(mac, 0) + 1
+        else:
+            session[1] = t
+            session[2] += 1
+            session[3] += rssi
+            self.open.move_to_end(mac)
+
+    def _close(self, mac):
+        session = self.open.pop(mac, None)
+        if session is None: return
+        enter, leave, count, total = session
+        self.closed.append((mac, self.stats[mac][0], enter, leave, count, total / count))
+        self.dwell[mac] = self.dwell.get(mac, 0.0) + (leave - enter)
+
+    def close_idle(self, now=None):
+        """Encerra as sessões sem leituras há mais de gap segundos. Retorna quantas."""
+        limit = (time.time() if now is None else now) - self.gap
+        closed = 0
+        with self._lock:
+            while self.open:
+                mac, session = next(iter(self.open.items()))
+                if session[1] >= limit: break
+                self._close(mac)
+                closed += 1
+        return closed
+
+    def clear(self):
+        with self._lock:
+            self.stats.clear()
+            self.open.clear()
+            self.closed.clear()
+            self.dwell.clear()
+            self.sessions.clear()
+
+    def report(self):
+        """PresenceReport do estado atual; as sessões abertas saem com a última leitura como saída."""
+        with self._lock:
+            macs = sorted(self.stats)
+            rows = [self.stats[mac] for mac in macs]
+            open_sessions = [(mac, self.stats[mac][0], s[0], s[1], s[2], s[3] / s[2]) for mac, s in self.open.items()]
+            sessions = [s for s in self.closed if s[0] in self.stats] + open_sessions
+            dwell = np.array([self.dwell.get(mac, 0.0) + (self.open[mac][1] - self.open[mac][0] if mac in self.open else 0.0)
+                              for mac in macs])
+            counts_by_mac = np.array([self.sessions.get(mac, 0) for mac in macs], dtype=np.int64)
+            hist = np.frombuffer(b"".join(r[6].tobytes() for r in rows), dtype=np.uint32).reshape(len(rows), 256) \
+                if rows else np.zeros((0, 256), dtype=np.uint32)
+        if not macs: return PresenceReport.empty()
+
+        count = np.array([r[3] for r in rows], dtype=np.int64)
+        mean = np.array([r[4] for r in rows]) / count
+        var = np.maximum(np.array([r[5] for r in rows]) / count - mean * mean, 0.0)
+        cumulative = np.cumsum(hist, axis=1)
+        levels = np.arange(-128, 128)
+        rssi = np.empty((len(macs), 5))
+        rssi[:, 0] = levels[np.argmax(hist > 0, axis=1)]
+        for col, q in enumerate(PERCENTILES, 1):
+            target = _rank_positions(count, q) + 1
+            rssi[:, col] = levels[(cumulative < target[:, None]).sum(axis=1)]
+        rssi[:, 4] = levels[255 - np.argmax(hist[:, ::-1] > 0, axis=1)]
+
+        row_of = {mac: i for i, mac in enumerate(macs)}
+        sessions.sort(key=lambda s: (row_of[s[0]], s[2]))
+        column = lambda k, dtype=np.float64: np.array([s[k] for s in sessions], dtype=dtype)
+        return PresenceReport(macs, [r[0] for r in rows], np.array([r[1] for r in rows]),
+                              np.array([r[2] for r in rows]), count, counts_by_mac, dwell, mean, var, rssi,
+                              np.array([row_of[s[0]] for s in sessions], dtype=np.int64), column(2), column(3),
+                              column(4, np.int64), column(5))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Relatório de presença (sessões, permanência e RSSI) de uma captura")
+    parser.add_argument("arquivo", help="Gravação .rble ou CSV exportado")
+    parser.add_argument("--gap", type=float, default=SESSION_GAP, help="Segundos sem leituras que encerram uma sessão")
+    parser.add_argument("--workers", type=int, default=None, help="Processos de trabalho (padrão: núcleos - 1)")
+    parser.add_argument("--resumo", default=None, metavar="CSV", help="Grava o resumo por dispositivo")
+    parser.add_argument("--sessoes", default=None, metavar="CSV", help="Grava a tabela de sessões")
+    parser.add_argument("--top", type=int, default=20, help="Dispositivos de maior permanência impressos")
+    args = parser.parse_args(argv)
+
+    analysis = PresenceAnalysis(args.arquivo, args.gap, args.workers)
+    report = analysis.run()
+    print(f"{len(report)} dispositivos, {len(report.enter)} sessões em {analysis.elapsed:.2f} s")
+    for row in report.device_rows(limit=args.top):
+        print(f"  {row[0]}  {row[1][:24]:<24} permanência {row[6]:>9.1f} s  sessões {row[5]:>4}  "
+              f"RSSI médio {row[7]:>6.1f}  mediana {row[12]:>4}")
+    if args.resumo: report.write_csv(args.resumo)
+    if args.sessoes: report.write_sessions_csv(args.sessoes)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
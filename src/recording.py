@@ -0,0 +1,347 @@
+"""
+Formato binário de gravação do Radar BLE (.rble), com acesso aleatório via mmap.
+
+Layout (little-endian):
+
+    Cabeçalho (64 bytes)
+        magic "RBLEREC1", versão u32, nº de dispositivos u32, nº de leituras u64,
+        offset do dicionário u64, offset do índice u64, passo do índice esparso u32
+    Dados
+        Para cada dispositivo, um bloco de registros de largura fixa em colunas:
+        timestamps float64 (n × 8 bytes) seguidos de RSSI int8 (n bytes),
+        alinhado a 8 bytes. Os registros de cada dispositivo estão em ordem de tempo.
+    Dicionário de dispositivos
+        Para cada dispositivo: MAC e nome (u16 tamanho + UTF-8).
+    Índice por dispositivo
+        offset dos dados u64, nº de registros u64, t_min f64, t_max f64,
+        offset do índice esparso u64, nº de entradas u32 (+4 de alinhamento).
+        O índice esparso guarda o timestamp de 1 a cada 'passo' registros, de
+        modo que uma consulta por intervalo de tempo toca só as páginas necessárias.
+
+Uso pela linha de comando:
+    python recording.py to-bin captura.csv captura.rble
+    python recording.py to-csv captura.rble captura.csv
+"""
+import csv
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+import numpy as np
+
+from csv_import import CsvImporter, ImportResult
+from telemetry_store import CSV_HEADER, TelemetryStore, format_timestamp
+
+MAGIC = b"RBLEREC1"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQQI")
+HEADER_SIZE = 64
+INDEX_ENTRY = struct.Struct("<QQddQI4x")
+SPARSE_STEP = 512
+
+
+def _align(offset, boundary=8):
+    return (offset + boundary - 1) // boundary * boundary
+
+
+def write_recording(filepath, store):
+    """Grava o conteúdo de um TelemetryStore no formato binário. Retorna o nº de leituras."""
+    groups = store.group_by_device()
+    device_ids = sorted(groups)
+    entries = []
+
+    with open(filepath, "wb") as f:
+        f.write(bytes(HEADER_SIZE))
+        offset = HEADER_SIZE
+
+        for device_id in device_ids:
+            ts, rs = groups[device_id]
+            if any(map(float.__gt__, ts, ts[1:])):
+                # Leituras fora de ordem (ex.: CSV editado à mão): ordena pelo tempo
+                order = sorted(range(len(ts)), key=ts.__getitem__)
+                ts = array("d", (ts[i] for i in order))
+                rs = array("b", (rs[i] for i in order))
+
+            f.write(ts.tobytes())
+            f.write(rs.tobytes())
+            size = len(ts) * 9
+            padding = _align(offset + size) - (offset + size)
+            f.write(bytes(padding))
+            entries.append([offset, len(ts), ts[0], ts[-1], ts[::SPARSE_STEP]])
+            offset += size + padding
+
+        # Índices esparsos
+        for entry in entries:
+            sparse = entry[4]
+            entry[4] = offset
+            entry.append(len(sparse))
+            f.write(sparse.tobytes())
+            offset += len(sparse) * 8
+
+        dict_offset = offset
+        for device_id in device_ids:
+            for text in (store.macs[device_id], store.names[device_id]):
+                raw = text.encode("utf-8")
+                f.write(struct.pack("<H", len(raw)))
+                f.write(raw)
+                offset += 2 + len(raw)
+
+        index_offset = _align(offset)
+        f.write(bytes(index_offset - offset))
+        for data_offset, count, t_min, t_max, sparse_offset, sparse_count in entries:
+            f.write(INDEX_ENTRY.pack(data_offset, count, t_min, t_max, sparse_offset, sparse_count))
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(device_ids), len(store), dict_offset, index_offset, SPARSE_STEP))
+    return len(store)
+
+
+class DeviceIndex:
+    """Entrada do índice de um dispositivo dentro da gravação."""
+    __slots__ = ("mac", "nome", "data_offset", "count", "t_min", "t_max", "sparse")
+
+    def __init__(self, mac, nome, data_offset, count, t_min, t_max, sparse):
+        self.mac = mac
+        self.nome = nome
+        self.data_offset = data_offset
+        self.count = count
+        self.t_min = t_min
+        self.t_max = t_max
+        self.sparse = sparse
+
+
+class Recording:
+    """
+    Leitor de gravações .rble. Abrir o arquivo lê apenas o cabeçalho, o
+    dicionário e o índice; os dados são mapeados em memória e as consultas
+    retornam memoryviews sobre o mmap, sem cópia.
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._file = open(filepath, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError("Arquivo de gravação vazio")
+        self._view = memoryview(self._mm)
+
+        magic, version, device_count, self.record_count, dict_offset, index_offset, self.sparse_step = \
+            HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("Arquivo não é uma gravação do Radar BLE")
+        if version != VERSION:
+            self.close()
+            raise ValueError(f"Versão de gravação não suportada: {version}")
+
+        names = []
+        pos = dict_offset
+        for _ in range(device_count * 2):
+            (size,) = struct.unpack_from("<H", self._mm, pos)
+            names.append(bytes(self._mm[pos + 2:pos + 2 + size]).decode("utf-8"))
+            pos += 2 + size
+
+        self.devices = []
+        self.by_mac = {}
+        for i in range(device_count):
+            data_offset, count, t_min, t_max, sparse_offset, sparse_count = \
+                INDEX_ENTRY.unpack_from(self._mm, index_offset + i * INDEX_ENTRY.size)
+            sparse = self._view[sparse_offset:sparse_offset + sparse_count * 8].cast("d")
+            entry = DeviceIndex(names[2 * i], names[2 * i + 1], data_offset, count, t_min, t_max, sparse)
+            self.devices.append(entry)
+            self.by_mac.setdefault(entry.mac, []).append(entry)
+
+    def __len__(self):
+        return self.record_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.devices = []
+        self.by_mac = {}
+        try:
+            if getattr(self, "_view", None) is not None: self._view.release()
+            if getattr(self, "_mm", None) is not None: self._mm.close()
+        except BufferError:
+            pass # Ainda há séries em uso; o mapeamento é liberado quando forem descartadas
+        self._view = None
+        self._mm = None
+        self._file.close()
+
+    @property
+    def t_min(self):
+        return min((d.t_min for d in self.devices), default=0.0)
+
+    @property
+    def t_max(self):
+        return max((d.t_max for d in self.devices), default=0.0)
+
+    def _columns(self, entry):
+        start = entry.data_offset
+        ts = self._view[start:start + entry.count * 8].cast("d")
+        rs = self._view[start + entry.count * 8:start + entry.count * 9].cast("b")
+        return ts, rs
+
+    def _locate(self, entry, ts, t):
+        """Primeira posição com timestamp >= t, usando o índice esparso e depois o bloco."""
+        block = bisect_left(entry.sparse, t) - 1
+        if block < 0: return 0
+        lo = block * self.sparse_step
+        hi = min(entry.count, lo + self.sparse_step)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ts[mid] < t: lo = mid + 1
+            else: hi = mid
+        return lo
+
+    def device_series(self, entry, t0=float("-inf"), t1=float("inf")):
+        """(timestamps, rssi) de um dispositivo no intervalo [t0, t1), como memoryviews."""
+        ts, rs = self._columns(entry)
+        if t0 > entry.t_max or t1 <= entry.t_min: return ts[0:0], rs[0:0]
+        start = 0 if t0 <= entry.t_min else self._locate(entry, ts, t0)
+        stop = entry.count if t1 > entry.t_max else self._locate(entry, ts, t1)
+        return ts[start:stop], rs[start:stop]
+
+    def series(self, mac, t0=float("-inf"), t1=float("inf")):
+        """
+        (timestamps, rssi) de um MAC no intervalo [t0, t1). Sem cópia quando o
+        MAC aparece com um único nome; caso contrário os blocos são mesclados.
+        """
+        entries = self.by_mac.get(mac, [])
+        if len(entries) == 1: return self.device_series(entries[0], t0, t1)
+
+        pairs = []
+        for entry in entries:
+            ts, rs = self.device_series(entry, t0, t1)
+            pairs.extend(zip(ts, rs))
+        pairs.sort(key=lambda p: p[0])
+        return array("d", (p[0] for p in pairs)), array("b", (p[1] for p in pairs))
+
+    def iter_rows(self):
+        """Itera as leituras como (timestamp, MAC, nome, RSSI), agrupadas por dispositivo."""
+        for entry in self.devices:
+            ts, rs = self._columns(entry)
+            mac, nome = entry.mac, entry.nome
+            for i in range(entry.count):
+                yield ts[i], mac, nome, rs[i]
+
+    def import_result(self):
+        """
+        Monta um ImportResult (como o da importação de CSV) sem percorrer as
+        leituras: as séries por MAC são memoryviews sobre o arquivo mapeado, e
+        o store é um RecordingStore, copiado para a memória só quando usado.
+        """
+        result = ImportResult()
+        result.store = RecordingStore(self.filepath, self.record_count)
+        for mac, entries in self.by_mac.items():
+            result.series[mac] = self.series(mac)
+            result.first_name[mac] = entries[0].nome
+            last = max(entries, key=lambda e: e.t_max)
+            _, rs = self._columns(last)
+            result.latest[mac] = {'mac': mac, 'nome': last.nome, 'rssi': rs[last.count - 1]}
+        return result
+
+    def to_store(self):
+        """
+        Copia a gravação para um TelemetryStore em ordem de tempo: os blocos
+        dos dispositivos são concatenados e intercalados por uma ordenação
+        estável, sem laço Python por leitura.
+        """
+        store = TelemetryStore()
+        if not self.record_count: return store
+        ts = np.empty(self.record_count, dtype=np.float64)
+        devs = np.empty(self.record_count, dtype=np.uint32)
+        rs = np.empty(self.record_count, dtype=np.int8)
+        pos = 0
+        for entry in self.devices:
+            t, r = self._columns(entry)
+            ts[pos:pos + entry.count] = np.frombuffer(t, dtype=np.float64)
+            rs[pos:pos + entry.count] = np.frombuffer(r, dtype=np.int8)
+            devs[pos:pos + entry.count] = store.intern(entry.mac, entry.nome)
+            pos += entry.count
+        order = np.argsort(ts, kind="stable")
+        store.extend(array("d", ts[order].tobytes()), array("I", devs[order].tobytes()),
+                     array("b", rs[order].tobytes()), is_sorted=True)
+        return store
+
+
+class RecordingStore:
+    """
+    Store de uma gravação importada, apoiado no arquivo .rble em vez de uma
+    cópia das leituras. Tamanho, cópia e limpeza não tocam nas leituras; o
+    restante da interface do TelemetryStore (colunas, séries, append de uma
+    captura que continua) copia a gravação para a memória, em ordem de tempo,
+    na primeira vez em que é usado. A cópia lê o arquivo por um mapeamento
+    próprio, de modo que pode rodar na thread da exportação mesmo depois que
+    a interface fechar a gravação.
+    """
+    def __init__(self, filepath, record_count):
+        self.filepath = filepath
+        self.record_count = record_count
+        self._store = None
+
+    def __len__(self):
+        return self.record_count if self._store is None else len(self._store)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def materialize(self):
+        """TelemetryStore com as leituras da gravação (criado no primeiro uso)."""
+        if self._store is None:
+            with Recording(self.filepath) as rec: self._store = rec.to_store()
+        return self._store
+
+    def __getattr__(self, name):
+        # Só chamado para atributos que o RecordingStore não define
+        if name.startswith("__"): raise AttributeError(name)
+        return getattr(self.materialize(), name)
+
+    def memory_bytes(self):
+        return 0 if self._store is None else self._store.memory_bytes()
+
+    def copy(self):
+        if self._store is None: return RecordingStore(self.filepath, self.record_count)
+        return self._store.copy()
+
+    def clear(self):
+        self._store = TelemetryStore()
+
+
+def csv_to_recording(csv_path, recording_path):
+    """Converte um CSV (Timestamp, MAC, Nome, RSSI) para o formato binário."""
+    result = CsvImporter(csv_path).run()
+    return write_recording(recording_path, result.store)
+
+
+def recording_to_csv(recording_path, csv_path):
+    """Converte uma gravação binária para o layout CSV da exportação, em ordem de tempo."""
+    with Recording(recording_path) as rec:
+        store = rec.to_store()
+    macs, names = store.macs, store.names
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter=",")
+        writer.writerow(CSV_HEADER)
+        writer.writerows((format_timestamp(ts), mac, nome, rssi) for ts, mac, nome, rssi in store.iter_rows())
+    return len(store)
+
+
+def main(argv):
+    if len(argv) != 4 or argv[1] not in ("to-bin", "to-csv"):
+        print("Uso: python recording.py to-bin|to-csv <entrada> <saída>")
+        return 2
+    convert = csv_to_recording if argv[1] == "to-bin" else recording_to_csv
+    total = convert(argv[2], argv[3])
+    print(f"{total} leituras convertidas.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,290 @@
+"""
+Reprodução de gravações pelo pipeline ao vivo do scanner.
+
+O ReplaySource é uma fonte de anúncios com a mesma interface do BleakScanner
+(detection_callback, start() e stop() assíncronos): entrega cada leitura de
+uma gravação (.rble ou CSV) ao BeaconScanner._callback, passando pelo
+IngestGate, histórico, filtros, stream e índice como um anúncio do rádio.
+
+As leituras saem com o intervalo original entre elas, dividido por 'speed'
+(1×, 10×, ...), ou o mais rápido possível com speed=math.inf. A fonte tem o
+próprio relógio (clock()), que o scanner usa no lugar de time.time(): os
+anúncios recebem o instante original da gravação e a atividade, o
+esquecimento e as amostras seguem o tempo da reprodução, em qualquer
+velocidade. Em velocidade máxima o laço asyncio é devolvido a cada
+REPLAY_BATCH leituras, para que as publicações continuem acontecendo.
+
+pause(), resume(), seek(instante) e set_speed(velocidade) podem ser
+chamados de qualquer thread. Voltar no tempo deixa no scanner leituras
+posteriores ao novo instante; para recomeçar do zero chame scanner.clear()
+antes de seek() (as duas operações são aplicadas em ordem no laço).
+
+Uso pela linha de comando (mede a vazão do pipeline inteiro):
+    python replay.py captura.rble --speed max
+    python replay.py captura.csv --speed 10 --max-rate 20
+"""
+import argparse
+import asyncio
+import math
+import sys
+import time
+from functools import partial
+
+import numpy as np
+
+from synthetic_source import SyntheticAdvertisementData, SyntheticDevice
+
+REPLAY_BATCH = 5000 # Leituras entregues antes de devolver o laço asyncio
+REPLAY_TICK = 0.01 # Segundos entre as verificações do relógio da reprodução
+SPEEDS = {"1×": 1.0, "10×": 10.0, "100×": 100.0, "Máx": math.inf}
+
+
+def parse_speed(text):
+    """Velocidade da linha de comando: fator (1, 10, 2.5) ou "max"."""
+    if text.strip().lower() in ("max", "máx"): return math.inf
+    speed = float(text.rstrip("x×"))
+    if speed <= 0: raise ValueError("A velocidade deve ser positiva")
+    return speed
+
+
+def format_speed(speed):
+    return "máx" if math.isinf(speed) else f"{speed:g}×"
+
+
+def format_duration(seconds):
+    """Duração como H:MM:SS (as horas passam de 24 em gravações longas)."""
+    minutes, secs = divmod(int(max(seconds, 0)), 60)
+    return f"{minutes // 60}:{minutes % 60:02d}:{secs:02d}"
+
+
+class ReplayTape:
+    """Leituras de uma gravação em ordem de tempo, em colunas NumPy."""
+    __slots__ = ("timestamps", "devices", "rssi", "macs", "names")
+
+    def __init__(self, timestamps, devices, rssi, macs, names):
+        self.timestamps = timestamps
+        self.devices = devices
+        self.rssi = rssi
+        self.macs = macs
+        self.names = names
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @classmethod
+    def from_store(cls, store):
+        """Monta a fita a partir de um TelemetryStore (ordem estável para leituras do mesmo instante)."""
+        ts, devs, rs = store.slice_by_time()
+        timestamps = np.frombuffer(ts, dtype=np.float64)
+        order = np.argsort(timestamps, kind="stable")
+        return cls(timestamps[order], np.frombuffer(devs, dtype=np.uint32)[order],
+                   np.frombuffer(rs, dtype=np.int8)[order], list(store.macs), list(store.names))
+
+    @classmethod
+    def load(cls, filepath):
+        """Lê uma gravação .rble ou um CSV exportado."""
+        if filepath.lower().endswith(".rble"):
+            from recording import Recording
+            with Recording(filepath) as rec: store = rec.to_store()
+        else:
+            from csv_import import CsvImporter
+            store = CsvImporter(filepath).run().store
+        return cls.from_store(store)
+
+    @property
+    def start(self):
+        return float(self.timestamps[0]) if len(self) else 0.0
+
+    @property
+    def end(self):
+        return float(self.timestamps[-1]) if len(self) else 0.0
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class ReplaySource:
+    """
+    Fonte de anúncios que reproduz uma ReplayTape (ver o início do módulo).
+
+    Estado: now (relógio da reprodução), delivered (leituras entregues),
+    elapsed (segundos de relógio real reproduzindo, sem as pausas), paused e
+    finished. As gravações não guardam payload: os anúncios saem sem
+    manufacturer/service data, como os do StreamSource.
+    """
+    def __init__(self, detection_callback=None, tape=None, speed=1.0, start=None):
+        self.detection_callback = detection_callback
+        self.tape = tape
+        self.speed = speed
+        self.now = tape.start if start is None else start
+        self.cursor = int(np.searchsorted(tape.timestamps, self.now, side="left"))
+        self.delivered = 0
+        self.elapsed = 0.0
+        self.paused = False
+        self._objects = [SyntheticDevice(mac, nome) for mac, nome in zip(tape.macs, tape.names)]
+        self._anchor = (self.now, time.perf_counter()) # (instante da fita, relógio real) do último ajuste
+        self._running = False
+        self._loop = None
+        self._task = None
+
+    @property
+    def finished(self):
+        return self.cursor >= len(self.tape)
+
+    @property
+    def progress(self):
+        duration = self.tape.duration
+        return 1.0 if duration <= 0 else min(1.0, max(0.0, (self.now - self.tape.start) / duration))
+
+    @property
+    def adverts_per_second(self):
+        return self.delivered / self.elapsed if self.elapsed else 0.0
+
+    def clock(self):
+        """Instante atual da reprodução (usado pelo BeaconScanner no lugar de time.time)."""
+        return self.now
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._running = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self._running = False
+        if self._task is not None:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+
+    def _call(self, func, *args):
+        """Aplica a operação no laço da reprodução (ou direto, se ela ainda não começou)."""
+        loop = self._loop
+        if loop is not None and loop.is_running(): loop.call_soon_threadsafe(func, *args)
+        else: func(*args)
+
+    def pause(self):
+        self._call(self._set_paused, True)
+
+    def resume(self):
+        self._call(self._set_paused, False)
+
+    def seek(self, instant):
+        """Continua a reprodução a partir de 'instant' (limitado ao intervalo da gravação)."""
+        self._call(self._seek, instant)
+
+    def set_speed(self, speed):
+        self._call(self._set_speed, speed)
+
+    def _set_paused(self, paused):
+        self.paused = paused
+        self._anchor = (self.now, time.perf_counter())
+
+    def _seek(self, instant):
+        tape = self.tape
+        self.now = min(max(instant, tape.start), tape.end)
+        self.cursor = int(np.searchsorted(tape.timestamps, self.now, side="left"))
+        self._anchor = (self.now, time.perf_counter())
+        # A fita tinha acabado: volta a reproduzir se a fonte continua ligada
+        if self._running and (self._task is None or self._task.done()):
+            self._task = asyncio.ensure_future(self._run())
+
+    def _set_speed(self, speed):
+        self.speed = speed
+        self._anchor = (self.now, time.perf_counter())
+
+    def _deliver(self, stop):
+        """Entrega as leituras de cursor até stop; o relógio acompanha cada uma."""
+        tape, objects, callback = self.tape, self._objects, self.detection_callback
+        empty = {}
+        start = self.cursor
+        for t, dev, rssi in zip(tape.timestamps[start:stop].tolist(), tape.devices[start:stop].tolist(),
+                                tape.rssi[start:stop].tolist()):
+            self.now = t
+            device = objects[dev]
+            callback(device, SyntheticAdvertisementData(device.name, rssi, empty, empty))
+        self.cursor = stop
+        self.delivered += stop - start
+
+    async def _run(self):
+        timestamps = self.tape.timestamps
+        total = len(timestamps)
+        self._anchor = (self.now, time.perf_counter())
+        last = time.perf_counter()
+        while self.cursor < total:
+            if self.paused:
+                await asyncio.sleep(REPLAY_TICK)
+                last = time.perf_counter()
+                continue
+
+            limit = min(total, self.cursor + REPLAY_BATCH)
+            if math.isinf(self.speed):
+                target = None
+                stop = limit
+            else:
+                base, wall = self._anchor
+                target = base + (time.perf_counter() - wall) * self.speed
+                stop = min(limit, int(np.searchsorted(timestamps, target, side="right")))
+            self._deliver(stop)
+
+            now = time.perf_counter()
+            self.elapsed += now - last
+            last = now
+            if target is None or stop == limit:
+                await asyncio.sleep(0) # Atrasado (ou sem limite de velocidade): só devolve o laço
+            elif stop < total:
+                # Em dia: o relógio avança até o instante de referência e a fonte dorme até a próxima leitura
+                self.now = max(self.now, target)
+                await asyncio.sleep(min(REPLAY_TICK, (timestamps[stop] - target) / self.speed))
+
+
+async def _replay(scanner, interval, out):
+    source = scanner.scanner
+    tape = source.tape
+    await scanner.start()
+    try:
+        while not source.finished:
+            await asyncio.sleep(interval)
+            print(f"  {source.progress * 100:5.1f}%  {source.delivered:>12,} leituras  "
+                  f"{source.adverts_per_second:>12,.0f} leituras/s  {len(scanner.beacons):>6} dispositivos", file=out, flush=True)
+    finally:
+        await scanner.stop()
+    speedup = tape.duration / source.elapsed if source.elapsed else math.inf
+    print(f"{source.delivered:,} leituras ({tape.duration / 3600:.2f} h de gravação) em {source.elapsed:.2f} s: "
+          f"{source.adverts_per_second:,.0f} leituras/s, {speedup:,.0f}× o tempo real", file=out)
+    ingest = scanner.ingest
+    print(f"{len(scanner.beacons)} dispositivos no scanner, {scanner.evicted} esquecidos" +
+          (f", {ingest.folded} dobrados e {ingest.duplicates} cópias na entrada" if ingest is not None else ""), file=out)
+
+
+def main(argv=None):
+    from beacon_scanner import BeaconScanner
+    from ingest_gate import IngestGate
+
+    parser = argparse.ArgumentParser(description="Reproduz uma gravação pelo pipeline do scanner e mede a vazão")
+    parser.add_argument("arquivo", help="Gravação .rble ou CSV exportado")
+    parser.add_argument("--speed", type=parse_speed, default=math.inf, help="Fator de velocidade (1, 10, ...) ou max (padrão)")
+    parser.add_argument("--max-rate", type=float, default=0, metavar="HZ", help="Liga o IngestGate (anúncios/s por MAC)")
+    parser.add_argument("--ttl", type=float, default=900, help="Esquece dispositivos calados há N segundos (0 desativa)")
+    parser.add_argument("--max-devices", type=int, default=5000, help="Máximo de dispositivos em memória (0 = sem limite)")
+    parser.add_argument("--interval", type=float, default=1.0, help="Segundos entre as linhas de progresso")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    tape = ReplayTape.load(args.arquivo)
+    print(f"{len(tape):,} leituras de {len(tape.macs)} dispositivos carregadas em {time.perf_counter() - started:.2f} s; "
+          f"reproduzindo em velocidade {format_speed(args.speed)}", flush=True)
+    scanner = BeaconScanner(source_factory=partial(ReplaySource, tape=tape, speed=args.speed),
+                            idle_ttl=args.ttl or None, max_devices=args.max_devices or None,
+                            ingest=IngestGate(args.max_rate) if args.max_rate else None)
+    try:
+        asyncio.run(_replay(scanner, args.interval, sys.stdout))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+import math
+from array import array
+from collections import OrderedDict
+
+# Bytes por amostra: timestamp float64 + RSSI int8
+BYTES_PER_SAMPLE = 9
+
+
+class RssiRingBuffer:
+    """
+    Buffer circular compacto de (timestamp, RSSI) de um único dispositivo.
+    Os dados ficam em dois arrays pré-alocados (float64 e int8), sem criar
+    objetos Python por amostra.
+
+    initial (opcional) começa com menos posições alocadas e dobra a
+    alocação conforme o buffer enche, até 'capacity': buffers de capacidade
+    grande (um dia de amostras) só ocupam a memória do que já receberam.
+    """
+    __slots__ = ("capacity", "size", "timestamps", "rssi", "head", "count")
+
+    def __init__(self, capacity, initial=None):
+        if capacity < 1:
+            raise ValueError("A capacidade do buffer deve ser positiva")
+        self.capacity = capacity
+        self.size = capacity if initial is None else max(1, min(initial, capacity)) # Posições alocadas
+        self.timestamps = array("d", bytes(8 * self.size))
+        self.rssi = array("b", bytes(self.size))
+        self.head = 0   # Próxima posição de escrita
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, rssi):
+        if self.count == self.size < self.capacity: self._grow()
+        head = self.head
+        self.timestamps[head] = timestamp
+        self.rssi[head] = -128 if rssi < -128 else (127 if rssi > 127 else rssi)
+        head += 1
+        self.head = 0 if head == self.size else head
+        if self.count < self.size: self.count += 1
+
+    def _grow(self):
+        """Dobra a alocação (até capacity), com as amostras em ordem a partir da posição 0."""
+        size = min(2 * self.size, self.capacity)
+        ts, rs = self._slice(0, self.count)
+        free = size - self.count
+        ts.extend(array("d", bytes(8 * free)))
+        rs.extend(array("b", bytes(free)))
+        self.timestamps, self.rssi = ts, rs
+        self.size = size
+        self.head = self.count
+
+    def _physical(self, i):
+        """Converte a posição lógica i (0 = mais antiga) na posição física do array."""
+        return (self.head - self.count + i) % self.size
+
+    def last(self):
+        """Retorna a amostra mais recente (timestamp, rssi) ou None se vazio."""
+        if not self.count: return None
+        p = self.head - 1
+        return self.timestamps[p], self.rssi[p]
+
+    def _bisect(self, t):
+        """Primeira posição lógica com timestamp >= t (timestamps crescentes)."""
+        lo, hi = 0, self.count
+        ts = self.timestamps
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ts[self._physical(mid)] < t: lo = mid + 1
+            else: hi = mid
+        return lo
+
+    def _slice(self, start, stop):
+        """Retorna cópias (array) das posições lógicas [start, stop)."""
+        if start >= stop: return array("d"), array("b")
+        p0 = self._physical(start)
+        n = stop - start
+        if p0 + n <= self.size:
+            return self.timestamps[p0:p0 + n], self.rssi[p0:p0 + n]
+        split = self.size - p0
+        ts = self.timestamps[p0:] + self.timestamps[:n - split]
+        rs = self.rssi[p0:] + self.rssi[:n - split]
+        return ts, rs
+
+    def since(self, t):
+        """Retorna (timestamps, rssi) de todas as amostras com timestamp >= t."""
+        return self._slice(self._bisect(t), self.count)
+
+    def between(self, t0, t1):
+        """Retorna (timestamps, rssi) das amostras com t0 <= timestamp < t1."""
+        return self._slice(self._bisect(t0), self._bisect(t1))
+
+    def shrink(self, capacity):
+        """Reduz a capacidade mantendo as amostras mais recentes; retorna quantas foram descartadas."""
+        if capacity >= self.capacity: return 0
+        ts, rs = self._slice(max(0, self.count - capacity), self.count)
+        dropped = self.count - len(ts)
+        free = capacity - len(ts)
+        ts.extend(array("d", bytes(8 * free)))
+        rs.extend(array("b", bytes(free)))
+        self.timestamps, self.rssi = ts, rs
+        self.capacity = self.size = capacity
+        self.count = capacity - free
+        self.head = self.count % capacity
+        return dropped
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+
+class TieredRssiBuffer:
+    """
+    Histórico de RSSI de um dispositivo em dois níveis, para janelas longas
+    sem guardar todas as amostras: as 'capacity' mais recentes em resolução
+    completa (raw) e, além delas, a média (instante e RSSI) de cada balde de
+    'bucket' segundos (coarse, até coarse_capacity baldes). since()/between() devolvem os
+    baldes só para o trecho que o nível completo já descartou.
+    """
+    __slots__ = ("raw", "coarse", "bucket", "_slot", "_tsum", "_sum", "_count")
+
+    def __init__(self, capacity, coarse_capacity, bucket, initial=None):
+        self.raw = RssiRingBuffer(capacity, initial)
+        self.coarse = RssiRingBuffer(coarse_capacity, None if initial is None else min(initial, coarse_capacity))
+        self.bucket = bucket
+        self._slot = None   # Balde aberto (índice) e suas somas/contagem
+        self._tsum = 0.0
+        self._sum = 0
+        self._count = 0
+
+    def __len__(self):
+        return len(self.raw) + len(self.coarse)
+
+    @property
+    def size(self):
+        """Posições alocadas nos dois níveis."""
+        return self.raw.size + self.coarse.size
+
+    def append(self, timestamp, rssi):
+        self.raw.append(timestamp, rssi)
+        slot = int(timestamp // self.bucket)
+        if slot != self._slot:
+            if self._count: self.coarse.append(self._tsum / self._count, round(self._sum / self._count))
+            self._slot, self._tsum, self._sum, self._count = slot, 0.0, 0, 0
+        self._tsum += timestamp
+        self._sum += rssi
+        self._count += 1
+
+    def last(self):
+        return self.raw.last()
+
+    def between(self, t0, t1):
+        raw = self.raw
+        if len(raw) < raw.capacity: return raw.between(t0, t1) # Nada descartado ainda
+        boundary = raw.timestamps[raw._physical(0)]
+        if t0 >= boundary: return raw.between(t0, t1)
+        ts, rs = self.coarse.between(t0, min(t1, boundary))
+        if t1 > boundary:
+            raw_ts, raw_rs = raw.between(boundary, t1)
+            ts += raw_ts
+            rs += raw_rs
+        return ts, rs
+
+    def since(self, t):
+        return self.between(t, math.inf)
+
+    def clear(self):
+        self.raw.clear()
+        self.coarse.clear()
+        self._slot, self._tsum, self._sum, self._count = None, 0.0, 0, 0
+
+
+class AdvertHistory:
+    """
+    Conjunto de buffers circulares por MAC com orçamento de memória limitado.
+
+    Cada dispositivo guarda até 'capacity' amostras e o histórico comporta
+    max_bytes // (capacity × 9) dispositivos. Os buffers ficam num OrderedDict
+    na ordem da última amostra, então o descarte do dispositivo visto há mais
+    tempo é O(1).
+
+    max_devices: dispositivos que o dono do histórico mantém (ex.: o
+    max_devices do scanner). A capacidade por dispositivo é reduzida para que
+    todos caibam no orçamento; assim o histórico nunca descarta um
+    dispositivo que o scanner ainda acompanha.
+
+    Sem max_devices, quando um novo dispositivo não cabe no orçamento a
+    capacidade de todos os buffers é reduzida à metade (mantendo as amostras
+    mais recentes), até min_capacity; só abaixo disso o dispositivo visto há
+    mais tempo é descartado. Com os valores padrão (32 MiB, mínimo de 16
+    amostras) são cerca de 233 mil dispositivos antes do primeiro descarte.
+    clear() restaura a capacidade inicial. 'evicted' conta os dispositivos
+    descartados, 'shrinks' as reduções e 'dropped' as amostras perdidas.
+    """
+    def __init__(self, capacity=1024, max_bytes=32 * 1024 * 1024, max_devices=None, min_capacity=16):
+        if max_devices is not None:
+            capacity = min(capacity, max_bytes // (max_devices * BYTES_PER_SAMPLE))
+            if capacity < 1:
+                raise ValueError("O orçamento do histórico não comporta uma amostra por dispositivo")
+            min_capacity = capacity # O limite de dispositivos já é garantido pelo dono
+        self.initial_capacity = capacity
+        self.min_capacity = max(1, min(min_capacity, capacity))
+        self.max_bytes = max_bytes
+        self.buffers = OrderedDict()
+        self.evicted = 0
+        self.shrinks = 0
+        self.dropped = 0    # Amostras perdidas junto com os buffers descartados ou reduzidos
+        self._set_capacity(capacity)
+
+    def _set_capacity(self, capacity):
+        self.capacity = capacity
+        self.max_devices = max(1, self.max_bytes // (capacity * BYTES_PER_SAMPLE))
+
+    def __len__(self):
+        return len(self.buffers)
+
+    def __contains__(self, mac):
+        return mac in self.buffers
+
+    def append(self, mac, timestamp, rssi):
+        buffers = self.buffers
+        buf = buffers.get(mac)
+        if buf is None:
+            if len(buffers) >= self.max_devices:
+                if self.capacity > self.min_capacity: self._shrink()
+                else: self._evict_oldest()
+            buf = buffers[mac] = RssiRingBuffer(self.capacity)
+        else:
+            buffers.move_to_end(mac)
+        buf.append(timestamp, rssi)
+
+    def _shrink(self):
+        """Reduz à metade a capacidade de todos os buffers, dobrando o nº de dispositivos que cabem."""
+        capacity = max(self.min_capacity, self.capacity // 2)
+        for buf in self.buffers.values(): self.dropped += buf.shrink(capacity)
+        self._set_capacity(capacity)
+        self.shrinks += 1
+
+    def _evict_oldest(self):
+        _, buf = self.buffers.popitem(last=False)
+        self.dropped += len(buf)
+        self.evicted += 1
+
+    def get(self, mac):
+        return self.buffers.get(mac)
+
+    def pop(self, mac):
+        """Remove e retorna o buffer do MAC (ou None), para quem esquece o dispositivo."""
+        return self.buffers.pop(mac, None)
+
+    def since(self, mac, t=0.0):
+        """Retorna (timestamps, rssi) das amostras do MAC desde o instante t."""
+        buf = self.buffers.get(mac)
+        if buf is None: return array("d"), array("b")
+        return buf.since(t)
+
+    def since_all(self, t=0.0):
+        """Retorna {mac: (timestamps, rssi)} com as amostras de todos os dispositivos desde t."""
+        result = {}
+        for mac, buf in list(self.buffers.items()):
+            ts, rs = buf.since(t)
+            if ts: result[mac] = (ts, rs)
+        return result
+
+    def memory_bytes(self):
+        return len(self.buffers) * self.capacity * BYTES_PER_SAMPLE
+
+    def clear(self):
+        self.buffers.clear()
+        self._set_capacity(self.initial_capacity)
@@ -0,0 +1,263 @@
+from array import array
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+METHODS = ("ema", "median", "kalman")
+
+# Número máximo de entradas da tabela de ganhos do Kalman (o ganho converge bem antes)
+GAIN_TABLE_SIZE = 256
+
+
+def _linear_scan(a, b):
+    """
+    Resolve a recorrência y[i] = a[i] * y[i-1] + b[i] (com y[-1] = 0) para o
+    array inteiro, por varredura paralela de Hillis-Steele: log2(n) passos
+    vetorizados em vez de um laço Python por amostra. a[i] = 0 reinicia a
+    recorrência, o que separa os dispositivos de um mesmo lote.
+    """
+    a = a.copy()
+    y = b.copy()
+    n = len(y)
+    shift = 1
+    while shift < n:
+        y[shift:] += a[shift:] * y[:-shift]
+        a[shift:] *= a[:-shift]
+        shift *= 2
+    return y
+
+
+def _segment_info(groups):
+    """
+    Para ids de grupo em ordem de chegada, retorna a ordem estável que agrupa
+    as amostras, o posto de cada amostra dentro do grupo (já ordenada) e os
+    índices onde cada grupo começa.
+    """
+    order = np.argsort(groups, kind="stable")
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    sizes = np.diff(np.r_[starts, len(order)])
+    rank = np.arange(len(order)) - np.repeat(starts, sizes)
+    return order, sorted_groups, starts, sizes, rank
+
+
+class RssiFilterBank:
+    """
+    Suavização do RSSI de todos os dispositivos com o estado em arrays contíguos.
+
+    Cada MAC recebe um slot; o estado do filtro (valor, nº de amostras e, na
+    mediana, a janela recente) fica em arrays NumPy indexados pelo slot. O
+    callback só enfileira (slot, RSSI) com push(); process() aplica o lote
+    inteiro de uma vez, respeitando a ordem das amostras de cada dispositivo.
+
+    Métodos:
+        ema     média móvel exponencial com fator alpha
+        median  mediana das últimas 'window' amostras
+        kalman  filtro de Kalman 1-D (modelo de nível constante) com ruído de
+                processo process_noise e de medição measurement_noise (dBm²)
+
+    EMA e Kalman são a mesma atualização v += k * (z - v); só muda o ganho k,
+    que depende apenas do nº de amostras já vistas e vem de uma tabela.
+    """
+    def __init__(self, method="ema", alpha=0.3, window=5, process_noise=0.05, measurement_noise=4.0,
+                 capacity=1024):
+        self.slots = {}     # MAC -> slot
+        self.macs = []      # slot -> MAC (None nos slots liberados)
+        self._free = []     # Slots liberados por release(), reaproveitados por slot()
+        self._capacity = capacity
+        self.configure(method, alpha, window, process_noise, measurement_noise)
+
+    def configure(self, method=None, alpha=None, window=None, process_noise=None, measurement_noise=None):
+        """Altera os parâmetros do filtro. O estado é reiniciado, mas os slots são mantidos."""
+        method = method or getattr(self, "method", "ema")
+        if method not in METHODS:
+            raise ValueError(f"Filtro desconhecido: {method} (use {', '.join(METHODS)})")
+        self.method = method
+        if alpha is not None: self.alpha = alpha
+        if window is not None: self.window = window
+        if process_noise is not None: self.process_noise = process_noise
+        if measurement_noise is not None: self.measurement_noise = measurement_noise
+        if not 0 < self.alpha <= 1: raise ValueError("alpha deve estar em (0, 1]")
+        if self.window < 1: raise ValueError("A janela da mediana deve ter ao menos 1 amostra")
+
+        self.gains = self._gain_table()
+        capacity = max(self._capacity, len(self.macs))
+        self.values = np.full(capacity, np.nan)
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.tails = np.full((capacity, self.window - 1), np.nan)
+        self._pending_slots = array("I")
+        self._pending_rssi = array("b")
+
+    def _gain_table(self):
+        if self.method == "ema":
+            return np.array([1.0, self.alpha])
+        if self.method == "kalman":
+            # A primeira medição inicializa o estado (ganho 1, variância r)
+            q, r = self.process_noise, self.measurement_noise
+            gains = [1.0]
+            p = r
+            for _ in range(GAIN_TABLE_SIZE - 1):
+                p += q
+                k = p / (p + r)
+                p *= 1 - k
+                if abs(k - gains[-1]) < 1e-9: break
+                gains.append(k)
+            return np.array(gains)
+        return None
+
+    def __len__(self):
+        return len(self.slots)
+
+    def slot(self, mac):
+        """Retorna o slot do MAC, criando-o (e aumentando os arrays) se necessário."""
+        slot = self.slots.get(mac)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+                self.macs[slot] = mac
+            else:
+                slot = len(self.macs)
+                self.macs.append(mac)
+                if slot >= len(self.values): self._grow()
+            self.slots[mac] = slot
+        return slot
+
+    def release(self, mac):
+        """
+        Libera o slot de um dispositivo esquecido para ser reaproveitado. Deve
+        ser chamado sem leituras pendentes do MAC (logo após process()).
+        """
+        slot = self.slots.pop(mac, None)
+        if slot is None: return
+        self.macs[slot] = None
+        self.values[slot] = np.nan
+        self.counts[slot] = 0
+        self.tails[slot] = np.nan
+        self._free.append(slot)
+
+    def _grow(self):
+        capacity = len(self.values) * 2
+        self.values = np.concatenate([self.values, np.full(capacity - len(self.values), np.nan)])
+        self.counts = np.concatenate([self.counts, np.zeros(capacity - len(self.counts), dtype=np.int64)])
+        self.tails = np.concatenate([self.tails, np.full((capacity - len(self.tails), self.window - 1), np.nan)])
+
+    def push(self, mac, rssi):
+        """Enfileira uma leitura; barato o bastante para o callback de anúncios."""
+        slot = self.slots.get(mac)
+        if slot is None: slot = self.slot(mac)
+        self._pending_slots.append(slot)
+        self._pending_rssi.append(-128 if rssi < -128 else (127 if rssi > 127 else rssi))
+
+    def pending(self):
+        return len(self._pending_slots)
+
+    def process(self):
+        """Aplica as leituras pendentes ao estado. Retorna os slots atualizados (array NumPy)."""
+        if not self._pending_slots: return np.empty(0, dtype=np.int64)
+        slots = np.frombuffer(self._pending_slots, dtype=np.uint32).astype(np.int64)
+        rssi = np.frombuffer(self._pending_rssi, dtype=np.int8).astype(np.float64)
+        self._pending_slots = array("I")
+        self._pending_rssi = array("b")
+
+        order, sorted_slots, starts, sizes, rank = _segment_info(slots)
+        x = rssi[order]
+        updated = sorted_slots[starts]
+        ends = starts + sizes - 1
+
+        if self.method == "median":
+            filtered, tails = self._median(x, starts, sizes, self.tails[updated])
+            self.tails[updated] = tails
+        else:
+            counts = np.repeat(self.counts[updated], sizes) + rank
+            filtered = self._smooth(x, counts, starts, self.values[updated])
+        self.values[updated] = filtered[ends]
+        self.counts[updated] += sizes
+        return updated
+
+    def _smooth(self, x, counts, starts, previous):
+        """EMA/Kalman sobre amostras agrupadas por dispositivo, continuando do estado anterior."""
+        k = self.gains[np.minimum(counts, len(self.gains) - 1)]
+        a = 1.0 - k
+        b = k * x
+        # A primeira amostra de cada grupo parte do valor anterior do dispositivo
+        carry = np.nan_to_num(previous)
+        b[starts] += a[starts] * carry
+        a[starts] = 0.0
+        return _linear_scan(a, b)
+
+    def _median(self, x, starts, sizes, tails):
+        """
+        Mediana móvel sobre amostras agrupadas por dispositivo. Cada grupo é
+        precedido pela sua janela anterior (window - 1 valores) num único array,
+        de modo que uma só sliding_window_view cobre todos os dispositivos.
+        """
+        w = self.window
+        if w == 1: return x.copy(), tails
+        groups = len(starts)
+        ext = np.empty(len(x) + groups * (w - 1))
+        group_of = np.repeat(np.arange(groups), sizes)
+        positions = np.arange(len(x)) + (group_of + 1) * (w - 1)
+        ext[positions] = x
+        tail_pos = (starts + np.arange(groups) * (w - 1))[:, None] + np.arange(w - 1)
+        ext[tail_pos] = tails
+
+        windows = sliding_window_view(ext, w)[positions - (w - 1)]
+        filtered = np.nanmedian(windows, axis=1)
+        last = positions[starts + sizes - 1]
+        new_tails = ext[(last - (w - 2))[:, None] + np.arange(w - 1)]
+        return filtered, new_tails
+
+    def value(self, mac):
+        """Valor filtrado atual do MAC, ou None se ainda não houver leituras."""
+        slot = self.slots.get(mac)
+        if slot is None or not self.counts[slot]: return None
+        return float(self.values[slot])
+
+    def filter_series(self, rssi, groups=None):
+        """
+        Filtra uma série completa sem tocar no estado do banco (importações,
+        gráfico e exportação). 'groups' (opcional) identifica o dispositivo de
+        cada leitura; as leituras de cada grupo são filtradas em ordem e o
+        resultado volta alinhado com a entrada.
+        """
+        x = np.asarray(rssi, dtype=np.float64)
+        n = len(x)
+        if not n: return x.copy()
+        if groups is None:
+            order, starts, sizes, rank = None, np.array([0]), np.array([n]), np.arange(n)
+        else:
+            order, _, starts, sizes, rank = _segment_info(np.asarray(groups))
+            x = x[order]
+
+        if self.method == "median":
+            filtered, _ = self._median(x, starts, sizes, np.full((len(starts), self.window - 1), np.nan))
+        else:
+            filtered = self._smooth(x, rank, starts, np.zeros(len(starts)))
+
+        if order is None: return filtered
+        result = np.empty(n)
+        result[order] = filtered
+        return result
+
+    def filter_store(self, store):
+        """Coluna de RSSI filtrado (por MAC) alinhada com store.slice_by_time()."""
+        _, devs, rs = store.slice_by_time()
+        mac_index = {}
+        device_to_mac = np.array([mac_index.setdefault(mac, len(mac_index)) for mac in store.macs], dtype=np.int64)
+        groups = device_to_mac[np.frombuffer(devs, dtype=np.uint32)] if len(devs) else np.empty(0, dtype=np.int64)
+        return self.filter_series(np.frombuffer(rs, dtype=np.int8), groups)
+
+    def snapshot(self):
+        """
+        Banco novo (sem dispositivos nem estado) com o método e os parâmetros
+        atuais, para filtrar séries em outra thread enquanto este continua
+        sendo reconfigurado.
+        """
+        return RssiFilterBank(self.method, self.alpha, self.window, self.process_noise, self.measurement_noise,
+                              capacity=1)
+
+    def clear(self):
+        self.slots.clear()
+        self.macs.clear()
+        self._free.clear()
+        self.configure()
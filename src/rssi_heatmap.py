@@ -0,0 +1,162 @@
+import math
+
+import numpy as np
+
+HEATMAP_COLUMNS = 120 # Baldes de tempo da matriz (colunas da imagem)
+LABEL_LIMIT = 40 # Acima disto as linhas do mapa de calor ficam sem rótulo
+
+
+class HeatmapMatrix:
+    """
+    Matriz dispositivo × tempo com o RSSI médio de cada balde de 'bucket'
+    segundos (NaN onde não há leituras). A coluna 0 começa em self.origin e a
+    última contém o instante de referência.
+
+    O agrupamento é vetorizado: as séries são concatenadas e cada leitura vira
+    um índice plano linha × coluna, somado por np.bincount. Entre quadros só
+    as colunas mais novas mudam: advance() desloca a matriz quando o tempo
+    entra num balde novo e update_tail() recalcula apenas as colunas a partir
+    do balde que era o mais novo.
+    """
+    def __init__(self, columns=HEATMAP_COLUMNS):
+        self.columns = columns
+        self.keys = ()
+        self.bucket = None
+        self.origin = 0.0
+        self.values = np.full((0, columns), np.nan)
+        self.rebuilds = 0
+        self.tail_updates = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def newest_start(self):
+        return self.origin + (self.columns - 1) * self.bucket
+
+    @property
+    def end(self):
+        return self.origin + self.columns * self.bucket
+
+    def needs_rebuild(self, keys, bucket):
+        return tuple(keys) != self.keys or bucket != self.bucket
+
+    def bin(self, series):
+        """Médias por balde de [(timestamps, rssi)], uma linha por série, nas colunas atuais."""
+        rows, columns = len(series), self.columns
+        counts = [len(ts) for ts, _ in series]
+        if not rows or not sum(counts): return np.full((rows, columns), np.nan)
+        ts = np.concatenate([np.asarray(t, dtype=np.float64) for t, _ in series])
+        rs = np.concatenate([np.asarray(r, dtype=np.float64) for _, r in series])
+        row = np.repeat(np.arange(rows), counts)
+        col = np.floor((ts - self.origin) / self.bucket).astype(np.int64)
+        inside = (col >= 0) & (col < columns)
+        flat = row[inside] * columns + col[inside]
+        sums = np.bincount(flat, weights=rs[inside], minlength=rows * columns)
+        hits = np.bincount(flat, minlength=rows * columns)
+        with np.errstate(invalid="ignore"):
+            return (sums / hits).reshape(rows, columns)
+
+    def rebuild(self, keys, series, bucket, now):
+        """Recalcula a matriz inteira (linhas ou largura do balde mudaram)."""
+        self.keys = tuple(keys)
+        self.bucket = bucket
+        self.origin = (math.floor(now / bucket) - self.columns + 1) * bucket
+        self.values = self.bin(series)
+        self.rebuilds += 1
+
+    def advance(self, now):
+        """
+        Desloca a matriz para que a última coluna contenha 'now'. Retorna o
+        instante a partir do qual as colunas precisam ser recalculadas.
+        """
+        refresh_from = self.newest_start
+        shift = math.floor(now / self.bucket) - round(self.newest_start / self.bucket)
+        if shift > 0:
+            values = self.values
+            if shift >= self.columns: values[:] = np.nan
+            else:
+                values[:, :-shift] = values[:, shift:]
+                values[:, -shift:] = np.nan
+            self.origin += shift * self.bucket
+        return max(refresh_from, self.origin)
+
+    def update_tail(self, series, start):
+        """Recalcula as colunas a partir de 'start' com as leituras (desde start) de cada linha."""
+        first = max(0, int(round((start - self.origin) / self.bucket)))
+        self.values[:, first:] = self.bin(series)[:, first:]
+        self.tail_updates += 1
+
+
+class RssiHeatmap:
+    """
+    Mapa de calor do RSSI: a matriz inteira é uma única imagem (imshow), então
+    o custo de desenho não depende do número de dispositivos. Como o RssiPlot,
+    redesenha a figura só quando o layout muda e, nos demais quadros, restaura
+    o fundo e redesenha apenas a imagem (blitting).
+    """
+    def __init__(self, fig, ax, canvas, empty_message, vmin=-100, vmax=-20, cmap="viridis"):
+        self.fig = fig
+        self.ax = ax
+        self.canvas = canvas
+        self.active = False
+        self.layout_key = None
+        self.background = None
+        self.full_redraws = 0
+        self.blits = 0
+
+        self.image = ax.imshow(np.full((1, 1), np.nan), aspect="auto", interpolation="nearest", cmap=cmap,
+                               vmin=vmin, vmax=vmax, animated=True)
+        # Barra de cores num eixo filho, para não tirar espaço dos outros eixos da figura
+        self.colorbar = fig.colorbar(self.image, cax=ax.inset_axes([1.01, 0.0, 0.015, 1.0]), label="RSSI (dBm)")
+        self.placeholder = ax.text(0.5, 0.5, empty_message, horizontalalignment='center', verticalalignment='center',
+                                   transform=ax.transAxes, color='gray')
+        ax.set_visible(False)
+        self.canvas.mpl_connect("draw_event", self._on_draw)
+
+    def _on_draw(self, event):
+        if not self.active: return
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.ax.draw_artist(self.image)
+
+    def set_active(self, active):
+        self.active = active
+        self.ax.set_visible(active)
+        self.layout_key = None
+        self.background = None
+
+    def update(self, values, labels, title, xlabel, ylabel, extent, xlim):
+        """values: matriz linhas × colunas; extent: (x da coluna 0, x do fim da última coluna)."""
+        rows = len(values)
+        self.image.set_visible(rows > 0)
+        if rows: self.image.set_data(values)
+        self.image.set_extent((extent[0], extent[1], max(rows, 1), 0))
+
+        shown = tuple(labels) if rows <= LABEL_LIMIT else rows
+        layout_key = (title, xlabel, ylabel, shown, tuple(xlim))
+        if layout_key != self.layout_key or self.background is None:
+            self.layout_key = layout_key
+            self._relayout(title, xlabel, ylabel, labels, xlim, rows)
+        else:
+            self._blit()
+
+    def _relayout(self, title, xlabel, ylabel, labels, xlim, rows):
+        ax = self.ax
+        ax.set_title(title)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        ax.set_xlim(*xlim)
+        ax.set_ylim(max(rows, 1), 0)
+        if 0 < rows <= LABEL_LIMIT: ax.set_yticks(np.arange(rows) + 0.5, labels, fontsize=7)
+        else: ax.set_yticks([])
+        self.placeholder.set_visible(rows == 0)
+
+        self.fig.tight_layout()
+        self.full_redraws += 1
+        self.canvas.draw()  # Dispara _on_draw, que salva o fundo e desenha a imagem
+
+    def _blit(self):
+        self.canvas.restore_region(self.background)
+        self.ax.draw_artist(self.image)
+        self.canvas.blit(self.fig.bbox)
+        self.blits += 1
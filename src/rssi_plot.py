@@ -0,0 +1,95 @@
+class RssiPlot:
+    """
+    Motor de plotagem do RSSI com artistas persistentes e blitting.
+
+    Mantém uma Line2D por MAC selecionado e apenas atualiza seus dados com
+    set_data. O redesenho completo (títulos, legenda, tight_layout e
+    canvas.draw) só acontece quando o layout muda: seleção, legendas, títulos
+    ou limites dos eixos. Nos demais ticks restaura-se o fundo salvo e
+    redesenham-se somente as linhas.
+    """
+    def __init__(self, fig, ax, canvas, empty_message):
+        self.fig = fig
+        self.ax = ax
+        self.canvas = canvas
+        self.lines = {}
+        self.layout_key = None
+        self.background = None
+        self.full_redraws = 0
+        self.blits = 0
+
+        self.placeholder = ax.text(0.5, 0.5, empty_message, horizontalalignment='center', verticalalignment='center',
+                                   transform=ax.transAxes, color='gray')
+        self.canvas.mpl_connect("draw_event", self._on_draw)
+
+    def _on_draw(self, event):
+        # Cada desenho completo (inclusive redimensionamento) atualiza o fundo salvo
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_lines()
+
+    def _draw_lines(self):
+        for line in self.lines.values():
+            self.ax.draw_artist(line)
+
+    def set_active(self, active):
+        """Mostra ou esconde o eixo das linhas, quando a figura alterna com outra visualização."""
+        self.ax.set_visible(active)
+        if not active:
+            for line in self.lines.values(): line.remove()
+            self.lines.clear()
+        self.layout_key = None
+        self.background = None
+
+    def update(self, series, title, xlabel, ylabel, xlim, ylim=(-100, -20)):
+        """
+        series: lista de (mac, legenda, xs, ys, marcadores) na ordem da legenda.
+        """
+        ax = self.ax
+        wanted = [mac for mac, _, _, _, _ in series]
+
+        for mac in [m for m in self.lines if m not in wanted]:
+            self.lines.pop(mac).remove()
+
+        labels = []
+        for mac, label, xs, ys, markers in series:
+            line = self.lines.get(mac)
+            if line is None:
+                line, = ax.plot([], [], marker='o', markersize=3, animated=True)
+                self.lines[mac] = line
+            line.set_label(label)
+            line.set_marker('o' if markers else '')
+            line.set_data(xs, ys)
+            labels.append((mac, label, markers))
+
+        layout_key = (title, xlabel, ylabel, tuple(labels), tuple(xlim), tuple(ylim))
+        if layout_key != self.layout_key or self.background is None:
+            self.layout_key = layout_key
+            self._relayout(title, xlabel, ylabel, xlim, ylim, has_series=bool(series))
+        else:
+            self._blit()
+
+    def _relayout(self, title, xlabel, ylabel, xlim, ylim, has_series):
+        ax = self.ax
+        ax.set_title(title)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        ax.set_xlim(*xlim)
+        ax.set_ylim(*ylim)
+
+        self.placeholder.set_visible(not has_series)
+        legend = ax.get_legend()
+        if legend is not None: legend.remove()
+        if has_series:
+            # A legenda usa a ordem da seleção, não a ordem de criação das linhas
+            handles = [self.lines[mac] for mac, _, _ in self.layout_key[3]]
+            ax.legend(handles=handles, loc="lower left")
+
+        self.fig.tight_layout() # Previne textos cortados nas bordas do gráfico
+        self.full_redraws += 1
+        self.canvas.draw()  # Dispara _on_draw, que salva o fundo e desenha as linhas
+
+    def _blit(self):
+        self.canvas.restore_region(self.background)
+        self._draw_lines()
+        self.canvas.blit(self.fig.bbox)
+        self.blits += 1
@@ -0,0 +1,199 @@
+"""
+Modo sem interface gráfica (daemon) do Radar BLE, para gateways headless.
+
+Usa apenas o BeaconScanner e o diário de captura: não importa Tkinter nem
+Matplotlib. As leituras dos beacons ativos são gravadas no diário (mesmo
+layout CSV da interface) a cada --sample-interval segundos, e um resumo é
+impresso a cada --summary-interval segundos.
+
+Uso:
+    python scanner_daemon.py
+    python scanner_daemon.py --dir /var/lib/radar_ble --summary-interval 30
+    python scanner_daemon.py --synthetic 500 --duration 60
+    python scanner_daemon.py --replay captura.rble --speed 10   # reproduz uma gravação (replay.py)
+    python scanner_daemon.py --metrics-port 9464 --profile perfil.txt
+    python scanner_daemon.py --stream-port 8765      # anúncios para outros serviços (advert_stream.py)
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import time
+
+from beacon_scanner import BeaconScanner
+from advert_stream import AdvertStreamServer
+from capture_journal import CaptureJournal
+from ingest_gate import IngestGate
+from metrics import MetricsRegistry, MetricsServer, SamplingProfiler, register_journal, register_scanner, register_stream
+from replay import ReplaySource, ReplayTape, parse_speed
+from rssi_filter import METHODS
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".radar_ble", "diario")
+
+
+class ScannerDaemon:
+    """
+    Laço de captura sem interface: amostra os beacons ativos do snapshot,
+    grava no diário e imprime resumos periódicos até stop() ser chamado.
+    """
+    def __init__(self, scanner, journal, sample_interval=1.0, summary_interval=10.0, timeout=3.0, out=sys.stdout):
+        self.scanner = scanner
+        self.stream = scanner.stream
+        self.replay = scanner.scanner if isinstance(scanner.scanner, ReplaySource) else None
+        self.journal = journal
+        self.sample_interval = sample_interval
+        self.summary_interval = summary_interval
+        self.timeout = timeout
+        self.out = out
+        self.samples = 0
+        self._stop = None
+
+    def stop(self):
+        if self._stop is not None: self._stop.set()
+
+    def sample(self):
+        """Grava uma leitura de cada beacon ativo. Retorna o número de leituras."""
+        now = self.scanner.clock()
+        rows = [(now, b["mac"], b["nome"], b["rssi"])
+                for b in self.scanner.get_snapshot().beacons.values() if now - b["last_seen"] <= self.timeout]
+        self.journal.append_many(rows)
+        self.samples += len(rows)
+        return len(rows)
+
+    def summary(self, elapsed):
+        beacons = self.scanner.get_all_beacons(timeout=self.timeout)
+        active = [b for b in beacons if b["is_active"]]
+        strongest = ", ".join(f"{b['nome']} ({b['mac']}) {b['rssi_filtrado']:.0f} dBm" for b in active[:3])
+        print(f"[{time.strftime('%H:%M:%S')}] {len(active)} ativos / {len(beacons)} vistos | "
+              f"{self.scanner.adverts_per_second:.0f} anúncios/s | "
+              f"{self.samples} leituras em {elapsed:.0f}s | diário: {self.journal.rows_written} gravadas, "
+              f"{self.journal.pending()} pendentes | esquecidos: {self.scanner.evicted}, unidos: {self.scanner.coalesced}" +
+              (f" | entrada: {self.scanner.ingest.folded} dobrados, {self.scanner.ingest.duplicates} cópias" if self.scanner.ingest is not None else "") +
+              (f" | stream: {len(self.stream.subscribers)} assinantes, {self.stream.dropped} descartados" if self.stream is not None else "") +
+              (f" | reprodução: {self.replay.progress * 100:.1f}% ({self.replay.adverts_per_second:.0f} leituras/s)" if self.replay is not None else "") +
+              (f" | mais fortes: {strongest}" if strongest else ""),
+              file=self.out, flush=True)
+
+    async def run(self, duration=None):
+        self._stop = asyncio.Event()
+        started = time.monotonic()
+        next_summary = started + self.summary_interval
+        if self.stream is not None: await self.stream.start()
+        await self.scanner.start()
+        try:
+            while not self._stop.is_set():
+                try:
+                    await asyncio.wait_for(self._stop.wait(), self.sample_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.sample()
+                now = time.monotonic()
+                if duration is not None and now - started >= duration: break
+                if self.replay is not None and self.replay.finished: break
+                if now >= next_summary:
+                    self.summary(now - started)
+                    next_summary = now + self.summary_interval
+        finally:
+            await self.scanner.stop()
+            if self.stream is not None: await self.stream.stop()
+        self.summary(time.monotonic() - started)
+
+
+def build_scanner(args, spill=None, stream=None):
+    if args.synthetic:
+        from functools import partial
+        from synthetic_source import SyntheticAdvertSource
+        factory = partial(SyntheticAdvertSource, num_devices=args.synthetic, adverts_per_second=args.synthetic * 10)
+    elif args.replay:
+        from functools import partial
+        factory = partial(ReplaySource, tape=ReplayTape.load(args.replay), speed=args.speed)
+    else:
+        factory = None
+    ingest = IngestGate(args.max_rate or None, args.duplicate_window) if args.max_rate or args.duplicate_window else None
+    return BeaconScanner(source_factory=factory, history_capacity=args.history, filter_method=args.filter,
+                         idle_ttl=args.ttl or None, max_devices=args.max_devices or None, spill=spill,
+                         coalesce=args.coalesce, coalesce_gap=args.coalesce_gap, active_timeout=args.timeout,
+                         stream=stream, ingest=ingest)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Radar BLE sem interface gráfica: captura contínua para o diário em disco")
+    parser.add_argument("--dir", default=DEFAULT_DIR, help="Diretório do diário de captura")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="Segundos entre leituras gravadas de cada beacon ativo")
+    parser.add_argument("--summary-interval", type=float, default=10.0, help="Segundos entre os resumos impressos")
+    parser.add_argument("--timeout", type=float, default=3.0, help="Segundos sem anúncio para considerar um beacon offline")
+    parser.add_argument("--duration", type=float, default=None, help="Encerra após N segundos (padrão: até Ctrl+C / SIGTERM)")
+    parser.add_argument("--history", type=int, default=256, help="Amostras de RSSI mantidas em memória por dispositivo")
+    parser.add_argument("--filter", default="ema", choices=METHODS, help="Filtro de RSSI usado no resumo")
+    parser.add_argument("--max-segment-mb", type=float, default=64, help="Tamanho máximo de cada segmento do diário (MB)")
+    parser.add_argument("--max-total-mb", type=float, default=1024, help="Espaço máximo ocupado pelo diário (MB)")
+    parser.add_argument("--ttl", type=float, default=900, help="Esquece dispositivos calados há N segundos (0 desativa)")
+    parser.add_argument("--max-devices", type=int, default=5000, help="Máximo de dispositivos em memória (0 = sem limite)")
+    parser.add_argument("--coalesce", action="store_true", help="Une endereços MAC rotativos com o mesmo payload num só dispositivo")
+    parser.add_argument("--coalesce-gap", type=float, default=None, metavar="S",
+                        help="Com --coalesce, só une se o dispositivo anterior está calado há S segundos (padrão: --timeout)")
+    parser.add_argument("--max-rate", type=float, default=0, metavar="HZ",
+                        help="Processa no máximo HZ anúncios por segundo de cada MAC; o excesso é dobrado num agregado (0 = sem limite)")
+    parser.add_argument("--duplicate-window", type=float, default=0, metavar="S",
+                        help="Descarta cópias exatas de um anúncio (mesmo RSSI e payload) recebidas em menos de S segundos")
+    parser.add_argument("--synthetic", type=int, default=0, metavar="N", help="Usa N dispositivos sintéticos em vez do rádio (testes)")
+    parser.add_argument("--replay", default=None, metavar="ARQUIVO", help="Reproduz uma gravação (.rble ou CSV) em vez do rádio; encerra no fim")
+    parser.add_argument("--speed", type=parse_speed, default=1.0, help="Velocidade da reprodução: fator (1, 10, ...) ou max")
+    parser.add_argument("--metrics-port", type=int, default=None, metavar="PORTA", help="Expõe as métricas em http://127.0.0.1:PORTA/metrics")
+    parser.add_argument("--stream-port", type=int, default=None, metavar="PORTA", help="Transmite os anúncios em tcp://127.0.0.1:PORTA (ver advert_stream.py)")
+    parser.add_argument("--stream-host", default="127.0.0.1", help="Endereço de escuta do stream (0.0.0.0 para a rede local)")
+    parser.add_argument("--stream-unix", default=None, metavar="CAMINHO", help="Transmite os anúncios num socket Unix")
+    parser.add_argument("--profile", default=None, metavar="ARQUIVO", help="Liga o profiler por amostragem e grava as pilhas (collapsed) no ARQUIVO ao encerrar")
+    args = parser.parse_args(argv)
+
+    journal = CaptureJournal(args.dir, max_bytes=int(args.max_segment_mb * 1024 * 1024),
+                             max_total_bytes=int(args.max_total_mb * 1024 * 1024))
+    if journal.recovered: print(f"{len(journal.recovered)} segmento(s) de uma sessão anterior recuperados.")
+    # Anúncios dos dispositivos esquecidos (TTL/limite) vão para segmentos próprios
+    spill = CaptureJournal(args.dir, max_bytes=journal.max_bytes, max_total_bytes=journal.max_total_bytes, prefix="esquecidos")
+    stream = None
+    if args.stream_port is not None or args.stream_unix:
+        stream = AdvertStreamServer(args.stream_port or 0, args.stream_host, args.stream_unix)
+    daemon = ScannerDaemon(build_scanner(args, spill, stream), journal, args.sample_interval, args.summary_interval, args.timeout)
+
+    registry = MetricsRegistry()
+    register_scanner(registry, daemon.scanner)
+    register_journal(registry, journal)
+    register_journal(registry, spill)
+    if stream is not None: register_stream(registry, stream)
+    profiler = SamplingProfiler()
+    server = MetricsServer(registry, args.metrics_port, profiler=profiler) if args.metrics_port is not None else None
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try: loop.add_signal_handler(sig, daemon.stop)
+            except (NotImplementedError, RuntimeError): pass # Windows: Ctrl+C cai no KeyboardInterrupt
+        await daemon.run(args.duration)
+
+    journal.start()
+    spill.start()
+    if server is not None:
+        server.start()
+        print(f"Métricas em http://{server.host}:{server.port}/metrics", flush=True)
+    if args.profile: profiler.start()
+    print(f"Capturando em {args.dir} (Ctrl+C para encerrar)", flush=True)
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        journal.stop()
+        spill.stop()
+        if server is not None: server.stop()
+        profiler.stop()
+        if args.profile:
+            with open(args.profile, "w", encoding="utf-8") as f: f.write(profiler.collapsed())
+            print(f"Perfil ({profiler.samples} amostras) gravado em {args.profile}")
+    print(f"Encerrado. {journal.rows_written} leituras gravadas em {len(journal.segments)} segmento(s).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+import asyncio
+import math
+import random
+import struct
+import time
+import uuid
+
+
+# UUID de proximidade dos iBeacons simulados (major/minor identificam o dispositivo)
+SYNTHETIC_UUID = uuid.UUID("5f2d6b1e-8a4c-4b0e-9f6a-2c1d3e4f5a6b")
+
+
+class SyntheticDevice:
+    """Equivalente mínimo do BLEDevice do bleak (apenas o que o scanner usa)."""
+    __slots__ = ("address", "name")
+
+    def __init__(self, address, name):
+        self.address = address
+        self.name = name
+
+
+class SyntheticAdvertisementData:
+    """Equivalente mínimo do AdvertisementData do bleak."""
+    __slots__ = ("local_name", "rssi", "manufacturer_data", "service_data", "tx_power")
+
+    def __init__(self, local_name, rssi, manufacturer_data, service_data=None, tx_power=None):
+        self.local_name = local_name
+        self.rssi = rssi
+        self.manufacturer_data = manufacturer_data
+        self.service_data = service_data if service_data is not None else {}
+        self.tx_power = tx_power
+
+
+class _Slot:
+    """Estado interno de um dispositivo simulado."""
+    __slots__ = ("index", "device", "base_rssi", "rssi", "phase", "rotate_at", "manufacturer_data")
+
+
+def random_mac(rng, private=False):
+    """Gera um endereço MAC aleatório. Com private=True gera um endereço privado resolvível."""
+    octets = [rng.randrange(256) for _ in range(6)]
+    if private:
+        octets[0] = (octets[0] & 0x3F) | 0x40
+    return ":".join(f"{o:02X}" for o in octets)
+
+
+class SyntheticAdvertSource:
+    """
+    Fonte de anúncios BLE sintéticos com a mesma interface do BleakScanner
+    (detection_callback, start() e stop() assíncronos).
+
+    Permite testar o BeaconScanner e a BeaconApp sem rádio, com milhares de
+    dispositivos, padrões de RSSI configuráveis, rotatividade de dispositivos
+    (churn) e rotação de endereços MAC.
+
+    rssi_pattern: "constant", "random_walk", "sine", "noise" ou uma função
+    f(indice_do_dispositivo, t) -> rssi.
+    churn_rate: fração dos dispositivos substituída por segundo.
+    mac_rotation_interval: segundos até cada dispositivo trocar de MAC (None desativa).
+    ibeacon_fraction: fração dos dispositivos que anunciam um payload iBeacon.
+    """
+    PATTERNS = ("constant", "random_walk", "sine", "noise")
+
+    def __init__(self, detection_callback=None, num_devices=1000, adverts_per_second=20000,
+                 rssi_pattern="random_walk", churn_rate=0.0, mac_rotation_interval=None,
+                 named_fraction=0.5, tick=0.01, seed=None, ibeacon_fraction=0.0):
+        if not callable(rssi_pattern) and rssi_pattern not in self.PATTERNS:
+            raise ValueError(f"Padrão de RSSI desconhecido: {rssi_pattern}")
+
+        self.detection_callback = detection_callback
+        self.num_devices = num_devices
+        self.adverts_per_second = adverts_per_second
+        self.rssi_pattern = rssi_pattern
+        self.churn_rate = churn_rate
+        self.mac_rotation_interval = mac_rotation_interval
+        self.named_fraction = named_fraction
+        self.ibeacon_fraction = ibeacon_fraction
+        self.tick = tick
+
+        self.rng = random.Random(seed)
+        self.sim_time = 0.0
+        self.adverts_sent = 0
+        self._next_index = 0
+        self._cursor = 0
+        self._churn_acc = 0.0
+        self._task = None
+        self.slots = [self._new_slot() for _ in range(num_devices)]
+
+    def _new_slot(self):
+        rng = self.rng
+        slot = _Slot()
+        slot.index = self._next_index
+        self._next_index += 1
+
+        name = f"Beacon-{slot.index:05d}" if rng.random() < self.named_fraction else None
+        slot.device = SyntheticDevice(random_mac(rng, private=self.mac_rotation_interval is not None), name)
+        slot.base_rssi = rng.randint(-95, -35)
+        slot.rssi = slot.base_rssi
+        slot.phase = rng.uniform(0, 2 * math.pi)
+        slot.rotate_at = self._next_rotation()
+        # 0xFFFF é o company ID reservado para testes; o payload acompanha o
+        # dispositivo mesmo após a rotação do MAC.
+        if self.ibeacon_fraction and rng.random() < self.ibeacon_fraction:
+            payload = b"\x02\x15" + SYNTHETIC_UUID.bytes + struct.pack(">HHb", slot.index >> 16, slot.index & 0xFFFF, -59)
+            slot.manufacturer_data = {0x004C: payload}
+        else:
+            slot.manufacturer_data = {0xFFFF: slot.index.to_bytes(4, "little")}
+        return slot
+
+    def _next_rotation(self):
+        if self.mac_rotation_interval is None: return math.inf
+        return self.sim_time + self.rng.uniform(0.5, 1.5) * self.mac_rotation_interval
+
+    def _next_rssi(self, slot, t):
+        pattern = self.rssi_pattern
+        if pattern == "random_walk":
+            rssi = slot.rssi + self.rng.randint(-2, 2)
+            rssi = min(max(rssi, slot.base_rssi - 15), slot.base_rssi + 15)
+        elif pattern == "sine":
+            rssi = slot.base_rssi + 10 * math.sin(0.5 * t + slot.phase)
+        elif pattern == "noise":
+            rssi = slot.base_rssi + self.rng.gauss(0, 4)
+        elif pattern == "constant":
+            rssi = slot.base_rssi
+        else:
+            rssi = pattern(slot.index, t)
+        rssi = int(min(max(rssi, -127), 0))
+        slot.rssi = rssi
+        return rssi
+
+    def _apply_churn(self, dt):
+        if not self.churn_rate or not self.slots: return
+        self._churn_acc += self.churn_rate * len(self.slots) * dt
+        while self._churn_acc >= 1.0:
+            self._churn_acc -= 1.0
+            self.slots[self.rng.randrange(len(self.slots))] = self._new_slot()
+
+    def generate(self, count):
+        """
+        Gera 'count' pares (device, advertisement_data) de forma síncrona,
+        avançando o relógio simulado conforme adverts_per_second.
+        Útil para benchmarks que chamam o callback diretamente.
+        """
+        slots = self.slots
+        n = len(slots)
+        dt = 1.0 / self.adverts_per_second
+        rotation = self.mac_rotation_interval is not None
+
+        for _ in range(count):
+            self.sim_time += dt
+            self._apply_churn(dt)
+
+            slot = slots[self._cursor]
+            self._cursor = (self._cursor + 1) % n
+
+            if rotation and self.sim_time >= slot.rotate_at:
+                slot.device = SyntheticDevice(random_mac(self.rng, private=True), slot.device.name)
+                slot.rotate_at = self._next_rotation()
+
+            device = slot.device
+            rssi = self._next_rssi(slot, self.sim_time)
+            self.adverts_sent += 1
+            yield device, SyntheticAdvertisementData(device.name, rssi, slot.manufacturer_data)
+
+    async def _run(self):
+        last = time.perf_counter()
+        pending = 0.0
+        while True:
+            await asyncio.sleep(self.tick)
+            now = time.perf_counter()
+            pending += (now - last) * self.adverts_per_second
+            last = now
+
+            count = int(pending)
+            pending -= count
+            callback = self.detection_callback
+            for device, adv in self.generate(count):
+                callback(device, adv)
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
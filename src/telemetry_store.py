@@ -0,0 +1,347 @@
+import csv
+import operator
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+
+# Bytes por leitura: timestamp float64 + id do dispositivo uint32 + RSSI int8
+BYTES_PER_READING = 13
+
+# Formato da coluna Timestamp nos arquivos CSV
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+CSV_HEADER = ["Timestamp", "MAC", "Nome", "RSSI"]
+# A exportação acrescenta o RSSI suavizado (e campos por MAC); a importação ignora essas colunas
+FILTERED_HEADER = "RSSI Filtrado"
+
+
+@lru_cache(maxsize=4096)
+def _format_second(second):
+    return datetime.fromtimestamp(second).strftime(TIMESTAMP_FORMAT)
+
+
+def format_timestamp(timestamp):
+    """Converte um timestamp epoch no texto usado no CSV (resolução de segundos)."""
+    return _format_second(int(timestamp))
+
+
+@lru_cache(maxsize=4096)
+def parse_timestamp(text):
+    """Converte o texto de Timestamp do CSV em epoch. Leituras do mesmo segundo reaproveitam o cache."""
+    return datetime.strptime(text, TIMESTAMP_FORMAT).timestamp()
+
+
+class _Chunk:
+    """Bloco de colunas de tamanho fixo do TelemetryStore."""
+    __slots__ = ("timestamps", "devices", "rssi", "sorted")
+
+    def __init__(self):
+        self.timestamps = array("d")
+        self.devices = array("I")
+        self.rssi = array("b")
+        self.sorted = True   # Timestamps em ordem não decrescente dentro do bloco
+
+
+class TelemetryStore:
+    """
+    Armazenamento colunar das leituras de telemetria (timestamp, MAC, nome, RSSI).
+
+    Cada leitura ocupa 13 bytes: timestamp epoch (float64), id do dispositivo
+    (uint32) e RSSI (int8). Os pares (MAC, nome) são internados numa tabela de
+    dispositivos, e as colunas são guardadas em blocos de 'chunk_size' leituras
+    para crescer sem realocar o histórico inteiro.
+    """
+    def __init__(self, chunk_size=65536):
+        self.chunk_size = chunk_size
+        self.macs = []        # id -> MAC
+        self.names = []       # id -> nome
+        self._ids = {}        # (MAC, nome) -> id
+        self._mac_ids = {}    # MAC -> [ids]
+        self._chunks = []
+        self._count = 0
+        self._series_cache = {}
+
+    def __len__(self):
+        return self._count
+
+    def __bool__(self):
+        return self._count > 0
+
+    def intern(self, mac, nome):
+        """Retorna o id do dispositivo (MAC, nome), criando-o se necessário."""
+        key = (mac, nome)
+        device_id = self._ids.get(key)
+        if device_id is None:
+            device_id = self._ids[key] = len(self.macs)
+            self.macs.append(mac)
+            self.names.append(nome)
+            self._mac_ids.setdefault(mac, []).append(device_id)
+        return device_id
+
+    def _writable_chunk(self):
+        if not self._chunks or len(self._chunks[-1].timestamps) >= self.chunk_size:
+            self._chunks.append(_Chunk())
+        return self._chunks[-1]
+
+    def append_id(self, timestamp, device_id, rssi):
+        chunk = self._writable_chunk()
+        ts = chunk.timestamps
+        if ts and timestamp < ts[-1]: chunk.sorted = False
+        ts.append(timestamp)
+        chunk.devices.append(device_id)
+        chunk.rssi.append(-128 if rssi < -128 else (127 if rssi > 127 else rssi))
+        self._count += 1
+
+    def append(self, timestamp, mac, nome, rssi):
+        self.append_id(timestamp, self.intern(mac, nome), rssi)
+
+    def extend(self, timestamps, device_ids, rssi, is_sorted=False):
+        """
+        Acrescenta colunas inteiras de uma vez (ids já internados, RSSI já em int8).
+        is_sorted indica que os timestamps recebidos estão em ordem não decrescente.
+        """
+        n = len(timestamps)
+        pos = 0
+        while pos < n:
+            chunk = self._writable_chunk()
+            take = min(n - pos, self.chunk_size - len(chunk.timestamps))
+            ts = timestamps[pos:pos + take]
+            if not is_sorted or (chunk.timestamps and ts[0] < chunk.timestamps[-1]): chunk.sorted = False
+            chunk.timestamps.extend(ts)
+            chunk.devices.extend(device_ids[pos:pos + take])
+            chunk.rssi.extend(rssi[pos:pos + take])
+            pos += take
+        self._count += n
+
+    def _chunk_ranges(self, t0, t1):
+        """Gera (bloco, início, fim) com as posições cujo timestamp está em [t0, t1)."""
+        for chunk in self._chunks:
+            ts = chunk.timestamps
+            if not ts: continue
+            if chunk.sorted:
+                if ts[-1] < t0 or ts[0] >= t1: continue
+                start = 0 if ts[0] >= t0 else bisect_left(ts, t0)
+                stop = len(ts) if ts[-1] < t1 else bisect_left(ts, t1)
+                yield chunk, start, stop
+            else:
+                for i, t in enumerate(ts):
+                    if t0 <= t < t1: yield chunk, i, i + 1
+
+    def slice_by_time(self, t0=float("-inf"), t1=float("inf")):
+        """Retorna as colunas (timestamps, ids, rssi) das leituras com t0 <= timestamp < t1."""
+        timestamps, devices, rssi = array("d"), array("I"), array("b")
+        for chunk, start, stop in self._chunk_ranges(t0, t1):
+            timestamps += chunk.timestamps[start:stop]
+            devices += chunk.devices[start:stop]
+            rssi += chunk.rssi[start:stop]
+        return timestamps, devices, rssi
+
+    def iter_rows(self, t0=float("-inf"), t1=float("inf")):
+        """Itera as leituras como tuplas (timestamp, MAC, nome, RSSI)."""
+        macs, names = self.macs, self.names
+        for chunk, start, stop in self._chunk_ranges(t0, t1):
+            ts, devs, rs = chunk.timestamps, chunk.devices, chunk.rssi
+            for i in range(start, stop):
+                d = devs[i]
+                yield ts[i], macs[d], names[d], rs[i]
+
+    def device_series(self, mac):
+        """
+        Retorna (timestamps, rssi) de todas as leituras de um MAC. O resultado
+        fica em cache até que novas leituras sejam adicionadas.
+        """
+        cached = self._series_cache.get(mac)
+        if cached is not None and cached[0] == self._count: return cached[1]
+
+        ids = set(self._mac_ids.get(mac, ()))
+        timestamps, rssi = array("d"), array("b")
+        if ids:
+            for chunk in self._chunks:
+                ts, devs, rs = chunk.timestamps, chunk.devices, chunk.rssi
+                for i, d in enumerate(devs):
+                    if d in ids:
+                        timestamps.append(ts[i])
+                        rssi.append(rs[i])
+        self._series_cache[mac] = (self._count, (timestamps, rssi))
+        return timestamps, rssi
+
+    def group_by_device(self):
+        """
+        Retorna {id do dispositivo: (timestamps, rssi)} com as leituras de cada
+        dispositivo em ordem de inserção. O agrupamento usa uma ordenação estável
+        dos índices de cada bloco, sem laço Python por leitura.
+        """
+        groups = {}
+        for chunk in self._chunks:
+            devs = chunk.devices
+            n = len(devs)
+            if not n: continue
+            order = sorted(range(n), key=devs.__getitem__)
+            pick = operator.itemgetter(*order)
+            ts, rs, ds = pick(chunk.timestamps), pick(chunk.rssi), pick(devs)
+            if n == 1: ts, rs, ds = (ts,), (rs,), (ds,)
+
+            pos = 0
+            while pos < n:
+                device_id = ds[pos]
+                end = pos + 1
+                # Avança até o fim do grupo com busca exponencial + binária
+                step = 1
+                while end + step <= n and ds[end + step - 1] == device_id: end += step; step *= 2
+                lo, hi = end, min(n, end + step)
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if ds[mid] == device_id: lo = mid + 1
+                    else: hi = mid
+                end = lo
+
+                group = groups.get(device_id)
+                if group is None: group = groups[device_id] = (array("d"), array("b"))
+                group[0].extend(ts[pos:end])
+                group[1].extend(rs[pos:end])
+                pos = end
+        return groups
+
+    def memory_bytes(self):
+        return sum(c.timestamps.buffer_info()[1] * 8 + c.devices.buffer_info()[1] * 4 + c.rssi.buffer_info()[1]
+                   for c in self._chunks)
+
+    def copy(self):
+        """Cópia independente (colunas copiadas em bloco), para gravar em outra thread enquanto a captura continua."""
+        other = TelemetryStore(self.chunk_size)
+        other.macs = list(self.macs)
+        other.names = list(self.names)
+        other._ids = dict(self._ids)
+        other._mac_ids = {mac: list(ids) for mac, ids in self._mac_ids.items()}
+        for chunk in self._chunks:
+            copy = _Chunk()
+            copy.timestamps = array("d", chunk.timestamps)
+            copy.devices = array("I", chunk.devices)
+            copy.rssi = array("b", chunk.rssi)
+            copy.sorted = chunk.sorted
+            other._chunks.append(copy)
+        other._count = self._count
+        return other
+
+    def clear(self):
+        self.macs.clear()
+        self.names.clear()
+        self._ids.clear()
+        self._mac_ids.clear()
+        self._chunks.clear()
+        self._series_cache.clear()
+        self._count = 0
+
+
+def write_csv(filepath, store, filtered=None, extra_header=(), extra_by_mac=None, progress=None, block_rows=65536):
+    """
+    Exporta o store como CSV, na ordem de inserção. 'filtered' (opcional) é a
+    coluna de RSSI filtrado alinhada com store.slice_by_time(); extra_by_mac
+    mapeia MAC -> valores das colunas extra_header. As linhas são gravadas em
+    blocos de block_rows, com progress(linhas gravadas) após cada bloco.
+    Retorna o nº de linhas.
+    """
+    ts, devs, rs = store.slice_by_time()
+    macs, names = store.macs, store.names
+    header = list(CSV_HEADER)
+    columns = [map(format_timestamp, ts), (macs[d] for d in devs), (names[d] for d in devs), rs]
+    if filtered is not None:
+        header.append(FILTERED_HEADER)
+        columns.append(f"{v:.1f}" for v in filtered.tolist())
+    rows = zip(*columns)
+    if extra_header:
+        header.extend(extra_header)
+        blank = ("",) * len(extra_header)
+        extras = [tuple(extra_by_mac.get(mac, blank)) for mac in macs]  # Por id de dispositivo
+        rows = (row + extras[d] for row, d in zip(rows, devs))
+
+    with open(filepath, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter=",")
+        writer.writerow(header)
+        done = 0
+        while done < len(ts):
+            count = min(block_rows, len(ts) - done)
+            writer.writerows(islice(rows, count))
+            done += count
+            if progress is not None: progress(done)
+    return len(ts)
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class StoreExporter:
+    """
+    Exporta um TelemetryStore numa thread, no molde do CsvImporter: start(),
+    progress (0.0 a 1.0), done, cancel(), e o nº de leituras gravadas em
+    self.total (ou a exceção em self.error). O store deve ser uma cópia
+    (TelemetryStore.copy()), já que a captura continua durante a gravação.
+
+    Arquivos .rble vão pelo write_recording; o CSV leva a coluna de RSSI
+    filtrado de filter_bank (calculada na própria thread) e as colunas
+    extra_header com os valores de extra_by_mac. Um arquivo cancelado ou com
+    erro é apagado.
+    """
+    def __init__(self, filepath, store, filter_bank=None, extra_header=(), extra_by_mac=None):
+        self.filepath = filepath
+        self.store = store
+        self.filter_bank = filter_bank
+        self.extra_header = extra_header
+        self.extra_by_mac = extra_by_mac
+        self.rows_done = 0
+        self.total = None
+        self.error = None
+        self._cancel = threading.Event()
+        self._thread = None
+
+    @property
+    def progress(self):
+        if not self.store: return 1.0
+        return self.rows_done / len(self.store)
+
+    @property
+    def done(self):
+        return self._thread is not None and not self._thread.is_alive()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run_safe, name="store-export", daemon=True)
+        self._thread.start()
+
+    def _run_safe(self):
+        try:
+            self.total = self.run()
+        except ExportCancelled:
+            self._discard()
+        except Exception as e:
+            self.error = e
+            self._discard()
+
+    def _discard(self):
+        try: os.remove(self.filepath)
+        except OSError: pass
+
+    def _progress(self, rows):
+        self.rows_done = rows
+        if self._cancel.is_set(): raise ExportCancelled()
+
+    def run(self):
+        """Executa a exportação de forma síncrona e retorna o nº de leituras gravadas."""
+        if self.filepath.lower().endswith(".rble"):
+            from recording import write_recording
+            total = write_recording(self.filepath, self.store)
+            self.rows_done = total
+            return total
+        filtered = self.filter_bank.filter_store(self.store) if self.filter_bank is not None else None
+        self._progress(0)
+        return write_csv(self.filepath, self.store, filtered, self.extra_header, self.extra_by_mac, self._progress)